@@ -35,9 +35,25 @@
 # 2018-03-21 jw, v1.7d Added handleViewBox() to load().
 #                      Added traverse().
 # 2019-01-12 jw, v1.7e debug output to self.tty
+# 2026-10-17     v1.8  Added FlattenCache, a persistent cache for getPathVertices().
+#                      getPathVertices() flattens in local coordinates, memoized per run.
+#                      Added getIdIndex(), used for <use> and getElementsByIds().
+#                      getNodeStyle() results and parsed style strings are cached.
+#                      Added classifyStrokeColors(), matchColor(), getStrokeColor().
+#                      Added accept and clip, to skip elements before flattening.
+#                      Added flattenCubicPath(), flattenCubicPathNumpy(), used instead of
+#                      subdivideCubicPath().
+#                      Circles, ellipses, arcs and rounded rects are flattened directly,
+#                      by arcVertices() and getShapeVertices().
+#                      Added objLine(), objPolyline() to PathGenerator. LinearPathGen
+#                      emits rects, lines, polylines and polygons without path data.
 
 import gettext
+import hashlib
+import math
+import os
 import re
+import struct
 import sys
 
 sys_platform = sys.platform.lower()
@@ -58,6 +74,11 @@ import bezmisc
 
 from lxml import etree
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class PathGenerator():
     """
     A PathGenerator has methods for different svg objects. It compiles an
@@ -90,6 +111,40 @@ class PathGenerator():
     def objRect(x, y, w, h, node, mat):
         raise NotImplementedError("See example inksvg.LinearPathGen.objRect()")
 
+    def objLine(self, x1, y1, x2, y2, node, mat):
+        """
+        Convert
+
+          <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
+
+        to
+
+          <path d="MX1,Y1 LX2,Y2"/>
+        """
+        a = []
+        a.append(['M ', [x1, y1]])
+        a.append([' L ', [x2, y2]])
+        self.pathList(a, node, mat)
+
+    def objPolyline(self, points, closed, node, mat):
+        """
+        Convert
+
+          <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
+
+        to
+
+          <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
+
+        points is the points attribute. With closed=True, for a <polygon>,
+        a Z is added.
+        """
+        pa = points.split()
+        d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
+        if closed:
+            d += " Z"
+        self.pathString(d, node, mat)
+
     def objRoundedRect(self, x, y, w, h, rx, ry, node, mat):
         raise NotImplementedError("See example inksvg.LinearPathGen.objRoundedRect()")
 
@@ -111,6 +166,10 @@ class PathGenerator():
 
 class LinearPathGen(PathGenerator):
 
+    # "x,y" with numbers as understood by simplepath.
+    point_re = re.compile(r'^([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?),'
+                          r'([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)$')
+
     def __init__(self, smoothness=0.2):
         self.smoothness = max(0.0001, smoothness)
 
@@ -139,7 +198,20 @@ class LinearPathGen(PathGenerator):
 
         I.e., explicitly draw three sides of the rectangle and the
         fourth side implicitly
+
+        Without a stroke-dasharray, the vertices are computed directly.
+        They are the same, as all numbers go through str() like in
+        simplepath.formatPath(), and the relative moves are added up like
+        in simplepath.parsePath(). The Z returns to the exact start point.
         """
+        if not self._svg.hasDasharray(node):
+            (x, y, w, h, mw) = [float(str(v)) for v in (x, y, w, h, -w)]
+            p1 = [x + w, y + 0.0]
+            p2 = [p1[0] + 0.0, p1[1] + h]
+            p3 = [p2[0] + mw, p2[1] + 0.0]
+            self._svg.getShapeVertices([[[x, y], p1, p2, p3, [x, y]]], node, mat)
+            return
+
         a = []
         a.append(['M ', [x, y]])
         a.append([' l ', [w, 0]])
@@ -148,10 +220,70 @@ class LinearPathGen(PathGenerator):
         a.append([' Z', []])
         self.pathList(a, node, mat)
 
+    def flatness(self, mat):
+        """
+        The smoothness, in the coordinates of an object drawn with transform mat.
+        """
+        scale = self._svg.transformScale(mat)
+        if scale > 0.0:
+            return self.smoothness / scale
+        return self.smoothness
+
+    def objLine(self, x1, y1, x2, y2, node, mat):
+        """
+        Without a stroke-dasharray, the two vertices are used directly,
+        with the numbers going through str() as in PathGenerator.objLine().
+        """
+        if self._svg.hasDasharray(node):
+            return PathGenerator.objLine(self, x1, y1, x2, y2, node, mat)
+        v = [[float(str(x1)), float(str(y1))], [float(str(x2)), float(str(y2))]]
+        self._svg.getShapeVertices([v], node, mat)
+
+    def objPolyline(self, points, closed, node, mat):
+        """
+        Without a stroke-dasharray, and with all points written as "x,y",
+        the points are used as vertices directly. A closed polyline ends
+        with its first point, as after a Z. Other notations go through
+        PathGenerator.objPolyline(), so that simplepath sees them as before.
+        """
+        if self._svg.hasDasharray(node):
+            return PathGenerator.objPolyline(self, points, closed, node, mat)
+        v = []
+        for p in points.split():
+            m = self.point_re.match(p)
+            if m is None:
+                return PathGenerator.objPolyline(self, points, closed, node, mat)
+            v.append([float(m.group(1)), float(m.group(2))])
+        if closed:
+            v.append(v[0][:])
+        self._svg.getShapeVertices([v], node, mat)
+
     def objRoundedRect(self, x, y, w, h, rx, ry, node, mat):
-        print("calling roundedRectBezier", file=self.tty)
-        d = self._svg.roundedRectBezier(x, y, w, h, rx, ry)
-        self._svg.getPathVertices(d, node, mat, self.smoothness)
+        """
+        The corners are flattened directly as quarter ellipses, clockwise
+        from the top left, as in InkSvg.roundedRectBezier().
+        A dashed outline is done through roundedRectBezier().
+        """
+        if self._svg.hasDasharray(node):
+            print("calling roundedRectBezier", file=self._svg.tty)
+            d = self._svg.roundedRectBezier(x, y, w, h, rx, ry)
+            self._svg.getPathVertices(d, node, mat, self.smoothness)
+            return
+
+        if rx < 0: rx = 0
+        if rx > 0.5*w: rx = 0.5*w
+        if ry < 0: ry = 0
+        if ry > 0.5*h: ry = 0.5*h
+        if ry < 0.0000001: ry = rx
+        flat = self.flatness(mat)
+        q = 0.5 * math.pi
+        v = [[x+rx, y]]
+        v += self._svg.arcVertices(x+w-rx, y+ry,   rx, ry, -q,  0,   flat)   # top right
+        v += self._svg.arcVertices(x+w-rx, y+h-ry, rx, ry,  0,  q,   flat)   # bottom right
+        v += self._svg.arcVertices(x+rx,   y+h-ry, rx, ry,  q,  2*q, flat)   # bottom left
+        v += self._svg.arcVertices(x+rx,   y+ry,   rx, ry,  2*q, 3*q, flat)[:-1]   # top left
+        v.append(v[0])
+        self._svg.getShapeVertices([v], node, mat)
 
     def objEllipse(self, cx, cy, rx, ry, node, mat):
         """
@@ -171,7 +303,16 @@ class LinearPathGen(PathGenerator):
 
         Note: ellipses or circles with a radius attribute of value 0
         are ignored
+
+        Without a stroke-dasharray, the same vertices are computed directly,
+        see InkSvg.arcVertices(), starting at X1,CY.
         """
+        if not self._svg.hasDasharray(node):
+            v = self._svg.arcVertices(cx, cy, rx, ry, math.pi, -math.pi, self.flatness(mat))
+            v[-1] = v[0]
+            self._svg.getShapeVertices([v], node, mat)
+            return
+
         x1 = cx - rx
         x2 = cx + rx
         d = 'M %f,%f '     % (x1, cy) + \
@@ -183,13 +324,159 @@ class LinearPathGen(PathGenerator):
 
     def objArc(self, d, cx, cy, rx, ry, st, en, cl, node, mat):
         """
-        We ignore the cx, cy, rx, ry data, and are happy that inkscape
-        also provides the same information as a path.
+        The arc runs from angle st to en, a full ellipse if they are equal.
+        If closed, it is a slice through the center, or a chord with
+        sodipodi:arc-type="chord".
+
+        A dashed arc or one without radius is done with the path d, which
+        inkscape provides with the same information.
         """
-        self.pathString(d, node, mat)
+        if rx <= 0 or ry <= 0 or self._svg.hasDasharray(node):
+            self.pathString(d, node, mat)
+            return
+
+        while en <= st:
+            en += 2 * math.pi
+        en = min(en, st + 2 * math.pi)
+        v = self._svg.arcVertices(cx, cy, rx, ry, st, en, self.flatness(mat))
+        if en - st >= 2 * math.pi - 1e-9:
+            v[-1] = v[0]
+        elif cl:
+            if node.get(inkex.addNS('arc-type', 'sodipodi'), 'slice') != 'chord':
+                v.append([cx, cy])
+            v.append(v[0])
+        self._svg.getShapeVertices([v], node, mat)
 
 
 
+class FlattenCache():
+    """
+    Persistent cache for InkSvg.getPathVertices(). The flattened subpaths
+    of a path are stored under a hash of everything that determines them:
+    the path data, the dash style, the composed transform and the smoothness.
+    Unchanged nodes are then not parsed and subdivided again, when the
+    document is exported the next time.
+
+    The cache is a single binary file. It is loaded at construction and
+    written by save(). Each entry holds a 20 byte key, the save() generation
+    it was last used in, and the subpaths as a count, and per subpath a
+    vertex count, a bounding box and the vertices as little endian doubles.
+    Entries used in the current run are always written. Older entries are
+    kept, most recently used first, as long as the file stays within maxsize bytes.
+    """
+    # Version of the flattening done by getPathVertices(). Bump it, whenever
+    # that output changes, so that old cache files are not used.
+    # 1: subdivideCubicPath() in document coordinates.
+    # 2: flattenPath() in local coordinates, with the tolerance scaled.
+    # 3: the tolerance is not rounded for unscaled paths.
+    VERSION = 3
+    MAGIC = b'inksvg-flatten-%d\n' % VERSION
+
+    def __init__(self, filename=None, maxsize=256<<20):
+        if filename is None:
+            filename = os.path.join(os.path.expanduser('~'), '.cache', 'thunderlaser', 'flatten.bin')
+        self.filename = filename
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = b''
+        self._index = {}        # key -> (offset, length, generation) of entries in self._data
+        self._used = {}         # key -> payload of entries to keep with the current generation
+        self._generation = 1
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as fd:
+                data = fd.read()
+        except (IOError, OSError):
+            return
+        if not data.startswith(self.MAGIC):
+            return
+        index = {}
+        generation = 0
+        pos = len(self.MAGIC)
+        try:
+            while pos < len(data):
+                (gen, length) = struct.unpack_from('<II', data, pos+20)
+                if pos+28+length > len(data): break     # truncated
+                index[data[pos:pos+20]] = (pos+28, length, gen)
+                generation = max(generation, gen)
+                pos += 28+length
+        except struct.error:
+            pass
+        self._data = data
+        self._index = index
+        self._generation = generation+1
+
+    def key(self, d, dash, transform, smoothness):
+        return hashlib.sha1(repr((self.VERSION, d, dash, transform, smoothness)).encode('utf-8')).digest()
+
+    def get(self, key):
+        """
+        Returns the subpath list for key, as built by getPathVertices(),
+        or None if key is not in the cache.
+        """
+        payload = self._used.get(key)
+        if payload is None and key in self._index:
+            (pos, length, gen) = self._index[key]
+            payload = self._data[pos:pos+length]
+            self._used[key] = payload
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        subpath_list = []
+        (nsub,) = struct.unpack_from('<I', payload, 0)
+        pos = 4
+        for i in range(nsub):
+            (n,) = struct.unpack_from('<I', payload, pos)
+            bbox = list(struct.unpack_from('<4d', payload, pos+4))
+            v = iter(struct.unpack_from('<%dd' % (2*n), payload, pos+36))
+            pos += 36+16*n
+            subpath_list.append([[[x, y] for (x, y) in zip(v, v)], bbox])
+        return subpath_list
+
+    def put(self, key, subpath_list):
+        data = [struct.pack('<I', len(subpath_list))]
+        for (vertices, bbox) in subpath_list:
+            data.append(struct.pack('<I4d', len(vertices), *bbox))
+            data.append(struct.pack('<%dd' % (2*len(vertices)), *[c for pt in vertices for c in pt]))
+        self._used[key] = b''.join(data)
+
+    def save(self):
+        """
+        Write all entries used or added since load() and as many of the older
+        entries as fit into maxsize to the file. Nothing is written, if no entry was used.
+        """
+        if not self._used:
+            return
+        entries = [(self._generation, key, self._used[key]) for key in self._used]
+        size = len(self.MAGIC) + sum([28+len(e[2]) for e in entries])
+        older = [(self._index[key][2], key) for key in self._index if key not in self._used]
+        for (gen, key) in sorted(older, reverse=True):
+            (pos, length, gen) = self._index[key]
+            if size+28+length > self.maxsize: break
+            entries.append((gen, key, self._data[pos:pos+length]))
+            size += 28+length
+
+        dirname = os.path.dirname(self.filename)
+        try:
+            if dirname and not os.path.isdir(dirname): os.makedirs(dirname)
+            tmpname = self.filename + '.%d.tmp' % os.getpid()
+            with open(tmpname, 'wb') as fd:
+                fd.write(self.MAGIC)
+                for (gen, key, payload) in entries:
+                    fd.write(key + struct.pack('<II', gen, len(payload)))
+                    fd.write(payload)
+            if os.path.exists(self.filename) and sys_platform.startswith('win'):
+                os.unlink(self.filename)        # windows cannot rename to an existing file.
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError) as e:
+            inkex.errormsg('Warning: cannot write %s: %s' % (self.filename, e))
+
+
 class InkSvg():
     """
     Usage example with subclassing:
@@ -218,7 +505,7 @@ class InkSvg():
     #    print(svg.pathgen.path)
 
     """
-    __version__ = "1.7e"
+    __version__ = "1.8"
     DEFAULT_WIDTH = 100
     DEFAULT_HEIGHT = 100
 
@@ -239,11 +526,11 @@ class InkSvg():
         # cannot use inkex.getElementById() -- it returns only the first element of each hit.
         # cannot use inkex.getselected() -- it returns the last element of each hit only.
         """Collect selected nodes"""
+        index = self.getIdIndex()
         nodes = []
         for id in ids:
           if id != '':    # empty strings happen after splitting...
-            path = '//*[@id="%s"]' % id
-            el_list = self.document.xpath(path, namespaces=InkSvg.NSS)
+            el_list = index.get(id)
             if el_list:
               for node in el_list:
                 nodes.append(node)
@@ -252,6 +539,21 @@ class InkSvg():
         return nodes
 
 
+    def getIdIndex(self):
+        """
+        Returns a dict, mapping each id to the list of elements with this id,
+        in document order. It is built in one pass over the document, when
+        first needed, and rebuilt when self.document is replaced.
+        Set self.id_index = None after changing ids in the document.
+        """
+        if self.id_index is None or self.id_index_doc is not self.document:
+          index = {}
+          for node in self.document.xpath('//*[@id]'):
+            index.setdefault(node.get('id'), []).append(node)
+          self.id_index = index
+          self.id_index_doc = self.document
+        return self.id_index
+
     def load(self, filename):
         inkex.localize()
         # OO-Fail: cannot call inkex.Effect.parse(), Effect constructor has so many side-effects.
@@ -259,6 +561,7 @@ class InkSvg():
         p = etree.XMLParser(huge_tree=True)
         self.document = etree.parse(stream, parser=p)
         stream.close()
+        self.id_index = None
         # initialize a coordinate system that can be picked up by pathgen.
         self.handleViewBox()
 
@@ -279,50 +582,80 @@ class InkSvg():
         else:
           # Traverse the entire document building new, transformed paths
           self.recursivelyTraverseSvg(self.document.getroot(), self.docTransform)
+        if self.cache is not None:
+          self.cache.save()
 
 
     def getNodeStyleOne(self, node):
         """
         Finds style declarations by .class, #id or by tag.class syntax,
         and of course by a direct style='...' attribute.
+
+        The css_dict declarations of each tag and class attribute combination
+        are looked up once, and kept in self.css_sheet_cache until cssDictAdd().
+        Parsed style strings are kept in self.style_parse_cache.
+        Do not modify the returned dict.
         """
         sheet = ''
-        selectors = []
-        classes = node.get('class', '')         # classes == None can happen here.
-        if classes is not None and classes != '':
-            selectors = ["."+cls for cls in re.split('[\s,]+', classes)]
-            selectors += [node.tag+sel for sel in selectors]
-        node_id = node.get('id', '')
-        if node_id is not None and node_id != '':
-            selectors += [ "#"+node_id ]
-        for sel in selectors:
-            if sel in self.css_dict:
-                sheet += '; '+self.css_dict[sel]
+        if self.css_dict:
+            classes = node.get('class', '')     # classes == None can happen here.
+            if classes is not None and classes != '':
+                key = (node.tag, classes)
+                sheet = self.css_sheet_cache.get(key)
+                if sheet is None:
+                    sheet = ''
+                    selectors = ["."+cls for cls in re.split('[\s,]+', classes)]
+                    selectors += [node.tag+sel for sel in selectors]
+                    for sel in selectors:
+                        if sel in self.css_dict:
+                            sheet += '; '+self.css_dict[sel]
+                    self.css_sheet_cache[key] = sheet
+            node_id = node.get('id', '')
+            if node_id is not None and node_id != '':
+                if "#"+node_id in self.css_dict:
+                    sheet += '; '+self.css_dict["#"+node_id]
         style = node.get('style', '')
         if style is not None and style != '':
             sheet += '; '+style
-        return simplestyle.parseStyle(sheet)
+        parsed = self.style_parse_cache.get(sheet)
+        if parsed is None:
+            parsed = simplestyle.parseStyle(sheet)
+            self.style_parse_cache[sheet] = parsed
+        return parsed
 
     def getNodeStyle(self, node):
         """
         Recurse into parent group nodes, like simpletransform.ComposeParents
         Calling getNodeStyleOne() for each.
+
+        The result is kept per node in self.style_cache. While recursivelyTraverseSvg()
+        walks down the document, the style of the parent group is already
+        there, and only the declarations of the node itself are added.
+        Nodes without declarations share the dict of their parent.
+        Do not modify the returned dict.
         """
+        combined_style = self.style_cache.get(node)
+        if combined_style is not None:
+            return combined_style
         combined_style = {}
         parent = node.getparent()
-        if parent.tag == inkex.addNS('g','svg') or parent.tag == 'g':
+        if parent is not None and (parent.tag == inkex.addNS('g','svg') or parent.tag == 'g'):
             combined_style = self.getNodeStyle(parent)
         style = self.getNodeStyleOne(node)
-        for s in style:
-            combined_style[s] = style[s]        # overwrite or add
+        if style:
+            combined_style = dict(combined_style)
+            for s in style:
+                combined_style[s] = style[s]    # overwrite or add
+        self.style_cache[node] = combined_style
         return combined_style
 
 
-    def styleDasharray(self, path_d, node):
+    def styleDasharray(self, path_d, node, style=None):
         """
         Check the style of node for a stroke-dasharray, and apply it to the
         path d returning the result.  d is returned unchanged, if no
-        stroke-dasharray was found.
+        stroke-dasharray was found. The style of node can be passed in,
+        if the caller already has it.
 
         ## Extracted from inkscape extension convert2dashes; original
         ## comments below.
@@ -354,7 +687,8 @@ class InkSvg():
             bez = (sp1[1][:],sp1[2][:],sp2[0][:],sp2[1][:])
             return bezmisc.bezierlength(bez, tolerance)
 
-        style = self.getNodeStyle(node)
+        if style is None:
+            style = self.getNodeStyle(node)
         if not style.has_key('stroke-dasharray'):
             return path_d
         dashes = []
@@ -416,14 +750,21 @@ class InkSvg():
         Hexadecimal stroke formats of '#RRGGBB' or '#RGB' are understood
         as well as 'rgb(100%, 0%, 0%) or 'red' relying on simplestyle.
         """
-        if eps is None:
-          eps = 64 if avg == True else 85
         if rgb is None or rgb is False: return False
         if rgb is True: return True
         style = self.getNodeStyle(node)
         s = style.get('stroke', '')
         if s == '': return False
         c = simplestyle.parseColor(s)
+        return self.matchColor(c, rgb, eps, avg)
+
+    def matchColor(self, c, rgb, eps=None, avg=True):
+        """
+        The color comparison of matchStrokeColor(), for a parsed color c
+        and an rgb list of three integers.
+        """
+        if eps is None:
+          eps = 64 if avg == True else 85
         if sum:
            s = abs(rgb[0]-c[0]) + abs(rgb[1]-c[1]) + abs(rgb[2]-c[2])
            if s < 3*eps:
@@ -434,11 +775,67 @@ class InkSvg():
         if abs(rgb[2]-c[2]) > eps: return False
         return True
 
+    def classifyStrokeColors(self, nodes, rgbs, eps=None, avg=True):
+        """
+        Assign each node to one of the colors in rgbs, according to its
+        stroke color. rgbs is a list of values as accepted by matchStrokeColor().
+        Returns a list with one entry per node: the index into rgbs, or None
+        if no color matches.
+
+        If several colors match, the first matching [r, g, b] value wins
+        over a True ('any') value. Otherwise the first match wins.
+
+        The stroke color of each node is taken from getStrokeColor(). Each
+        distinct color is compared against rgbs once, the results are kept
+        in a lookup table.
+        """
+        classify = self.strokeColorClassifier(rgbs, eps, avg)
+        return [classify(node) for node in nodes]
+
+    def strokeColorClassifier(self, rgbs, eps=None, avg=True):
+        """
+        Returns a function classify(node), that does what classifyStrokeColors()
+        does for a single node. The lookup table is shared by all calls.
+        """
+        order = [i for i in range(len(rgbs)) if rgbs[i] not in (None, False, True)]
+        order += [i for i in range(len(rgbs)) if rgbs[i] is True]
+        any_idx = [i for i in order if rgbs[i] is True]
+
+        by_color = { None: any_idx[0] if any_idx else None }   # (r, g, b) -> index
+
+        def classify(node):
+            c = self.getStrokeColor(node)
+            if c not in by_color:
+                by_color[c] = None
+                for i in order:
+                    if rgbs[i] is True or self.matchColor(c, rgbs[i], eps, avg):
+                        by_color[c] = i
+                        break
+            return by_color[c]
+        return classify
+
+    def getStrokeColor(self, node):
+        """
+        Returns the stroke color of node as an (r, g, b) tuple, or None if
+        the node has no stroke. Parsed colors are kept in self.color_parse_cache.
+        """
+        s = self.getNodeStyle(node).get('stroke', '')
+        if s == '':
+            return None
+        c = self.color_parse_cache.get(s)
+        if c is None:
+            c = tuple(simplestyle.parseColor(s))
+            self.color_parse_cache[s] = c
+        return c
+
     def cssDictAdd(self, text):
         """
         Represent css cdata as a hash in css_dict.
         Implements what is seen on: http://www.blooberry.com/indexdot/css/examples/cssembedded.htm
+        Styles computed before are dropped from the caches of getNodeStyle().
         """
+        self.style_cache = {}
+        self.css_sheet_cache = {}
         text=re.sub('^\s*(<!--)?\s*', '', text)
         while True:
             try:
@@ -528,6 +925,87 @@ class InkSvg():
             p = [one[2], one[3], two[1]]
             sp[i:1] = [p]
 
+    def flattenCubicPath(self, sp, flat):
+        '''
+        Returns the vertices of the subpath sp, with each bezier curve
+        subdivided as by subdivideCubicPath(). The result is the same, but
+        sp is not modified: pending halves wait on a stack, and vertices are
+        only appended to the output. Inserting into sp costs O(n**2) for
+        curves that need many subdivisions.
+
+        With numpy, longer subpaths are done by flattenCubicPathNumpy().
+        '''
+        if len(sp) == 0:
+            return []
+        if numpy is not None and len(sp) > 32:
+            return self.flattenCubicPathNumpy(sp, flat)
+
+        vertices = [sp[0][1]]
+        stack = []
+        for i in range(1, len(sp)):
+            b = (sp[i - 1][1], sp[i - 1][2], sp[i][0], sp[i][1])
+            while True:
+                if cspsubdiv.maxdist(b) > flat:
+                    one, two = bezmisc.beziersplitatt(b, 0.5)
+                    stack.append(two)
+                    b = one
+                    continue
+                vertices.append(b[3])
+                if not len(stack):
+                    break
+                b = stack.pop()
+        return vertices
+
+    def flattenCubicPathNumpy(self, sp, flat):
+        '''
+        Same as flattenCubicPath(), with numpy array operations. All curves of
+        the subpath are subdivided together, one level per round. The flatness
+        test is that of cspsubdiv.maxdist(): the larger distance of the two
+        control points from the line through the end points. It is NaN for
+        curves that end where they start, these are not subdivided.
+        '''
+        bez = numpy.array([[sp[i - 1][1], sp[i - 1][2], sp[i][0], sp[i][1]] for i in range(1, len(sp))],
+                          dtype=numpy.float64)
+        seg = numpy.arange(len(bez))            # index of the original curve
+        t = numpy.zeros(len(bez))               # start of each part in the original curve
+        w = 1.0                                 # length of all parts in this round
+        done_pt, done_seg, done_t = [], [], []
+        while len(bez):
+            (x0, y0) = (bez[:, 0, 0], bez[:, 0, 1])
+            dx = bez[:, 3, 0] - x0
+            dy = bez[:, 3, 1] - y0
+            l = numpy.sqrt(dx ** 2 + dy ** 2)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                d1 = numpy.fabs(dx * (y0 - bez[:, 1, 1]) - (x0 - bez[:, 1, 0]) * dy) / l
+                d2 = numpy.fabs(dx * (y0 - bez[:, 2, 1]) - (x0 - bez[:, 2, 0]) * dy) / l
+                split = numpy.maximum(d1, d2) > flat
+            split[l == 0] = False
+            keep = ~split
+            done_pt.append(bez[keep, 3])
+            done_seg.append(seg[keep])
+            done_t.append(t[keep])
+
+            bez, seg, t = bez[split], seg[split], t[split]
+            if not len(bez):
+                break
+            # bezmisc.beziersplitatt(b, 0.5), for all curves at once.
+            m1 = bez[:, 0] + 0.5 * (bez[:, 1] - bez[:, 0])
+            m2 = bez[:, 1] + 0.5 * (bez[:, 2] - bez[:, 1])
+            m3 = bez[:, 2] + 0.5 * (bez[:, 3] - bez[:, 2])
+            m4 = m1 + 0.5 * (m2 - m1)
+            m5 = m2 + 0.5 * (m3 - m2)
+            m = m4 + 0.5 * (m5 - m4)
+            one = numpy.stack((bez[:, 0], m1, m4, m), axis=1)
+            two = numpy.stack((m, m5, m3, bez[:, 3]), axis=1)
+            w *= 0.5
+            bez = numpy.concatenate((one, two))
+            seg = numpy.concatenate((seg, seg))
+            t = numpy.concatenate((t, t + w))
+
+        pts = numpy.concatenate(done_pt)
+        order = numpy.lexsort((numpy.concatenate(done_t), numpy.concatenate(done_seg)))
+        return [sp[0][1]] + pts[order].tolist()
+
     def parseLengthWithUnits(self, str, default_unit='px'):
         '''
         Parse an SVG value which may or may not have units attached
@@ -555,7 +1033,7 @@ class InkSvg():
         return v, u
 
 
-    def __init__(self, document=None, svgfile=None, smoothness=0.2, debug=False, pathgen=LinearPathGen(smoothness=0.2)):
+    def __init__(self, document=None, svgfile=None, smoothness=0.2, debug=False, pathgen=LinearPathGen(smoothness=0.2), cache=None):
         """
         Usage: ...
         """
@@ -582,9 +1060,50 @@ class InkSvg():
         # to go back and update the SVG document, or retrieve e.g. style information.
         self.paths = []
 
+        # Elements by id, built by getIdIndex().
+        self.id_index = None
+        self.id_index_doc = None
+
+        # A FlattenCache() used by getPathVertices(), or None.
+        self.cache = cache
+
+        # Untransformed vertices of flattened path data, see getPathVertices().
+        # Memoization stops after flatten_memo_max vertices.
+        self.flatten_memo = {}
+        self.flatten_memo_size = 0
+        self.flatten_memo_max = 2000000
+
+        # A function accept(node), or None. Shapes it returns False for are
+        # not flattened by recursivelyTraverseSvg(). They only extend the
+        # drawing bounding box. self.skipping is set while they are traversed.
+        # Their path data is collected in self.skipped, see addSkippedBBoxes().
+        self.accept = None
+        self.skipping = False
+        self.skipped = []
+        self.traverse_depth = 0
+
+        # [xmin, xmax, ymin, ymax] or None. Paths that lie outside are not added
+        # to self.paths, and if possible not even flattened, see getPathVertices().
+        self.clip = None
+
+        # Number of elements rejected by accept, and by clip.
+        self.rejected = 0
+        self.clipped = 0
+
+        # Tags of the elements that recursivelyTraverseSvg() hands to pathgen.
+        self.shape_tags = set([inkex.addNS('path', 'svg')])
+        for tag in ('rect', 'line', 'polyline', 'polygon', 'ellipse', 'circle'):
+            self.shape_tags.update([inkex.addNS(tag, 'svg'), tag])
+
         # cssDictAdd collects style definitions here:
         self.css_dict = {}
 
+        # Caches of getNodeStyle() and getNodeStyleOne().
+        self.style_cache = {}
+        self.css_sheet_cache = {}
+        self.style_parse_cache = {}
+        self.color_parse_cache = {}
+
         # For handling an SVG viewbox attribute, we will need to know the
         # values of the document's <svg> width and height attributes as well
         # as establishing a transform from the viewbox to the display.
@@ -597,12 +1116,13 @@ class InkSvg():
         # multiple times about the same problem
         self.warnings = {}
 
+        self.document = None
         if document:
             self.document = document
             if svgfile:
                 inkex.errormsg('Warning: ignoring svgfile. document given too.')
         elif svgfile:
-            self.document = self.load(svgfile)
+            self.load(svgfile)
 
     def getLength(self, name, default):
 
@@ -726,6 +1246,32 @@ class InkSvg():
                     sy = self.docHeight / float(vinfo[3])
                     self.docTransform = simpletransform.parseTransform('scale(%f,%f)' % (sx, sy))
 
+    def pageBox(self):
+        '''
+        Returns the page as [xmin, xmax, ymin, ymax] in the coordinates of
+        self.paths, i.e. the viewBox rectangle mapped through docTransform,
+        or [0, docWidth, 0, docHeight] without a viewBox.
+        None if the page size is unknown: width or height missing, or not
+        in absolute units (e.g. '100%'). Call handleViewBox() first.
+        '''
+        root = self.document.getroot()
+        if root.get('width') is None or root.get('height') is None:
+            return None
+        if self.docWidth is None or self.docHeight is None:
+            return None
+        viewbox = root.get('viewBox')
+        if not viewbox:
+            return [0.0, self.docWidth, 0.0, self.docHeight]
+        try:
+            (x, y, w, h) = [float(v) for v in viewbox.strip().replace(',', ' ').split()]
+        except ValueError:
+            return None
+        if w <= 0 or h <= 0:
+            return None
+        corners = [[x, y], [x + w, y + h]]
+        [[corners, bbox]] = self.transformVertices([corners], self.docTransform)
+        return bbox
+
     def getPathVertices(self, path, node=None, transform=None, smoothness=None):
 
         '''
@@ -738,6 +1284,24 @@ class InkSvg():
         form (node, path_list). This preserves the native ordering of
         the SVG file as much as possible, while still making all attributes
         if the node available when processing the path list.
+
+        The path is flattened in its own coordinates, by flattenPath(), and
+        then transformed. The smoothness is divided by the largest scale factor
+        of the transform, so that it holds after transforming. The untransformed
+        vertices are kept in self.flatten_memo, thus repeated path data, e.g. of
+        <use> clones, is flattened only once per run.
+
+        With a FlattenCache in self.cache, the path list is taken from there,
+        if the same path was flattened before.
+
+        With self.clip set, a path that lies outside of it is not added,
+        see addPathVertices(). If it is not in the cache or the memo, the
+        bounding box of its control points is checked first, so that it is
+        not even flattened.
+
+        With self.skipping set (for elements rejected by self.accept), the
+        path is not flattened here. It is kept in self.skipped, for
+        addSkippedBBoxes() at the end of the traversal.
         '''
 
         if not smoothness:
@@ -747,8 +1311,74 @@ class InkSvg():
             # Nothing to do
             return None
 
+        if self.skipping:
+            bbox = self.pathBBox(path, transform)
+            if bbox is not None and (self.clip is None or self.boxInClip(bbox)):
+                self.skipped.append((path, node, transform, smoothness, bbox))
+            return None
+
+        subpath_list = self.flattenTransformed(path, node, transform, smoothness)
+        if subpath_list is not None:
+            self.addPathVertices(node, subpath_list)
+
+    def flattenTransformed(self, path, node, transform, smoothness):
+        '''
+        Returns the subpath list of the path data, flattened and transformed
+        as described in getPathVertices(), using self.cache and
+        self.flatten_memo. None if there is nothing to add, or if the path
+        is outside of self.clip.
+        '''
+        style = None
+        dash = None
         if node is not None:
-            path = self.styleDasharray(path, node)
+            style = self.getNodeStyle(node)
+            dash = (style.get('stroke-dasharray'), style.get('stroke-dashoffset'))
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(path, dash, transform, float(smoothness))
+            subpath_list = self.cache.get(cache_key)
+            if subpath_list is not None:
+                return subpath_list
+
+        # Round the tolerance down to 1/64 of an octave, so that clones with
+        # almost the same scale (e.g. rotated) share the memo entry.
+        # Without scaling, the smoothness is used as it is.
+        flat = float(smoothness)
+        scale = self.transformScale(transform)
+        if scale > 0.0 and scale != 1.0:
+            flat = 2.0 ** (math.floor(64 * math.log(flat / scale, 2)) / 64)
+
+        memo_key = (path, dash, flat)
+        vertex_lists = self.flatten_memo.get(memo_key)
+        if vertex_lists is None:
+            if self.clip is not None:
+                bbox = self.pathBBox(path, transform)
+                if bbox is not None and not self.boxInClip(bbox):
+                    self.clipped += 1
+                    return None
+            vertex_lists = self.flattenPath(path, node, style, flat)
+            if vertex_lists is None:
+                return None
+            if self.flatten_memo_size < self.flatten_memo_max:
+                self.flatten_memo[memo_key] = vertex_lists
+                self.flatten_memo_size += sum([len(v) for v in vertex_lists])
+
+        subpath_list = self.transformVertices(vertex_lists, transform)
+        if cache_key is not None and len(subpath_list) > 0:
+            self.cache.put(cache_key, subpath_list)
+        return subpath_list
+
+    def flattenPath(self, path, node, style, flat):
+        '''
+        Returns the subpaths of the path data as lists of vertices, without
+        any transform. Bezier curves are subdivided until they are within flat
+        of a straight line. A stroke-dasharray of the node is applied first.
+        None is returned if the path data has no content.
+        '''
+
+        if node is not None:
+            path = self.styleDasharray(path, node, style)
 
         # parsePath() may raise an exception.  This is okay
         sp = simplepath.parsePath(path)
@@ -762,69 +1392,155 @@ class InkSvg():
             # Probably never happens, but...
             return None
 
-        if transform:
-            simpletransform.applyTransformToPath(transform, p)
+        vertex_lists = []
+        for sp in p:
+            vertex_lists.append(self.flattenCubicPath(sp, flat))
+        return vertex_lists
+
+    def pathBBox(self, path, transform):
+        '''
+        Returns the bounding box [xmin, xmax, ymin, ymax] of the control
+        points of the path data, after applying transform. The bezier curves
+        of the path stay within it. Dashes are not considered, they only
+        remove parts of the path. None if the path has no points.
+        '''
+        p = cubicsuperpath.CubicSuperPath(simplepath.parsePath(path))
+        xs = [pt[0] for sp in p for csp in sp for pt in csp]
+        ys = [pt[1] for sp in p for csp in sp for pt in csp]
+        if not len(xs):
+            return None
+        corners = [[min(xs), min(ys)], [max(xs), min(ys)], [min(xs), max(ys)], [max(xs), max(ys)]]
+        [[corners, bbox]] = self.transformVertices([corners], transform)
+        return bbox
 
-        # Now traverse the cubic super path
+    def boxInClip(self, bbox):
+        '''
+        Returns False if the bounding box [xmin, xmax, ymin, ymax] lies outside of self.clip.
+        '''
+        (xmin, xmax, ymin, ymax) = bbox
+        (cxmin, cxmax, cymin, cymax) = self.clip
+        return xmax >= cxmin and xmin <= cxmax and ymax >= cymin and ymin <= cymax
+
+    def hasDasharray(self, node):
+        '''
+        True if styleDasharray() would split the outline of node into dashes.
+        '''
+        return self.getNodeStyle(node).get('stroke-dasharray', '').find(',') > 0
+
+    def arcVertices(self, cx, cy, rx, ry, st, en, flat):
+        '''
+        Returns the vertices of an elliptical arc, from angle st to angle en
+        (in radians, en < st runs backwards). The angles are evenly spaced, and
+        the chords stay within flat of the arc: a chord spanning the angle a
+        is at most max(rx, ry) * (1 - cos(a/2)) away from it. A quarter ellipse
+        takes at least one chord.
+        '''
+        r = max(abs(rx), abs(ry))
+        step = 0.5 * math.pi
+        if flat < r:
+            step = min(step, 2.0 * math.acos(1.0 - flat / r))
+        n = max(1, int(math.ceil(abs(en - st) / step - 1e-9)))
+        a = (en - st) / n
+        return [[cx + rx * math.cos(st + i*a), cy + ry * math.sin(st + i*a)] for i in range(n + 1)]
+
+    def getShapeVertices(self, vertex_lists, node=None, transform=None):
+        '''
+        Like getPathVertices(), for lists of vertices that were generated
+        without path data, e.g. by arcVertices(). The vertices are
+        transformed and added by addPathVertices(). With self.skipping set,
+        only their bounding box is added to the drawing bounding box.
+        '''
+        subpath_list = self.transformVertices(vertex_lists, transform)
+        if self.skipping:
+            if self.clip is not None and not [1 for (vertices, bbox) in subpath_list if self.boxInClip(bbox)]:
+                return None
+            for (vertices, bbox) in subpath_list:
+                self.addBBox(bbox)
+            return None
+        self.addPathVertices(node, subpath_list)
+
+    def transformScale(self, transform):
+        '''
+        Returns the largest factor by which transform stretches a distance,
+        the larger singular value of its 2x2 matrix part. 1.0 for no transform.
+        '''
+        if not transform:
+            return 1.0
+        (a, c) = (transform[0][0], transform[0][1])
+        (b, d) = (transform[1][0], transform[1][1])
+        s = a*a + b*b + c*c + d*d
+        det = a*d - b*c
+        return math.sqrt(0.5 * (s + math.sqrt(max(0.0, s*s - 4*det*det))))
+
+    def transformVertices(self, vertex_lists, transform):
+        '''
+        Apply transform to lists of vertices, as returned by flattenPath().
+        Returns new lists, in the path_list format of getPathVertices(): each
+        list of vertices is paired with its bounding box [xmin, xmax, ymin, ymax].
+        '''
+        if not transform:
+            transform = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+        ((a, c, e), (b, d, f)) = transform
         subpath_list = []
-        subpath_vertices = []
+        for vertices in vertex_lists:
+            if not len(vertices):
+                continue
+            tv = [[a*x + c*y + e, b*x + d*y + f] for (x, y) in vertices]
+            xs = [pt[0] for pt in tv]
+            ys = [pt[1] for pt in tv]
+            subpath_list.append([tv, [min(xs), max(xs), min(ys), max(ys)]])
+        return subpath_list
 
-        for sp in p:
+    def addPathVertices(self, node, subpath_list):
+        '''
+        Append (node, subpath_list) to self.paths, and track the bounding box of
+        the overall drawing in self.xmin, self.xmax, self.ymin, self.ymax.
+        This is used for centering the polygons in OpenSCAD around the (x,y) origin.
+
+        With self.clip set, nothing is added if all subpaths lie outside of it.
+        '''
+        if self.clip is not None and len(subpath_list) > 0:
+            if not [1 for (vertices, bbox) in subpath_list if self.boxInClip(bbox)]:
+                self.clipped += 1
+                return
 
-            # We've started a new subpath
-            # See if there is a prior subpath and whether we should keep it
-            if len(subpath_vertices):
-                subpath_list.append([subpath_vertices, [sp_xmin, sp_xmax, sp_ymin, sp_ymax]])
-
-            subpath_vertices = []
-            self.subdivideCubicPath(sp, float(smoothness))
-
-            # Note the first point of the subpath
-            first_point = sp[0][1]
-            subpath_vertices.append(first_point)
-            sp_xmin = first_point[0]
-            sp_xmax = first_point[0]
-            sp_ymin = first_point[1]
-            sp_ymax = first_point[1]
-
-            n = len(sp)
-
-            # Traverse each point of the subpath
-            for csp in sp[1:n]:
-
-                # Append the vertex to our list of vertices
-                pt = csp[1]
-                subpath_vertices.append(pt)
-
-                # Track the bounding box of this subpath
-                if pt[0] < sp_xmin:
-                    sp_xmin = pt[0]
-                elif pt[0] > sp_xmax:
-                    sp_xmax = pt[0]
-                if pt[1] < sp_ymin:
-                    sp_ymin = pt[1]
-                elif pt[1] > sp_ymax:
-                    sp_ymax = pt[1]
-
-            # Track the bounding box of the overall drawing
-            # This is used for centering the polygons in OpenSCAD around the
-            # (x,y) origin
-            if sp_xmin < self.xmin:
-                self.xmin = sp_xmin
-            if sp_xmax > self.xmax:
-                self.xmax = sp_xmax
-            if sp_ymin < self.ymin:
-                self.ymin = sp_ymin
-            if sp_ymax > self.ymax:
-                self.ymax = sp_ymax
-
-        # Handle the final subpath
-        if len(subpath_vertices):
-            subpath_list.append([subpath_vertices, [sp_xmin, sp_xmax, sp_ymin, sp_ymax]])
+        for (vertices, bbox) in subpath_list:
+            self.addBBox(bbox)
 
         if len(subpath_list) > 0:
             self.paths.append( (node, subpath_list) )
 
+    def addSkippedBBoxes(self):
+        '''
+        Extend the bounding box of the overall drawing by the paths in
+        self.skipped, as if they had been flattened. Paths whose control
+        points lie strictly inside the bounding box cannot extend it, as the
+        curves stay within their control points. Only the others are flattened.
+        '''
+        skipped = self.skipped
+        self.skipped = []
+        for (path, node, transform, smoothness, bbox) in skipped:
+            if bbox[0] > self.xmin and bbox[1] < self.xmax and bbox[2] > self.ymin and bbox[3] < self.ymax:
+                continue
+            subpath_list = self.flattenTransformed(path, node, transform, smoothness) or []
+            if self.clip is not None and not [1 for (vertices, vbbox) in subpath_list if self.boxInClip(vbbox)]:
+                continue
+            for (vertices, vbbox) in subpath_list:
+                self.addBBox(vbbox)
+
+    def addBBox(self, bbox):
+        '''
+        Extend the bounding box of the overall drawing by bbox [xmin, xmax, ymin, ymax].
+        '''
+        if bbox[0] < self.xmin:
+            self.xmin = bbox[0]
+        if bbox[1] > self.xmax:
+            self.xmax = bbox[1]
+        if bbox[2] < self.ymin:
+            self.ymin = bbox[2]
+        if bbox[3] > self.ymax:
+            self.ymax = bbox[3]
+
 
     def recursivelyTraverseSvg(self, aNodeList, matCurrent=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
                                parent_visibility='visible'):
@@ -850,6 +1566,7 @@ class InkSvg():
         All other SVG elements trigger an error (including <text>)
         '''
 
+        self.traverse_depth += 1
         for node in aNodeList:
 
             # Ignore invisible nodes
@@ -863,6 +1580,12 @@ class InkSvg():
             s = self.getNodeStyle(node)
             if s.get('display', '') == 'none': continue
 
+            # Shapes rejected by accept are not flattened, but still count
+            # for the bounding box of the drawing, see getPathVertices() and addSkippedBBoxes().
+            self.skipping = self.accept is not None and node.tag in self.shape_tags and not self.accept(node)
+            if self.skipping:
+                self.rejected += 1
+
             # First apply the current matrix transform to this node's tranform
             matNew = simpletransform.composeTransform(
                 matCurrent, simpletransform.parseTransform(node.get("transform")))
@@ -875,8 +1598,8 @@ class InkSvg():
 
                 # A <use> element refers to another SVG element via an
                 # xlink:href="#blah" attribute.  We will handle the element by
-                # doing an XPath search through the document, looking for the
-                # element with the matching id="blah" attribute.  We then
+                # looking up the element with the matching id="blah" attribute
+                # in the id index of the document.  We then
                 # recursively process that element after applying any necessary
                 # (x,y) translation.
                 #
@@ -893,8 +1616,7 @@ class InkSvg():
                     continue
 
                 # [1:] to ignore leading '#' in reference
-                path = '//*[@id="%s"]' % refid[1:]
-                refnode = node.xpath(path)
+                refnode = self.getIdIndex().get(refid[1:])
                 if refnode:
                     x = float(node.get('x', '0'))
                     y = float(node.get('y', '0'))
@@ -942,65 +1664,33 @@ class InkSvg():
 
             elif node.tag == inkex.addNS('line', 'svg') or node.tag == 'line':
 
-                # Convert
-                #
-                #   <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
-                #
-                # to
-                #
-                #   <path d="MX1,Y1 LX2,Y2"/>
-
                 x1 = float(node.get('x1'))
                 y1 = float(node.get('y1'))
                 x2 = float(node.get('x2'))
                 y2 = float(node.get('y2'))
                 if (not x1) or (not y1) or (not x2) or (not y2):
                     continue
-                a = []
-                a.append(['M ', [x1, y1]])
-                a.append([' L ', [x2, y2]])
-                self.pathgen.pathList(a, node, matNew)
+                self.pathgen.objLine(x1, y1, x2, y2, node, matNew)
 
             elif node.tag == inkex.addNS('polyline', 'svg') or node.tag == 'polyline':
 
-                # Convert
-                #
-                #  <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
-                #
                 # Note: we ignore polylines with no points
 
                 pl = node.get('points', '').strip()
                 if pl == '':
                     continue
 
-                pa = pl.split()
-                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
-                self.pathgen.pathString(d, node, matNew)
+                self.pathgen.objPolyline(pl, False, node, matNew)
 
             elif node.tag == inkex.addNS('polygon', 'svg') or node.tag == 'polygon':
 
-                # Convert
-                #
-                #  <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...] Z"/>
-                #
                 # Note: we ignore polygons with no points
 
                 pl = node.get('points', '').strip()
                 if pl == '':
                     continue
 
-                pa = pl.split()
-                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
-                d += " Z"
-                self.pathgen.pathString(d, node, matNew)
+                self.pathgen.objPolyline(pl, True, node, matNew)
 
             elif node.tag == inkex.addNS('ellipse', 'svg') or node.tag == 'ellipse' or \
                  node.tag == inkex.addNS('circle', 'svg')  or node.tag == 'circle':
@@ -1107,6 +1797,11 @@ class InkSvg():
                 inkex.errormsg('Warning: unable to draw object <%s>, please convert it to a path first.' % node.tag)
                 pass
 
+        self.skipping = False
+        self.traverse_depth -= 1
+        if self.traverse_depth == 0:
+            self.addSkippedBBoxes()
+
     def recursivelyGetEnclosingTransform(self, node):
 
         '''
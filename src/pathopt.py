@@ -0,0 +1,610 @@
+#! /usr/bin/python3
+#
+# pathopt.py -- dedup, join, simplify and reorder the paths of a laser job to reduce machine time.
+#
+# The code is fully compatible with python 2.7 and 3.5
+#
+# Paths are lists of [x, y] points in mm, as passed to Ruida.set(paths=...).
+# Ordering never changes the geometry. The 2-opt refinement may reverse
+# the direction of a path, all other methods keep paths as they are.
+#
+# Methods:
+#  'none'     -- document order
+#  'nn'       -- nearest neighbour, using a k-d tree of the start points.
+#  '2opt'     -- nearest neighbour, then 2-opt refinement within a time budget.
+#  'hilbert'  -- sort by position of the start point along a hilbert curve.
+#                O(n log n), for very large jobs.
+#
+# With entry=True, closed paths may also start at any of their vertices, and open paths
+# may be cut in reverse. 'nn' then searches all these entry points. The other methods
+# rotate or reverse each path afterwards, to start nearest to the end of the previous path.
+#
+# Use Ruida.odometer() to measure the travel distance before and after.
+#
+# dedup() removes segments that are cut twice, e.g. shared edges of adjacent tiles. Segments
+# are indexed by the straight line they lie on, and overlaps are subtracted as intervals.
+#
+# join() chains open paths that end where another one starts, using a grid hash of their
+# end points. Each join saves a travel move and a laser on/off.
+#
+# simplify() drops vertices with the Ramer-Douglas-Peucker algorithm. No point of the
+# original path is farther than the tolerance from the simplified path.
+#
+# 2026-10-17
+#     v1.0 -- initial draft: nearest neighbour, 2-opt and hilbert ordering.
+#     v1.1 -- entry point selection: rotate closed paths, reverse open paths.
+#     v1.2 -- added simplify(), iterative RDP decimation.
+#     v1.3 -- added join().
+#     v1.4 -- added dedup().
+
+import math, time, bisect
+
+try:
+  from math import gcd
+except ImportError:     # python2
+  from fractions import gcd
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+class PathOpt():
+  """
+  Travel minimizing ordering of paths.
+  Example:
+    po = PathOpt(method='2opt')
+    paths = po.order(paths)
+  """
+  __version__ = "1.4"
+
+  methods = ('none', 'nn', '2opt', 'hilbert')
+
+  def __init__(self, method='nn', init=[0,0], timeout=2.0, window=64, entry=False):
+    self._method = method
+    self._entry = entry         # allow rotation of closed paths and reversal of open paths.
+    self._init = init           # start position of the laser head.
+    self._timeout = timeout     # time budget for 2-opt in seconds.
+    self._window = window       # 2-opt looks at most this many paths ahead.
+    if method not in self.methods:
+      raise ValueError("unknown path ordering method: "+str(method))
+
+  def order(self, paths, method=None, init=None, entry=None):
+    """
+    Returns a new list with the same paths in travel optimized order.
+    Empty paths are moved to the end.
+    """
+    if method is None: method = self._method
+    if init is None: init = self._init
+    if entry is None: entry = self._entry
+    todo = [p for p in paths if len(p)]
+    empty = [p for p in paths if not len(p)]
+    if not todo:
+      return empty
+    if method == 'nn':
+      todo = self.nearest(todo, init, entry)
+    elif method == '2opt':
+      todo = self.two_opt(self.nearest(todo, init, entry), init)
+    elif method == 'hilbert':
+      todo = self.hilbert(todo)
+    elif method != 'none':
+      raise ValueError("unknown path ordering method: "+str(method))
+    if entry and method != 'nn':
+      todo = self.entry_points(todo, init)
+    return todo + empty
+
+  def closed(self, path, eps=1e-6):
+    """
+    True, if the path ends where it starts.
+    """
+    return len(path) > 2 and abs(path[0][0]-path[-1][0]) < eps and abs(path[0][1]-path[-1][1]) < eps
+
+  def rotate(self, path, k):
+    """
+    Returns a closed path, that starts and ends at vertex k. Same geometry and direction.
+    """
+    if k == 0: return path
+    return path[k:] + path[1:k+1]
+
+  def entry_points(self, paths, init=None):
+    """
+    Keeps the order of paths, but starts each path nearest to the end of the previous one.
+    Closed paths are rotated to their nearest vertex, open paths are reversed if their end is nearer.
+    """
+    if init is None: init = self._init
+    xy = init
+    result = []
+    for path in paths:
+      if self.closed(path):
+        d = [(p[0]-xy[0])*(p[0]-xy[0]) + (p[1]-xy[1])*(p[1]-xy[1]) for p in path[:-1]]
+        path = self.rotate(path, d.index(min(d)))
+      else:
+        d0 = (path[0][0]-xy[0])*(path[0][0]-xy[0]) + (path[0][1]-xy[1])*(path[0][1]-xy[1])
+        d1 = (path[-1][0]-xy[0])*(path[-1][0]-xy[0]) + (path[-1][1]-xy[1])*(path[-1][1]-xy[1])
+        if d1 < d0: path = path[::-1]
+      result.append(path)
+      xy = path[-1]
+    return result
+
+  def kdtree(self, pts, leafsize=8):
+    """
+    Build a static k-d tree over a list of [x, y] points, splitting x and y alternately.
+    Each node is a list [bbox, lo, hi, left, right, parent], where bbox = [x0, y0, x1, y1]
+    encloses the points perm[lo:hi]. Leaves have left = right = None.
+    Returns (nodes, perm, leaf_of_point)
+    """
+    n = len(pts)
+    perm = list(range(n))
+    coord = ([p[0] for p in pts], [p[1] for p in pts])
+    nodes = []
+    leaf = [None] * n
+    stack = [(0, n, None, 3, 0)]
+    while stack:
+      (lo, hi, parent, side, axis) = stack.pop()
+      k = len(nodes)
+      nodes.append([None, lo, hi, None, None, parent])
+      if parent is not None: nodes[parent][side] = k
+      if hi-lo <= leafsize:
+        for i in perm[lo:hi]: leaf[i] = k
+        self.kdtree_bbox(nodes, k, pts, perm, None)
+        continue
+      perm[lo:hi] = sorted(perm[lo:hi], key=coord[axis].__getitem__)
+      mid = (lo+hi) >> 1
+      stack.append((mid, hi, k, 4, 1-axis))
+      stack.append((lo, mid, k, 3, 1-axis))
+    # fill in the bounding boxes bottom up. Children always have higher node numbers.
+    for k in range(len(nodes)-1, -1, -1):
+      if nodes[k][3] is not None:
+        self.kdtree_bbox(nodes, k, pts, perm, None)
+    return (nodes, perm, leaf)
+
+  def kdtree_bbox(self, nodes, k, pts, perm, alive):
+    """
+    Recompute the bounding box of node k from its alive points (leaf) or its children.
+    An empty node gets bbox None. Returns True if the bbox changed.
+    """
+    node = nodes[k]
+    if node[3] is None:
+      live = [pts[i] for i in perm[node[1]:node[2]] if alive is None or alive[i]]
+      if live:
+        bbox = [min(p[0] for p in live), min(p[1] for p in live), max(p[0] for p in live), max(p[1] for p in live)]
+      else:
+        bbox = None
+    else:
+      (l, r) = (nodes[node[3]][0], nodes[node[4]][0])
+      if l is None:
+        bbox = r
+      elif r is None:
+        bbox = l
+      else:
+        bbox = [min(l[0], r[0]), min(l[1], r[1]), max(l[2], r[2]), max(l[3], r[3])]
+    if bbox == node[0]: return False
+    node[0] = bbox
+    return True
+
+  def nearest(self, paths, init=None, entry=False):
+    """
+    Greedy nearest neighbour ordering. From the end of each path, continue with the
+    path whose start point is closest. Ties are resolved in document order.
+    With entry=True, every vertex of a closed path and both ends of an open path are
+    candidates, the chosen path is rotated or reversed accordingly.
+    The candidates are kept in a k-d tree. The bounding boxes of the tree shrink
+    to the remaining points, so that used up subtrees are pruned early.
+    """
+    if init is None: init = self._init
+    n = len(paths)
+    pts = []            # candidate entry points
+    owner = []          # path index of each candidate
+    entry_at = []       # vertex index of each candidate, -1 for the reversed end of an open path.
+    first = []          # index of the first candidate of each path
+    for j in range(n):
+      first.append(len(pts))
+      path = paths[j]
+      if not entry:
+        vertices = [0]
+      elif self.closed(path):
+        vertices = range(len(path)-1)
+      elif len(path) > 1:
+        vertices = [0, -1]
+      else:
+        vertices = [0]
+      for v in vertices:
+        pts.append(path[v])
+        owner.append(j)
+        entry_at.append(v)
+    first.append(len(pts))
+    (nodes, perm, leaf) = self.kdtree(pts)
+    alive = [True] * len(pts)
+    xy = init
+    result = []
+    for count in range(n):
+      (qx, qy) = (xy[0], xy[1])
+      (best_d, best_i) = (None, None)
+      stack = [(0, 0)]                  # (squared distance to the bounding box, node index)
+      while stack:
+        (dn, k) = stack.pop()
+        if best_d is not None and dn > best_d: continue
+        node = nodes[k]
+        if node[3] is None:
+          for i in perm[node[1]:node[2]]:
+            if not alive[i]: continue
+            d = (pts[i][0]-qx)*(pts[i][0]-qx) + (pts[i][1]-qy)*(pts[i][1]-qy)
+            if best_d is None or d < best_d or (d == best_d and i < best_i):
+              (best_d, best_i) = (d, i)
+          continue
+        near = []
+        for c in (node[3], node[4]):
+          b = nodes[c][0]
+          if b is None: continue
+          dx = b[0]-qx if qx < b[0] else (qx-b[2] if qx > b[2] else 0)
+          dy = b[1]-qy if qy < b[1] else (qy-b[3] if qy > b[3] else 0)
+          d = dx*dx+dy*dy
+          if best_d is None or d <= best_d: near.append((d, c))
+        if len(near) == 2 and near[0][0] < near[1][0]:
+          near.reverse()                # visit the nearer child first.
+        stack.extend(near)
+      j = owner[best_i]
+      for c in range(first[j], first[j+1]):
+        alive[c] = False
+      for k in set(leaf[c] for c in range(first[j], first[j+1])):
+        while k is not None and self.kdtree_bbox(nodes, k, pts, perm, alive):
+          k = nodes[k][5]
+      path = paths[j]
+      if entry_at[best_i] == -1:
+        path = path[::-1]
+      elif entry_at[best_i]:
+        path = self.rotate(path, entry_at[best_i])
+      result.append(path)
+      xy = path[-1]
+    return result
+
+  def two_opt(self, paths, init=None, timeout=None, window=None):
+    """
+    Improve an ordering by reversing sub-sequences, as long as the travel distance decreases.
+    A reversed sub-sequence also reverses each path in it, so that only the two
+    connecting travel moves change. Candidates are limited to window paths ahead.
+    Stops after timeout seconds, the result is always valid.
+    """
+    if init is None: init = self._init
+    if timeout is None: timeout = self._timeout
+    if window is None: window = self._window
+    deadline = time.time() + timeout
+    n = len(paths)
+    seq = list(range(n))
+    flip = [False] * n
+    sx = [p[0][0] for p in paths]
+    sy = [p[0][1] for p in paths]
+    ex = [p[-1][0] for p in paths]
+    ey = [p[-1][1] for p in paths]
+
+    def dist(x1, y1, x2, y2):
+      return math.sqrt((x2-x1)*(x2-x1) + (y2-y1)*(y2-y1))
+
+    improved = True
+    while improved and time.time() < deadline:
+      improved = False
+      for i in range(n):
+        if time.time() > deadline: break
+        if i == 0:
+          (px, py) = (init[0], init[1])
+        else:
+          (px, py) = (ex[i-1], ey[i-1])
+        d_in = dist(px, py, sx[i], sy[i])
+        for j in range(i, min(n, i+window)):
+          delta = dist(px, py, ex[j], ey[j]) - d_in
+          if j < n-1:
+            delta += dist(sx[i], sy[i], sx[j+1], sy[j+1]) - dist(ex[j], ey[j], sx[j+1], sy[j+1])
+          if delta < -1e-9:
+            # reverse positions i..j, and swap start and end of each path there.
+            seq[i:j+1]  = seq[i:j+1][::-1]
+            flip[i:j+1] = [not f for f in flip[i:j+1][::-1]]
+            (sx[i:j+1], ex[i:j+1]) = (ex[i:j+1][::-1], sx[i:j+1][::-1])
+            (sy[i:j+1], ey[i:j+1]) = (ey[i:j+1][::-1], sy[i:j+1][::-1])
+            d_in = dist(px, py, sx[i], sy[i])
+            improved = True
+    return [paths[seq[k]][::-1] if flip[k] else paths[seq[k]] for k in range(n)]
+
+  def hilbert_index(self, order, x, y):
+    """
+    Position of the grid point (x, y) along a hilbert curve covering 2**order x 2**order cells.
+    x and y may be integers or numpy integer arrays.
+    """
+    n = 1 << order
+    d = 0
+    s = n >> 1
+    while s > 0:
+      rx = (x & s) > 0
+      ry = (y & s) > 0
+      if numpy is not None and isinstance(x, numpy.ndarray):
+        rx = rx.astype(numpy.int64)
+        ry = ry.astype(numpy.int64)
+        d = d + s * s * ((3 * rx) ^ ry)
+        mirror = (ry == 0) & (rx == 1)
+        x = numpy.where(mirror, n-1-x, x)
+        y = numpy.where(mirror, n-1-y, y)
+        (x, y) = (numpy.where(ry == 0, y, x), numpy.where(ry == 0, x, y))
+      else:
+        rx = int(rx)
+        ry = int(ry)
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+          if rx == 1:
+            x = n-1-x
+            y = n-1-y
+          (x, y) = (y, x)
+      s >>= 1
+    return d
+
+  def hilbert(self, paths, order=16):
+    """
+    Sort paths by the hilbert curve position of their start point.
+    Nearby paths are cut one after the other, without any search.
+    """
+    xs = [p[0][0] for p in paths]
+    ys = [p[0][1] for p in paths]
+    (x0, y0) = (min(xs), min(ys))
+    scale = ((1 << order) - 1) / max(max(xs)-x0, max(ys)-y0, 1e-3)
+    if numpy is not None:
+      gx = ((numpy.array(xs, dtype=numpy.float64) - x0) * scale).astype(numpy.int64)
+      gy = ((numpy.array(ys, dtype=numpy.float64) - y0) * scale).astype(numpy.int64)
+      d = self.hilbert_index(order, gx, gy)
+      return [paths[i] for i in numpy.argsort(d, kind='mergesort')]
+    d = [self.hilbert_index(order, int((xs[i]-x0)*scale), int((ys[i]-y0)*scale)) for i in range(len(paths))]
+    return [paths[i] for i in sorted(range(len(paths)), key=lambda i: d[i])]
+
+  def dedup(self, paths, eps=0.001):
+    """
+    Returns a new list of paths, where each piece of a line is cut only once.
+    Points are quantized to multiples of eps. Each segment is indexed by its line,
+    an exact integer tuple (dx, dy, offset) with dx, dy reduced by their gcd and
+    normalized in sign, so that both directions give the same key. Along that line,
+    the intervals already cut are kept sorted. A new segment only keeps the parts not
+    yet covered, in document order. Exact duplicates are the special case of full coverage.
+
+    The remaining segments of a path stay connected, a path is only split where something
+    was removed. A closed path with a gap is rotated to start after the gap.
+    Segments that are shorter than eps are kept. Collinear segments are only found, if their
+    quantized end points are exactly collinear, which is always true for horizontal and
+    vertical lines.
+    """
+    covered = {}        # line key -> sorted list of disjoint intervals [lo, hi], flattened.
+    result = []
+    for path in paths:
+      if len(path) < 2:
+        result.append(path)
+        continue
+      pieces = []       # output polylines of this path
+      cur = None
+      for k in range(len(path)-1):
+        (p0, p1) = (path[k], path[k+1])
+        for (a, b) in self.dedup_segment(covered, p0, p1, eps):
+          if a == 0.0:
+            pa = p0
+          else:
+            pa = [p0[0]+a*(p1[0]-p0[0]), p0[1]+a*(p1[1]-p0[1])]
+          if b == 1.0:
+            pb = p1
+          else:
+            pb = [p0[0]+b*(p1[0]-p0[0]), p0[1]+b*(p1[1]-p0[1])]
+          if cur is not None and cur[-1] is pa:
+            cur.append(pb)
+          else:
+            cur = [pa, pb]
+            pieces.append(cur)
+      if len(pieces) > 1 and pieces[0][0] is path[0] and pieces[-1][-1] is path[-1] and self.closed(path):
+        pieces[0] = pieces.pop() + pieces[0][1:]
+      result.extend(pieces)
+    return result
+
+  def dedup_segment(self, covered, p0, p1, eps):
+    """
+    Mark the segment p0 to p1 as cut. Returns the parts, that were not cut before,
+    as a list of (a, b) with 0 <= a < b <= 1, relative to the segment.
+    """
+    (x0, y0) = (int(round(p0[0]/eps)), int(round(p0[1]/eps)))
+    (x1, y1) = (int(round(p1[0]/eps)), int(round(p1[1]/eps)))
+    (dx, dy) = (x1-x0, y1-y0)
+    if dx == 0 and dy == 0: return [(0.0, 1.0)]
+    g = abs(gcd(dx, dy))
+    (dx, dy) = (dx//g, dy//g)
+    if dx < 0 or (dx == 0 and dy < 0): (dx, dy) = (-dx, -dy)
+    key = (dx, dy, dx*y0 - dy*x0)
+    # position along the line, in units of the reduced direction vector.
+    (t0, t1) = (dx*x0 + dy*y0, dx*x1 + dy*y1)
+    (lo, hi) = (min(t0, t1), max(t0, t1))
+    iv = covered.setdefault(key, [])
+    # iv is flattened [lo0, hi0, lo1, hi1, ...]. Find the intervals touching [lo, hi].
+    i = bisect.bisect_left(iv, lo)
+    if i % 2: i -= 1            # lo falls into the interval starting at iv[i-1].
+    j = bisect.bisect_right(iv, hi)
+    if j % 2: j += 1            # hi falls into the interval ending at iv[j].
+    free = []
+    pos = lo
+    for n in range(i, j, 2):
+      if iv[n] > pos: free.append((pos, iv[n]))
+      pos = max(pos, iv[n+1])
+    if pos < hi: free.append((pos, hi))
+    iv[i:j] = [min(lo, iv[i]) if i < j else lo, max(hi, iv[j-1]) if i < j else hi]
+    if free == [(lo, hi)]: return [(0.0, 1.0)]
+    # back to segment relative positions, in the direction of the segment.
+    span = float(t1 - t0)
+    parts = [((u-t0)/span, (v-t0)/span) for (u, v) in free]
+    if t1 < t0: parts = [(b, a) for (a, b) in reversed(parts)]
+    return [(max(a, 0.0), min(b, 1.0)) for (a, b) in parts]
+
+  def join(self, paths, eps=0.001, reverse=True):
+    """
+    Returns a new list of paths, where open paths are chained into longer paths,
+    if the end of one is within eps of the start of the other. With reverse=True,
+    paths may be reversed to make them fit. A chain stops when it becomes closed.
+    Closed paths and single points are kept as they are.
+    The end points are hashed into a grid of eps sized cells, so that each lookup
+    only needs to check 3x3 cells. Chains start in document order, and continue with
+    the first matching path in document order.
+    """
+    n = len(paths)
+    used = [False] * n
+    grid = {}
+
+    def cell(p):
+      return (int(p[0]//eps), int(p[1]//eps))
+
+    def find(p, end):
+      # an unused path with its end (0: start, -1: last point) near p. Returns (index, reversed) or None
+      (px, py) = (p[0], p[1])
+      (cx, cy) = (int(px//eps), int(py//eps))
+      best = None
+      for x in (cx-1, cx, cx+1):
+        for y in (cy-1, cy, cy+1):
+          entries = grid.get((x, y))
+          if not entries: continue
+          stale = False
+          for e in entries:
+            if used[e[0]]:
+              stale = True
+              continue
+            if e[1] != end and not reverse: continue
+            q = paths[e[0]][e[1]]
+            if abs(q[0]-px) <= eps and abs(q[1]-py) <= eps:
+              cand = (e[0], e[1] != end)
+              if best is None or cand < best: best = cand
+          if stale:
+            entries[:] = [e for e in entries if not used[e[0]]]
+      return best
+
+    def near(p, q):
+      return abs(p[0]-q[0]) <= eps and abs(p[1]-q[1]) <= eps
+
+    joinable = [len(path) > 1 and not self.closed(path, eps) for path in paths]
+    for j in range(n):
+      if joinable[j]:
+        for end in (0, -1):
+          c = cell(paths[j][end])
+          if c in grid:
+            grid[c].append((j, end))
+          else:
+            grid[c] = [(j, end)]
+
+    result = []
+    for j in range(n):
+      if used[j]: continue
+      used[j] = True
+      if not joinable[j]:
+        result.append(paths[j])
+        continue
+      tail = list(paths[j])
+      while not near(tail[0], tail[-1]):
+        e = find(tail[-1], 0)
+        if e is None: break
+        used[e[0]] = True
+        tail.extend(paths[e[0]][-2::-1] if e[1] else paths[e[0]][1:])
+      head = []         # pieces to prepend, in reverse order, each without its last point.
+      start = tail[0]
+      while not near(start, tail[-1]):
+        e = find(start, -1)
+        if e is None: break
+        used[e[0]] = True
+        piece = paths[e[0]][:0:-1] if e[1] else paths[e[0]][:-1]
+        head.append(piece)
+        start = piece[0]
+      result.append([p for piece in reversed(head) for p in piece] + tail)
+    return result
+
+  def simplify(self, paths, tolerance):
+    """
+    Returns a new list of paths, each simplified with simplify_path().
+    """
+    return [self.simplify_path(path, tolerance) for path in paths]
+
+  def simplify_path(self, path, tolerance):
+    """
+    Ramer-Douglas-Peucker decimation of a single path. tolerance is in mm.
+    The first and last point are always kept, closed paths stay closed.
+    Iterative with an explicit stack, so that paths of any length can be handled.
+    Long spans are searched with numpy, if available. The result is the same.
+    """
+    n = len(path)
+    if n < 3 or tolerance <= 0: return path
+    tol2 = tolerance * tolerance
+    keep = [False] * n
+    keep[0] = keep[n-1] = True
+    xy = None
+    if numpy is not None and n > 64:
+      xy = numpy.array(path, dtype=numpy.float64)
+    stack = [(0, n-1)]
+    while stack:
+      (a, b) = stack.pop()
+      if b - a < 2: continue
+      if xy is not None and b - a > 64:
+        (k, d2) = self.farthest_numpy(xy, a, b)
+      else:
+        (k, d2) = self.farthest(path, a, b)
+      if d2 > tol2:
+        keep[k] = True
+        stack.append((k, b))
+        stack.append((a, k))
+    return [path[k] for k in range(n) if keep[k]]
+
+  def farthest(self, path, a, b):
+    """
+    Returns (k, d2) of the point path[k], a < k < b, farthest from the segment path[a] to path[b],
+    and its squared distance. The first one wins in case of a tie.
+    """
+    (x1, y1) = (path[a][0], path[a][1])
+    dx = path[b][0] - x1
+    dy = path[b][1] - y1
+    l2 = dx*dx + dy*dy
+    (best_k, best_d2) = (a+1, -1.0)
+    for k in range(a+1, b):
+      (px, py) = (path[k][0], path[k][1])
+      if l2 == 0:
+        (ex, ey) = (px-x1, py-y1)
+      else:
+        t = ((px-x1)*dx + (py-y1)*dy) / l2
+        if t < 0:
+          t = 0.0
+        elif t > 1:
+          t = 1.0
+        (ex, ey) = (px-(x1+t*dx), py-(y1+t*dy))
+      d2 = ex*ex + ey*ey
+      if d2 > best_d2: (best_k, best_d2) = (k, d2)
+    return (best_k, best_d2)
+
+  def farthest_numpy(self, xy, a, b):
+    """
+    Same as farthest(), for a numpy array of points.
+    """
+    (x1, y1) = (xy[a,0], xy[a,1])
+    dx = xy[b,0] - x1
+    dy = xy[b,1] - y1
+    l2 = dx*dx + dy*dy
+    px = xy[a+1:b,0]
+    py = xy[a+1:b,1]
+    if l2 == 0:
+      ex = px-x1
+      ey = py-y1
+    else:
+      t = numpy.clip(((px-x1)*dx + (py-y1)*dy) / l2, 0.0, 1.0)
+      ex = px-(x1+t*dx)
+      ey = py-(y1+t*dy)
+    d2 = ex*ex + ey*ey
+    k = int(numpy.argmax(d2))
+    return (a+1+k, float(d2[k]))
+
+
+if __name__ == '__main__':
+  import random
+  from ruida import Ruida
+  random.seed(42)
+  paths = []
+  for n in range(2000):
+    x = random.uniform(0, 500)
+    y = random.uniform(0, 300)
+    paths.append([[x,y], [x+5,y], [x+5,y+5], [x,y+5], [x,y]])
+  rd = Ruida()
+  print("document order: travel %.1f mm" % rd.odometer(paths)[1])
+  for method in PathOpt.methods[1:]:
+    t = time.time()
+    p = PathOpt(method=method).order(paths)
+    print("%-8s: travel %.1f mm, %.2f sec" % (method, rd.odometer(p)[1], time.time()-t))
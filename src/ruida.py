@@ -1 +0,0 @@
-ruida/src/ruida.py
\ No newline at end of file
@@ -0,0 +1,1570 @@
+#! /usr/bin/python3
+#
+# (c) 2017 Patrick Himmelmann et.al.
+# 2017-05-21
+#
+# (c) 2017-11-24, juergen@fabmail.org
+#
+# The code is fully compatible with python 2.7 and 3.5
+#
+# High level methods:
+#  set(paths=[[..]], speed=.., power=[..], ...)
+#  write(fd), write_stream(fd)
+#  estimate()
+#
+# Intermediate methods:
+#  header(), body(), trailer()
+#  body_paths(), body_paths_numpy()
+#
+# Low level methods:
+#  encode_hex(), encode_relcoord(), encode_percent()
+#  encode_number() for e.g.: # Bottom_Right_E7_51 452.84mm 126.8mm           e7 51 00 00 1b 51 68 00 00 07 5e 50
+#  scramble()
+#
+# Some, but not all unscramble() decode_..() methods are also included.
+# A self test example (cutting the triange in a square) is included at the end.
+#
+# 2017-12-03, jw@fabmail.org
+#     v1.0 -- The test code produces a valid square_tri_test.rd, according to
+#             githb.com/kkaempf/rudida/bin/decode
+# 2017-12-11, jw@fabmail.org
+#     v1.2 -- Correct maxrel 8.191 found.
+#             Implemented Cut_Horiz, Cut_Vert, Move_Horiz, Move_Vert
+#             Updated encode_relcoord() to use encode_number(2)
+# 2017-12-13, jw@fabmail.org
+#     v1.3 -- added _forceabs = 100. Limit possible precision loss.
+# 2017-12-14, jw@fabmail.org
+#     v1.4 -- added bbox2moves() and paths2moves()
+# 2017-12-16, jw@fabmail.org
+#     v1.5 -- added interface to support multiple layer
+# 2017-12-18, jw@fabmail.org
+#     v1.6 -- encode_byte() encode_color() added.
+#             multi layer support in header() and body() done.
+# 2026-10-17
+#     v1.7 -- encode_hex() snippets and enc() format strings are parsed once
+#             and cached. body() emits precomputed opcode bytes per vertex.
+#             header(), body(), trailer() and enc() assemble their output in
+#             a RuidaBuffer(), avoiding quadratic bytes() concatenation.
+#             body_paths_numpy() encodes a layer with numpy array operations,
+#             used by body() if numpy is available. Same output as body_paths(),
+#             compared by test/bench_ruida.py.
+#             scramble_bytes() and unscramble_bytes() use translation tables,
+#             a bytearray() is converted in place.
+#             write_stream() writes in chunks, with bounded memory.
+#             Bounding box and odometer of each layer are computed while
+#             encoding, instead of extra passes over the paths.
+#             added _quantize = True. Relative moves are computed from
+#             integer micrometers, _forceabs is no longer needed.
+#             added estimate(), job time with acceleration and corner slowdown.
+#             added _processes. body() can encode path chunks in a process pool.
+#             added _cache. RuidaCache() keeps the geometry of unchanged layers on disk.
+
+import sys, os, stat, re, math, copy, itertools, multiprocessing
+import hashlib, json, struct, tempfile
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# python2 has a completely useless alias bytes = str. Fix this:
+if sys.version_info.major < 3:
+        def bytes(tupl):
+                "Minimalistic python3 compatible implementation used in python2."
+                return str(bytearray(tupl))
+
+class RuidaBuffer(bytearray):
+  """
+  Append-only output buffer for encoded instructions.
+  Appending with += is amortized O(1), as the underlying bytearray grows in
+  place. Repeated += on immutable bytes() copies all previous data each time.
+  """
+  def getvalue(self):
+    """ Returns the buffer contents as a bytes() object (a str() in python2). """
+    if sys.version_info.major < 3:
+      return str(self)
+    else:
+      return bytes(self)
+
+
+class RuidaLayer():
+  """
+  """
+  def __init__(self, paths=None, speed=None, power=None, bbox=None, color=[0,0,0], freq=20.0):
+    self._paths = paths
+
+    self._bbox  = bbox
+    self._speed = speed
+    self._power = power
+    self._color = color
+    self._freq  = freq
+
+    # Results of Ruida.iter_body(), computed while the paths are encoded:
+    self._paths_bbox = None     # boundingbox() of the paths, None if there are no points.
+    self._odo = None            # odometer() of the paths: [cut_distance, travel_distance]
+
+    # Result of Ruida.estimate():
+    self._time = None           # estimated run time in seconds.
+
+  def set(self, paths=None, speed=None, power=None, bbox=None, color=None, freq=None):
+    if paths is not None: self._paths = paths
+    if speed is not None: self._speed = speed
+    if power is not None: self._power = power
+    if bbox  is not None: self._bbox  = bbox
+    if color is not None: self._color = color
+    if freq  is not None: self._freq  = freq
+
+
+
+class RuidaCache():
+  """
+  Disk cache for the encoded geometry of RuidaLayer()s. Entries are files in
+  a directory, named by a hash of everything that goes into the geometry:
+  the paths, speed, power, color, freq and the encoder settings of Ruida.
+  A layer that was encoded before with the same key is read back from the
+  file instead of encoded again. The prolog of a layer is not cached, it
+  depends on the layer number.
+
+  Each file starts with a line of json, holding the bounding box and the
+  odometer of the layer, followed by the instruction bytes.
+
+  The total size of the files is limited to maxsize bytes. When it is
+  exceeded, the least recently used files are removed.
+  """
+  def __init__(self, directory=None, maxsize=256<<20):
+    if directory is None: directory = os.path.join(os.path.expanduser('~'), '.cache', 'thunderlaser')
+    self._dir = directory
+    self._maxsize = maxsize
+    self._suffix = '.rdb'
+
+  def key(self, rd, l, chunksize=None):
+    """
+    Returns the hex digest for RuidaLayer l, encoded by Ruida rd with
+    iter_body(chunksize=chunksize). With _processes > 1 the chunks start
+    with an absolute move, so the chunking is part of the key.
+    """
+    h = hashlib.sha1()
+    chunking = None
+    if rd._processes and rd._processes > 1: chunking = (rd._processes, chunksize or 1<<20)
+    params = (rd.__version__, rd._quantize, rd._forceabs, rd._maxrel, chunking, l._speed, l._power, l._color, l._freq)
+    h.update(repr(params).encode('ascii'))
+    for path in l._paths or []:
+      n = len(path)
+      h.update(struct.pack('<i%dd' % (2*n), n, *itertools.chain.from_iterable(path)))
+    return h.hexdigest()
+
+  def filename(self, key):
+    return os.path.join(self._dir, key + self._suffix)
+
+  def open_entry(self, key):
+    """
+    Returns an open file positioned after the json line, and the parsed json.
+    None if key is not in the cache, or the file is incomplete.
+    """
+    try:
+      fd = open(self.filename(key), 'rb')
+    except (IOError, OSError):
+      return None
+    try:
+      meta = json.loads(fd.readline().decode('ascii'))
+      if os.fstat(fd.fileno()).st_size - fd.tell() != meta['size']: raise ValueError("truncated")
+    except (ValueError, KeyError, IOError, OSError):
+      fd.close()
+      return None
+    return (fd, meta)
+
+  def peek(self, key):
+    """
+    Returns (bbox, odo) of a cached layer, without reading the geometry. None if not cached.
+    """
+    entry = self.open_entry(key)
+    if entry is None: return None
+    entry[0].close()
+    return (entry[1]['bbox'], entry[1]['odo'])
+
+  def get(self, key, chunksize=1<<20):
+    """
+    Returns (bbox, odo, chunks), or None if key is not in the cache.
+    chunks is a generator, reading the instruction bytes from the file.
+    """
+    entry = self.open_entry(key)
+    if entry is None: return None
+    (fd, meta) = entry
+    try:
+      os.utime(fd.name, None)           # most recently used.
+    except OSError:
+      pass
+
+    def chunks(fd):
+      try:
+        while True:
+          data = fd.read(chunksize)
+          if not data: break
+          yield data
+      finally:
+        fd.close()
+    return (meta['bbox'], meta['odo'], chunks(fd))
+
+  def writer(self, key):
+    """
+    Returns a RuidaCacheWriter() for a new entry. None, if the directory cannot be written.
+    """
+    try:
+      if not os.path.isdir(self._dir): os.makedirs(self._dir)
+      return RuidaCacheWriter(self, key)
+    except (IOError, OSError):
+      return None
+
+  def prune(self):
+    """
+    Remove the least recently used files, until the total size is within _maxsize.
+    """
+    entries = []
+    try:
+      for name in os.listdir(self._dir):
+        if not name.endswith(self._suffix): continue
+        st = os.stat(os.path.join(self._dir, name))
+        entries.append((st.st_mtime, st.st_size, name))
+    except OSError:
+      return
+    total = sum([e[1] for e in entries])
+    for (mtime, size, name) in sorted(entries):
+      if total <= self._maxsize: break
+      try:
+        os.unlink(os.path.join(self._dir, name))
+        total -= size
+      except OSError:
+        pass
+
+
+class RuidaCacheWriter():
+  """
+  Stores an entry of RuidaCache() in a temporary file. The entry becomes
+  visible with commit(). close() removes the temporary file, if it was not committed.
+  The json line is written last, into space reserved at the start of the file.
+  """
+  _metasize = 256
+
+  def __init__(self, cache, key):
+    self._cache = cache
+    self._key = key
+    (fd, self._tmpname) = tempfile.mkstemp(suffix='.tmp', dir=cache._dir)
+    self._fd = os.fdopen(fd, 'wb')
+    self._fd.write(b' ' * self._metasize)
+    self._size = 0
+
+  def write(self, data):
+    self._fd.write(data)
+    self._size += len(data)
+
+  def commit(self, bbox, odo):
+    meta = json.dumps({ 'bbox': bbox, 'odo': odo, 'size': self._size })
+    if len(meta) >= self._metasize: return
+    self._fd.seek(0)
+    self._fd.write((meta + ' ' * (self._metasize - 1 - len(meta)) + '\n').encode('ascii'))
+    self._fd.close()
+    try:
+      os.rename(self._tmpname, self._cache.filename(self._key))
+      self._tmpname = None
+    except OSError:
+      pass              # windows cannot rename to an existing file. Same contents anyway.
+    self._cache.prune()
+
+  def close(self):
+    if not self._fd.closed: self._fd.close()
+    if self._tmpname:
+      try:
+        os.unlink(self._tmpname)
+      except OSError:
+        pass
+      self._tmpname = None
+
+
+class Ruida():
+  """
+   Assemble a valid *.rd file with multiple layers. Each layer has the following parameters:
+
+   paths = [
+            [[0,0], [50,0], [50,50], [0,50], [0,0]],
+            [[12,10], [38,25], [12,40], [12,10]]
+           ]
+        This example is a 50 mm square, with a 30 mm triangle inside.
+
+   speed = 30
+   speed = [ 1000, 30 ]
+        Movement speed in mm/sec.
+        Can be scalar or sequence. A scalar NUMBER is the same as a
+        sequence of [1000, NUMBER]. The first value of the sequence is
+        used for travelling with lasers off.
+        The second value is with laser1 on.
+
+   power = [ 50, 70 ]
+        Values in percent. The first value is the minimum power used near
+        corners or start and end of lines.
+        The second value is the maximum power used in the middle of long
+        straight lines, this compensates for accellerated machine
+        movements.  Additional pairs can be specified for a second, third,
+        and fourth laser.
+
+   bbox = [[0,0], [50,50]]
+        Must span the rectangle that contains all points in the paths.
+        Can also be ommited and/or computed by the boundingbox() method.
+        The first point ([xmin, ymin] aka "top left") of the bounding
+        box is ususally [0,0] so that the start position can be easily
+        adjusted at the machine.
+
+   color = [0,255,0]
+        Give a display color for the layer. This is used in the preview
+        to visualize different layers in different colors.
+        Expected as a triple [RED, GREEN, BLUE] each in [0..255]
+  """
+
+  __version__ = "1.7"
+
+  # Parsed encode_hex() snippets and compiled enc() format strings.
+  # Shared by all instances, as the snippets are mostly constants in this file.
+  _hex_cache = {}
+  _hex_cache_max = 1000
+  _fmt_cache = {}
+
+  # 256 byte translation tables for scramble_bytes() and unscramble_bytes(),
+  # built on first use from scramble() and unscramble().
+  _scramble_table = None
+  _unscramble_table = None
+
+  def __init__(self, layers=None):
+    if layers is None: layers = []
+    self._layers = layers
+
+    self._odo = None
+    self._globalbbox = None
+
+    self._header = None
+    self._body = None
+    self._trailer = None
+
+    # Must do an absolute mov/cut every now and then to avoid precision loss.
+    # Worst case estimation: A deviation of 0.1mm is acceptable, this is circa the
+    # diameter of the laser beam. Precision loss can occur due to rounding of the last decimal,
+    # Which can contribute less than 0.001 mm each time. Thus a helpful value should be around
+    # 100. We want the value as high as possible to safe code size, but slow enough to keep the
+    # precision loss invisible.
+    #
+    # Set to 1, to disable relative moves.
+    # Set to 0, to never force an absolute move. Allows potentially infinite precision loss.
+    #
+    # Not used with _quantize.
+    self._forceabs = 100
+
+    # Truncate all coordinates to integer micrometers, before computing relative moves.
+    # The sum of relative moves then arrives exactly at the next absolute position, there is
+    # no precision loss. Absolute moves are only needed where a difference exceeds the
+    # range of encode_relcoord(). Horizontal and vertical moves are detected in micrometers.
+    # Set to False, for the float differences and the _forceabs rule of v1.6.
+    self._quantize = True
+
+    # 8.191 encodes as 3f 7f. -8.191 encodes as 40 01
+    self._maxrel = 8.191
+
+    # Geometry encoder used by body(): 'python', 'numpy', or None to use numpy when available.
+    self._engine = None
+
+    # Number of worker processes for body(). 0 or 1 encodes in this process.
+    # Chunks of paths are encoded in parallel, see iter_geometry_parallel().
+    self._processes = 0
+
+    # A RuidaCache() for the geometry of the layers, or None.
+    self._cache = None
+
+    # Machine dynamics for estimate(). Acceleration in mm/s^2, the same for travel and cut.
+    # Corners are passed at the speed where a circular blend would deviate by _junction mm
+    # from the corner point (the junction deviation model of grbl).
+    self._accel = 3000.0
+    self._junction = 0.05
+
+  def addLayer(self, layer):
+    self._layers.append(layer)
+
+  def set(self, nlayers=None, layer=0, paths=None, speed=None, power=None, globalbbox=None, bbox=None, freq=None, odo=None, color=None, forceabs=None, engine=None, quantize=None, accel=None, junction=None, processes=None, cache=None):
+    if forceabs   is not None: self._forceabs   = forceabs
+    if cache      is not None: self._cache      = cache
+    if processes  is not None: self._processes  = processes
+    if accel      is not None: self._accel      = accel
+    if junction   is not None: self._junction   = junction
+    if quantize   is not None: self._quantize   = quantize
+    if engine     is not None: self._engine     = engine
+    if globalbbox is not None: self._globalbbox = globalbbox
+    if odo        is not None: self._odo        = odo
+
+    if layer >= len(self._layers): nlayers = layer+1
+
+    if nlayers  is not None:
+      if nlayers < len(self._layers): self._layers = self._layers[0:nlayers]
+      while nlayers > len(self._layers): self.addLayer(RuidaLayer())
+
+    if paths is not None: self._layers[layer].set(paths = paths)
+    if speed is not None: self._layers[layer].set(speed = speed)
+    if power is not None: self._layers[layer].set(power = power)
+    if bbox  is not None: self._layers[layer].set(bbox  = bbox)
+    if freq  is not None: self._layers[layer].set(freq  = freq)
+    if color is not None: self._layers[layer].set(color = color)
+
+
+  def write(self, fd, scramble=True, chunksize=None):
+    """
+    Write a fully prepared object into a file (or raise ValueError()s
+    for missing attributes). The object must be prepared by passing
+    parameters to __init__ or set().
+
+    The filedescriptor should be opened in "wb" mode.
+
+    The file format is normally scrambled. Files written with
+    scramble=False are not understood by the machine, but may be
+    helpful for debugging.
+
+    With a chunksize, the work is done by write_stream().
+    """
+    if chunksize: return self.write_stream(fd, scramble=scramble, chunksize=chunksize)
+
+    # body() runs first, it also computes bounding boxes and odometers of the layers.
+    if not self._body:
+      if self._layers:
+        self._body = self.body(self._layers)
+    if not self._header:
+      if self._layers:
+        for l in self._layers:
+          if l._bbox is None and l._paths: l._bbox = self.layer_bbox(l)
+      self._header = self.header(self._layers)
+    if not self._odo:
+      if self._layers:
+        for l in self._layers:
+          self.odoAdd(self.layer_odo(l))
+    if not self._trailer: self._trailer = self.trailer(self._odo)
+
+    if not self._header:  raise ValueError("header(_bbox,_speed,_power,_freq) not initialized")
+    if not self._body:    raise ValueError("body(_layers) not initialized")
+    if not self._trailer: raise ValueError("trailer() not initialized")
+
+    contents = RuidaBuffer()
+    contents += self._header
+    contents += self._body
+    contents += self._trailer
+    if scramble: self.scramble_bytes(contents)      # in place
+    fd.write(contents)
+
+  def write_stream(self, fd, scramble=True, chunksize=1<<20):
+    """
+    Same as write(), but the body is encoded, scrambled and written in
+    chunks of about chunksize bytes. Memory use does not grow with the size
+    of the job. The body is not kept in self._body. The output is identical.
+
+    The header needs the bounding boxes of the layers, before any geometry.
+    If fd is a regular file, a header with preliminary bounding boxes is
+    written first, and overwritten with the correct header at the end.
+    Otherwise, e.g. for a device node, the bounding boxes are computed in a
+    pre-pass over the paths. The trailer comes last, thus the odometer is
+    simply taken from the layers after they are written.
+    """
+    if not self._layers: raise ValueError("body(_layers) not initialized")
+
+    backpatch = []
+    if not self._header:
+      backpatch = [l for l in self._layers if l._bbox is None and l._paths]
+      if not self.seekable(fd):
+        for l in backpatch: l._bbox = self.cached_bbox(l, chunksize) or self.boundingbox(l._paths)
+        backpatch = []
+      for l in backpatch: l._bbox = [[0,0], [0,0]]        # encodes with the same length.
+      self._header = self.header(self._layers)
+    if backpatch: header_pos = fd.tell()
+
+    out = RuidaBuffer()
+    def flush(out):
+      if scramble: self.scramble_bytes(out)     # in place
+      fd.write(out)
+      del out[:]
+
+    out += self._header
+    for data in self.iter_body(self._layers, chunksize=chunksize):
+      out += data
+      if len(out) >= chunksize: flush(out)
+
+    if not self._odo:
+      for l in self._layers:
+        self.odoAdd(self.layer_odo(l))
+    if not self._trailer: self._trailer = self.trailer(self._odo)
+    out += self._trailer
+    flush(out)
+
+    if backpatch:
+      for l in backpatch: l._bbox = l._paths_bbox
+      header = self.header(self._layers)
+      if len(header) != len(self._header): raise ValueError("header length changed, cannot patch")
+      self._header = header
+      out += header
+      end_pos = fd.tell()
+      fd.seek(header_pos)
+      flush(out)
+      fd.seek(end_pos)
+
+  def seekable(self, fd):
+    """
+    True if fd is a regular file, or an in-memory file object that can seek.
+    Device nodes are never seeked, even if the system would allow it.
+    """
+    try:
+      return stat.S_ISREG(os.fstat(fd.fileno()).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+      pass
+    try:
+      return fd.seekable()
+    except AttributeError:
+      return False
+
+  def cached_bbox(self, l, chunksize=None):
+    """
+    Returns the bounding box of the paths of RuidaLayer l from the _cache,
+    without reading the geometry. None if not available.
+    """
+    if self._cache is None: return None
+    hit = self._cache.peek(self._cache.key(self, l, chunksize))
+    if hit is None: return None
+    return hit[0]
+
+  def layer_bbox(self, l):
+    """
+    Returns the bounding box of the paths of RuidaLayer l. The result of
+    body() is used, if available. Otherwise boundingbox() is called.
+    """
+    if l._paths_bbox is not None: return l._paths_bbox
+    return self.boundingbox(l._paths)
+
+  def layer_odo(self, l):
+    """
+    Returns the odometer of the paths of RuidaLayer l. The result of
+    body() is used, if available. Otherwise odometer() is called.
+    """
+    if l._odo is not None: return l._odo
+    return self.odometer(l._paths)
+
+  def odometer(self, paths=None, init=[0,0], return_home=False):
+    """
+    Returns a list of two values: [ cut_distance, travel_distance ]
+    Note that these distances are subject to path ordering.
+    Call this after all optimizations.
+    """
+    if paths is None: paths = self._paths
+    if paths is None: raise ValueError("no paths")
+
+    def dist_xy(p1, p2):
+      dx = p2[0] - p1[0]
+      dy = p2[1] - p1[1]
+      return math.sqrt(dx*dx+dy*dy)
+
+    cut_d = 0
+    trav_d = 0
+    xy = init
+    for path in paths:
+      traveling=True
+      for point in path:
+        if traveling:
+          trav_d += dist_xy(xy, point)
+          xy = point
+          traveling = False
+        else:
+          cut_d += dist_xy(xy, point)
+          xy = point
+    if return_home:
+      trav_d += dist_xy(xy, init)
+    return [ cut_d, trav_d ]
+
+  def odoAdd(self, odo):
+    if self._odo is None:
+      self._odo = copy.copy(odo)        # we change values later. Thus we need a copy.
+    else:
+      for n in range(len(odo)):
+        self._odo[n] += odo[n]
+
+  def estimate(self, layers=None, init=[0,0]):
+    """
+    Estimate the run time of the job in seconds. Returns a dict
+      { 'layers': [ seconds_layer0, seconds_layer1, ... ], 'total': seconds }
+    and stores the time of each layer in its _time attribute.
+
+    Each layer starts at init, like odometer(). Travel moves start and end at
+    standstill, at the travel speed (speed[0]). Paths are cut at the laser
+    speed (speed[1]), starting and ending at standstill. In between, each
+    corner limits the speed according to _junction, and speed changes are
+    limited by _accel. Machine overhead, e.g. for switching the laser, is not modelled.
+    """
+    if layers is None: layers = self._layers
+    times = []
+    for l in layers:
+      speed = copy.copy(l._speed)
+      if speed is None: raise ValueError("layer speed not initialized")
+      if type(speed) == float or type(speed) == int: speed = [1000, speed]
+      paths = [path for path in (l._paths or []) if len(path)]
+      if numpy is not None:
+        l._time = self.estimate_paths_numpy(paths, speed[0], speed[1], init)
+      else:
+        l._time = self.estimate_paths(paths, speed[0], speed[1], init)
+      times.append(l._time)
+    return { 'layers': times, 'total': sum(times) }
+
+  def motion_time(self, dist, w0, w1, vmax, accel):
+    """
+    Time to move dist mm, entering with speed sqrt(w0) and leaving with sqrt(w1),
+    not exceeding vmax, with a trapezoidal (or triangular) speed profile.
+    Speeds are passed squared. w0 and w1 must be reachable from each other.
+    """
+    wpeak = (2*accel*dist + w0 + w1) * 0.5
+    if wpeak <= vmax*vmax:
+      return (2*math.sqrt(wpeak) - math.sqrt(w0) - math.sqrt(w1)) / accel
+    ramps = (vmax*vmax - w0) / (2*accel) + (vmax*vmax - w1) / (2*accel)
+    return (2*vmax - math.sqrt(w0) - math.sqrt(w1)) / accel + (dist - ramps) / vmax
+
+  def junction_limit(self, ux0, uy0, ux1, uy1, vmax):
+    """
+    Squared speed limit at a corner between the unit directions (ux0, uy0) and (ux1, uy1).
+    """
+    cos_theta = -(ux0*ux1 + uy0*uy1)
+    sin_half = math.sqrt(max(0.5*(1.0-cos_theta), 0.0))
+    if sin_half > 0.999999: return vmax*vmax
+    return min(self._accel * self._junction * sin_half / (1.0-sin_half), vmax*vmax)
+
+  def estimate_paths(self, paths, travelspeed, laserspeed, init=[0,0]):
+    """
+    Run time of paths in seconds, as described in estimate().
+    A forward and a backward pass limit the squared speed at each point
+    to what can be reached from the previous and the next standstill.
+    """
+    a = self._accel
+    t = 0.0
+    xy = init
+    for path in paths:
+      t += self.motion_time(math.hypot(path[0][0]-xy[0], path[0][1]-xy[1]), 0.0, 0.0, travelspeed, a)
+      seg = []                  # (length, ux, uy) of each segment with a length
+      for k in range(1, len(path)):
+        dx = path[k][0] - path[k-1][0]
+        dy = path[k][1] - path[k-1][1]
+        d = math.hypot(dx, dy)
+        if d > 0: seg.append((d, dx/d, dy/d))
+      xy = path[-1]
+      if not seg: continue
+      n = len(seg)
+      w = [0.0] * (n+1)           # squared speed at the points between segments
+      for k in range(1, n):
+        w[k] = self.junction_limit(seg[k-1][1], seg[k-1][2], seg[k][1], seg[k][2], laserspeed)
+      for k in range(1, n+1):
+        w[k] = min(w[k], w[k-1] + 2*a*seg[k-1][0])
+      for k in range(n-1, -1, -1):
+        w[k] = min(w[k], w[k+1] + 2*a*seg[k][0])
+      for k in range(n):
+        t += self.motion_time(seg[k][0], w[k], w[k+1], laserspeed, a)
+    return t
+
+  def estimate_paths_numpy(self, paths, travelspeed, laserspeed, init=[0,0]):
+    """
+    Same as estimate_paths(), with numpy array operations.
+    The passes are recurrences w[k+1] = min(limit[k+1], w[k] + 2*a*dist[k]), these are
+    solved with prefix sums S of 2*a*dist as w[k] = S[k] + minimum.accumulate(limit - S)[k].
+    """
+    if not paths: return 0.0
+    a = self._accel
+    lens = numpy.array([len(path) for path in paths])
+    xy = numpy.array(list(itertools.chain.from_iterable(paths)), dtype=numpy.float64).reshape(-1, 2)
+    last = numpy.cumsum(lens) - 1
+    first = last - lens + 1
+
+    # travel moves, from the end of the previous path to the start of each path.
+    prev = numpy.vstack((numpy.array(init, dtype=numpy.float64).reshape(1, 2), xy[last[:-1]]))
+    dist = numpy.hypot(xy[first,0]-prev[:,0], xy[first,1]-prev[:,1])
+    t = self.motion_time_numpy(dist, 0.0, 0.0, travelspeed, a).sum()
+
+    # cut segments, without zero length segments and without the gaps between paths.
+    d = numpy.diff(xy, axis=0)
+    pathid = numpy.repeat(numpy.arange(len(lens)), lens)
+    dist = numpy.hypot(d[:,0], d[:,1])
+    keep = (pathid[1:] == pathid[:-1]) & (dist > 0)
+    d = d[keep]
+    dist = dist[keep]
+    pathid = pathid[1:][keep]
+    n = len(dist)
+    if n == 0: return float(t)
+    ux = d[:,0] / dist
+    uy = d[:,1] / dist
+
+    # squared speed limit at the n+1 points between segments. 0 where a path starts or ends.
+    limit = numpy.zeros(n+1)
+    cos_theta = -(ux[:-1]*ux[1:] + uy[:-1]*uy[1:])
+    sin_half = numpy.sqrt(numpy.maximum(0.5*(1.0-cos_theta), 0.0))
+    straight = sin_half > 0.999999
+    j = a * self._junction * sin_half / numpy.where(straight, 1.0, 1.0-sin_half)
+    j = numpy.where(straight, laserspeed*laserspeed, numpy.minimum(j, laserspeed*laserspeed))
+    limit[1:-1] = numpy.where(pathid[1:] == pathid[:-1], j, 0.0)
+
+    S = numpy.concatenate(([0.0], numpy.cumsum(2*a*dist)))
+    fwd = S + numpy.minimum.accumulate(limit - S)
+    bwd = numpy.minimum.accumulate((limit + S)[::-1])[::-1] - S
+    w = numpy.maximum(numpy.minimum(fwd, bwd), 0.0)
+    t += self.motion_time_numpy(dist, w[:-1], w[1:], laserspeed, a).sum()
+    return float(t)
+
+  def motion_time_numpy(self, dist, w0, w1, vmax, accel):
+    """
+    Same as motion_time(), for numpy arrays.
+    """
+    wpeak = (2*accel*dist + w0 + w1) * 0.5
+    tri = (2*numpy.sqrt(wpeak) - numpy.sqrt(w0) - numpy.sqrt(w1)) / accel
+    ramps = (vmax*vmax - w0) / (2*accel) + (vmax*vmax - w1) / (2*accel)
+    trap = (2*vmax - numpy.sqrt(w0) - numpy.sqrt(w1)) / accel + (dist - ramps) / vmax
+    return numpy.where(wpeak <= vmax*vmax, tri, trap)
+
+  def paths2moves(self, paths=None):
+    """
+    Returns a list of one-element-lists, each point in any of the
+    sub-paths as a its own list. This is technique generates
+    only move instructions in the rd output (laser inactive).
+    """
+    if paths is None: paths = self._paths
+    if paths is None: raise ValueError("no paths")
+    moves = []
+    for path in paths:
+      for point in path:
+        moves.append([[point[0], point[1]]])
+    return moves
+
+  def boundingbox(self, paths=None):
+    """
+    Returns a list of two pairs [[xmin, ymin], [xmax, ymax]]
+    that spans the rectangle containing all points found in paths.
+    If no parameter is given, the _paths of the object are examined.
+    """
+    if paths is None: paths = self._paths
+    if paths is None: raise ValueError("no paths")
+    xmin = xmax = paths[0][0][0]
+    ymin = ymax = paths[0][0][1]
+    for path in paths:
+      for point in path:
+        if point[0] > xmax: xmax = point[0]
+        if point[0] < xmin: xmin = point[0]
+        if point[1] > ymax: ymax = point[1]
+        if point[1] < ymin: ymin = point[1]
+    return [[xmin, ymin], [xmax, ymax]]
+
+  def bbox_combine(self, bbox1, bbox2):
+    """
+    returns the boundingbox of two bounding boxes.
+    """
+    if bbox1 is None: return bbox2
+    if bbox2 is None: return bbox1
+    x0 = min(bbox1[0][0], bbox2[0][0])
+    y0 = min(bbox1[0][1], bbox2[0][1])
+    x1 = max(bbox1[1][0], bbox2[1][0])
+    y1 = max(bbox1[1][1], bbox2[1][1])
+    return [[x0, y0], [x1, y1]]
+
+  def bbox2moves(self, bbox):
+    """
+    bbox = [[x0, y0], [x1, y1]]
+    """
+    x0 = bbox[0][0]
+    y0 = bbox[0][1]
+    x1 = bbox[1][0]
+    y1 = bbox[1][1]
+    return [[[x0,y0]], [[x1,y0]], [[x1,y1]], [[x0,y1]], [[x0, y0]]]
+
+  def body(self, layers):
+    """
+    Convert a set of paths (one set per layer) into lasercut instructions.
+    Each layer has a prolog, that directly sets speed and powers.
+
+    The geometry is encoded by body_paths_numpy() if the numpy module is
+    available, otherwise by body_paths(). See also set(engine=...).
+
+    Returns the binary instruction data.
+    """
+    return b''.join(self.iter_body(layers))
+
+  def iter_body(self, layers, chunksize=None):
+    """
+    Generator for the instruction data of body(). Without a chunksize, the
+    prolog and the geometry of each layer are yielded as one piece each.
+    With a chunksize, the geometry of a layer is yielded in pieces of about
+    chunksize bytes. Paths are not split, thus a single long path can
+    exceed chunksize. The output is the same in both cases.
+
+    In the same pass over the points, the bounding box and the odometer of
+    each layer are computed. When a layer is done, they are available as
+    its _paths_bbox and _odo attributes.
+
+    With a _cache, the geometry of unchanged layers is read back from the
+    cache, and the geometry of all other layers is stored there.
+    With _processes > 1, the geometry is encoded by iter_geometry_parallel().
+    """
+    engine = self.body_engine()
+    keys = [None] * len(layers)
+    if self._cache is not None: keys = [self._cache.key(self, l, chunksize) for l in layers]
+    hits = [self._cache.get(k) if k else None for k in keys]
+    todo = [layers[i] for i in range(len(layers)) if hits[i] is None]
+
+    if self._processes and self._processes > 1:
+      source = self.iter_geometry_parallel(todo, chunksize, engine)
+    else:
+      source = self.iter_geometry(todo, chunksize, engine)
+
+    try:
+      # for lnum in reversed(range(len(layers))):       # Can be permuted, lower lnum's are processed first. Always.
+      for lnum in range(len(layers)):
+        l = layers[lnum]
+        yield self.body_prolog(lnum, l)
+
+        if hits[lnum] is not None:
+          (l._paths_bbox, l._odo, chunks) = hits[lnum]
+          for data in chunks:
+            yield data
+          continue
+
+        store = self._cache.writer(keys[lnum]) if keys[lnum] else None
+        try:
+          for data in source:
+            if data is None: break      # end of layer l
+            if store: store.write(data)
+            yield data
+          if store: store.commit(l._paths_bbox, l._odo)
+        finally:
+          if store: store.close()
+    finally:
+      source.close()
+
+  def iter_geometry(self, layers, chunksize, engine):
+    """
+    Generator for the geometry of the layers, without prologs. None is yielded
+    at the end of each layer, after its _paths_bbox and _odo attributes are set.
+    """
+    for l in layers:
+      state = self.body_state()
+      for paths in self.path_batches(l._paths, chunksize):
+        yield self.body_batch(paths, state, engine)
+      l._paths_bbox = state['bbox']
+      l._odo = state['odo']
+      yield None
+
+  def iter_geometry_parallel(self, layers, chunksize, engine):
+    """
+    Same as iter_geometry(), but the paths of all layers are split into chunks
+    of about chunksize bytes (default 1MB), that are encoded by a pool of _processes
+    worker processes. The results are yielded in order.
+
+    A chunk continues from the last point of the previous chunk. With _quantize
+    (or _forceabs = 0) this is all the state the encoder needs, and the output
+    is identical to iter_geometry(). Otherwise, a chunk starts with an absolute
+    instruction, as if the _forceabs counter had just expired there.
+    The odometer of a layer is summed per chunk, it may differ from iter_geometry()
+    in the last digits.
+    """
+    if not chunksize: chunksize = 1<<20
+    config = { '_quantize': self._quantize, '_forceabs': self._forceabs, '_maxrel': self._maxrel }
+
+    tasks = []                  # (lnum, args) for each chunk, in order.
+    for lnum in range(len(layers)):
+      last = None
+      for paths in self.path_batches(layers[lnum]._paths, chunksize):
+        state = self.body_state()
+        state['last'] = last
+        if last is not None and not self._quantize and self._forceabs > 0:
+          state['relcounter'] = self._forceabs          # start with an absolute instruction
+        tasks.append((lnum, (config, engine, paths, state)))
+        for path in paths:
+          if len(path): last = path[-1]
+
+    # At most maxpending chunks are submitted ahead of the consumer, so that
+    # encoded chunks do not pile up in memory when the output is slow.
+    maxpending = 2 * max(1, self._processes)
+    pool = multiprocessing.Pool(self._processes)
+    try:
+      pending = []              # outstanding results, in task order.
+      submitted = 0
+      k = 0
+      for lnum in range(len(layers)):
+        l = layers[lnum]
+        (bbox, odo) = (None, [0.0, 0.0])
+        while k < len(tasks) and tasks[k][0] == lnum:
+          while submitted < len(tasks) and len(pending) < maxpending:
+            pending.append(pool.apply_async(_body_chunk, (tasks[submitted][1],)))
+            submitted += 1
+          (geometry, state) = pending.pop(0).get()
+          bbox = self.bbox_combine(bbox, state['bbox'])
+          odo = [odo[0] + state['odo'][0], odo[1] + state['odo'][1]]
+          k += 1
+          yield geometry
+        l._paths_bbox = bbox
+        l._odo = odo
+        yield None
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def body_engine(self):
+    """
+    Returns the geometry encoder to use, 'python' or 'numpy', according to _engine.
+    """
+    engine = self._engine
+    if engine is None: engine = 'python' if numpy is None else 'numpy'
+    if engine not in ('python', 'numpy'): raise ValueError("unknown engine: "+str(engine))
+    if engine == 'numpy' and numpy is None: raise ValueError("engine 'numpy' requires the numpy module")
+    return engine
+
+  def body_batch(self, paths, state, engine):
+    """
+    Encode a batch of paths with body_paths_numpy() or body_paths(),
+    falling back to body_paths(), if numpy cannot handle the coordinates.
+    """
+    geometry = None
+    if engine == 'numpy': geometry = self.body_paths_numpy(paths, state)
+    if geometry is None:  geometry = self.body_paths(paths, state)
+    return geometry
+
+  def body_state(self):
+    """
+    Returns the initial state for encoding the paths of a layer with
+    body_paths() or body_paths_numpy(). The encoders update it in place:
+      'last':       the last point encoded, None at the start.
+      'relcounter': relative instructions since the last absolute one.
+      'bbox':       boundingbox() of the points encoded so far, or None.
+      'odo':        odometer() of the points encoded so far.
+    """
+    return { 'last': None, 'relcounter': 0, 'bbox': None, 'odo': [0.0, 0.0] }
+
+  def path_batches(self, paths, chunksize=None):
+    """
+    Generator splitting paths into lists of consecutive paths, with
+    about chunksize bytes of instruction data each. This is estimated
+    as 11 bytes per point, the size of an absolute move or cut.
+    Without a chunksize, paths is returned as one batch.
+    """
+    if not chunksize:
+      yield paths
+      return
+    batch = []
+    npoints = 0
+    for path in paths:
+      batch.append(path)
+      npoints += len(path)
+      if npoints * 11 >= chunksize:
+        yield batch
+        batch = []
+        npoints = 0
+    if batch: yield batch
+
+  def body_prolog(self, lnum, l):
+    """
+    Returns the instructions starting layer number lnum. These set speed
+    and power for the RuidaLayer l.
+    """
+    # CAUTION: keep in sync with header()
+    power = copy.copy(l._power)
+    if len(power) % 2: raise ValueError("Even number of elements needed in power[]")
+    while len(power) < 8: power += power[-2:]
+
+    speed = copy.copy(l._speed)
+    if type(speed) == float or type(speed) == int: speed = [1000, speed]
+    travelspeed = speed[0]
+    laserspeed = speed[1]
+
+    ################## Body Prolog Start #######################
+    data = RuidaBuffer()
+    data += self.enc('-b-', ["""
+        ca 01 00                                        # Flags_CA_01 00
+        ca 02""", lnum, """                             # CA 02 Layer:0 priority?
+        ca 01 30                                        # Flags_CA_01 30
+        ca 01 10                                        # Flags_CA_01 10
+        ca 01 13                                        # Blow_on
+        """])
+
+    ##   '-p-p-p-p-'
+    #    c6 12 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
+    #    c6 13 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
+    #    c6 50 """, 100, """             # Cut_through_power1 100%
+    #    c6 51 """, 100, """             # Cut_through_power2 100%
+    #    c6 55 """, 100, """             # Cut_through_power3 100%
+    #    c6 56 """, 100, """             # Cut_through_power4 100%
+    ## if the Cut_through_powers are not present, then c6 15 and c6 16 instead.
+
+    data += self.enc('-n-p-p-p-p-p-p-p-p-', ["""
+        c9 02 """, laserspeed, """      # Speed_C9 30.0mm/s
+        c6 15 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
+        c6 16 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
+        c6 01 """, power[0], """        # Laser_1_Min_Pow_C6_01 0%
+        c6 02 """, power[1], """        # Laser_1_Max_Pow_C6_02 0%
+        c6 21 """, power[2], """        # Laser_2_Min_Pow_C6_21 0%
+        c6 22 """, power[3], """        # Laser_2_Max_Pow_C6_22 0%
+        c6 05 """, power[4], """        # Laser_3_Min_Pow_C6_05 1%
+        c6 06 """, power[5], """        # Laser_3_Max_Pow_C6_06 0%
+        c6 07 """, power[6], """        # Laser_4_Min_Pow_C6_07 0%
+        c6 08 """, power[7], """        # Laser_4_Max_Pow_C6_08 0%
+        ca 03 01                        # Layer_CA_03 01
+        ca 10 00                        # CA 10 00
+        """])
+    ################## Body Prolog End #######################
+
+    return data.getvalue()
+
+  def relok(self, last, point):
+    """
+    Determine, if we can emit a relative move or cut command.
+    An absolute move or cut costs 11 bytes,
+    a relative one costs 5 bytes.
+    """
+    if last is None: return False
+    dx = abs(point[0]-last[0])
+    dy = abs(point[1]-last[1])
+    return max(dx, dy) <= self._maxrel
+
+  def body_paths(self, paths, state=None):
+    """
+    Convert the paths of one layer into move and cut instructions.
+    The first point of each path is reached with a move, all other points with cuts.
+    With _quantize, all points are truncated to micrometers and relative
+    instructions are used for all differences in the range of
+    encode_relcoord_um(). Otherwise, relative instructions are used where
+    relok() permits, but at least every _forceabs points an absolute
+    instruction is emitted.
+
+    state is an optional dict as returned by body_state(), that is updated
+    in place. Passing the same state to consecutive calls encodes the paths of
+    a layer in pieces, with the same output as one call for all paths.
+    The bounding box and odometer are computed on the way, see body_state().
+
+    Returns the binary instruction data.
+    """
+    if state is None: state = self.body_state()
+    # Opcodes and encoders used per vertex are looked up once, not per point.
+    op_move_abs   = self.encode_hex('88')
+    op_move_rel   = self.encode_hex('89')
+    op_move_horiz = self.encode_hex('8a')
+    op_move_vert  = self.encode_hex('8b')
+    op_cut_abs    = self.encode_hex('a8')
+    op_cut_rel    = self.encode_hex('a9')
+    op_cut_horiz  = self.encode_hex('aa')
+    op_cut_vert   = self.encode_hex('ab')
+    encode_number   = self.encode_number
+    encode_relcoord_um = self.encode_relcoord_um
+    relok           = self.relok
+    quantize        = self._quantize
+
+    sqrt = math.sqrt
+    data = RuidaBuffer()
+    lp = state['last']
+    lq = None if lp is None else [int(lp[0]*1000), int(lp[1]*1000)]
+    relcounter = state['relcounter']
+    (cut_d, trav_d) = state['odo']
+    xmin = ymin = float('inf')
+    xmax = ymax = float('-inf')
+    for path in paths:
+      travel = True
+      for p in path:
+        if p[0] < xmin: xmin = p[0]
+        if p[0] > xmax: xmax = p[0]
+        if p[1] < ymin: ymin = p[1]
+        if p[1] > ymax: ymax = p[1]
+        if lp is None:
+          d = sqrt(p[0]*p[0] + p[1]*p[1])     # odometer() starts at [0,0]
+        else:
+          dx = p[0]-lp[0]
+          dy = p[1]-lp[1]
+          d = sqrt(dx*dx + dy*dy)
+        if travel: trav_d += d
+        else:      cut_d  += d
+
+        # rel, horiz, vert classify the instruction. ux, uy are relative micrometers.
+        if quantize:
+          q = [int(p[0]*1000), int(p[1]*1000)]       # same truncation as encode_number()
+          rel = False
+          if lq is not None:
+            ux = q[0]-lq[0]
+            uy = q[1]-lq[1]
+            rel = -8191 <= ux <= 8191 and -8191 <= uy <= 8191
+            horiz = uy == 0
+            vert  = ux == 0
+          lq = q
+        else:
+          rel = relok(lp, p) and (self._forceabs == 0 or relcounter < self._forceabs)
+          if rel:
+            if self._forceabs > 0: relcounter += 1
+            ux = int((p[0]-lp[0])*1000)
+            uy = int((p[1]-lp[1])*1000)
+            horiz = p[1] == lp[1]
+            vert  = p[0] == lp[0]
+          else:
+            relcounter = 0
+
+        if rel:
+          if horiz:
+            if travel:
+              data += op_move_horiz + encode_relcoord_um(ux)   # Move_Horiz 6.213mm
+            else:
+              data += op_cut_horiz  + encode_relcoord_um(ux)   # Cut_Horiz -6.008mm
+          elif vert:
+            if travel:
+              data += op_move_vert  + encode_relcoord_um(uy)   # Move_Vert 17.1mm
+            else:
+              data += op_cut_vert   + encode_relcoord_um(uy)   # Cut_Vert 2.987mm
+          else:
+            if travel:
+              data += op_move_rel + encode_relcoord_um(ux) + encode_relcoord_um(uy)  # Move_To_Rel 3.091mm 0.025mm
+            else:
+              data += op_cut_rel  + encode_relcoord_um(ux) + encode_relcoord_um(uy)  # Cut_Rel 0.015mm -1.127mm
+        else:
+          if travel:
+            data += op_move_abs + encode_number(p[0]) + encode_number(p[1])    # Move_To_Abs 0.0mm 0.0mm
+          else:
+            data += op_cut_abs  + encode_number(p[0]) + encode_number(p[1])    # Cut_Abs_a8 17.415mm 7.521mm
+
+        lp = p
+        travel = False
+    state['last'] = lp
+    state['relcounter'] = relcounter
+    state['odo'] = [cut_d, trav_d]
+    if xmin <= xmax:
+      state['bbox'] = self.bbox_combine(state['bbox'], [[xmin, ymin], [xmax, ymax]])
+    return data.getvalue()
+
+  def body_paths_numpy(self, paths, state=None):
+    """
+    Same as body_paths(), but all points of the layer are classified and
+    encoded at once with numpy array operations. The output is identical.
+
+    Returns None, if a coordinate cannot be handled here (not finite, or
+    too large for a 5 byte number). The caller falls back to body_paths() then,
+    state is only updated on success.
+    """
+    if state is None: state = self.body_state()
+    lp = state['last']
+    relcounter = state['relcounter']
+    nonempty = [path for path in paths if len(path)]
+    if not nonempty: return b''
+    lens = numpy.array([len(path) for path in nonempty])
+    xy = numpy.array(list(itertools.chain.from_iterable(nonempty)), dtype=numpy.float64).reshape(-1, 2)
+    if not numpy.isfinite(xy).all(): return None
+    if (xy >= (1<<35)*0.001).any(): return None         # encode_number() would need more than 5 bytes.
+    n = len(xy)
+    x = xy[:,0]
+    y = xy[:,1]
+
+    travel = numpy.zeros(n, dtype=bool)
+    travel[numpy.cumsum(lens)[:-1]] = True
+    travel[0] = True
+
+    dx = numpy.zeros(n)
+    dy = numpy.zeros(n)
+    dx[1:] = x[1:] - x[:-1]
+    dy[1:] = y[1:] - y[:-1]
+    if lp is not None:
+      dx[0] = x[0] - lp[0]
+      dy[0] = y[0] - lp[1]
+    else:
+      dx[0] = x[0]      # odometer() starts at [0,0]
+      dy[0] = y[0]
+
+    # odometer(): cumsum() adds in sequence, exactly like the loop there.
+    dist = numpy.sqrt(dx*dx + dy*dy)
+    (cut_d, trav_d) = state['odo']
+    cut_d  = float(numpy.cumsum(numpy.concatenate(([cut_d],  dist[~travel])))[-1])
+    trav_d = float(numpy.cumsum(numpy.concatenate(([trav_d], dist[travel])))[-1])
+
+    if self._quantize:
+      # Differences of coordinates truncated to micrometers are exact.
+      qx = numpy.trunc(x * 1000).astype(numpy.int64)
+      qy = numpy.trunc(y * 1000).astype(numpy.int64)
+      ux = numpy.zeros(n, dtype=numpy.int64)
+      uy = numpy.zeros(n, dtype=numpy.int64)
+      ux[1:] = qx[1:] - qx[:-1]
+      uy[1:] = qy[1:] - qy[:-1]
+      if lp is not None:
+        ux[0] = qx[0] - int(lp[0]*1000)
+        uy[0] = qy[0] - int(lp[1]*1000)
+      rel = numpy.maximum(numpy.abs(ux), numpy.abs(uy)) <= 8191
+      if lp is None: rel[0] = False
+      horiz = rel & (uy == 0)
+      vert  = rel & ~horiz & (ux == 0)
+    else:
+      # relok() for all points, then the _forceabs counter: within a run of
+      # relative points, every (_forceabs+1)th point becomes absolute.
+      # A run continued from the previous call has relcounter points already.
+      rel = numpy.maximum(numpy.abs(dx), numpy.abs(dy)) <= self._maxrel
+      if lp is None: rel[0] = False
+      if self._forceabs > 0:
+        idx = numpy.arange(n)
+        lastabs = numpy.maximum.accumulate(numpy.where(rel, -1-relcounter, idx))
+        runpos = (idx - lastabs) % (self._forceabs + 1)
+        rel &= runpos != 0
+        relcounter = int(runpos[-1]) if rel[-1] else 0
+      ux = numpy.trunc(dx * 1000).astype(numpy.int64)
+      uy = numpy.trunc(dy * 1000).astype(numpy.int64)
+      horiz = rel & (dy == 0)
+      vert  = rel & ~horiz & (dx == 0)
+    diag  = rel & ~horiz & ~vert
+    absol = ~rel
+
+    op = numpy.where(absol, 0x88, numpy.where(diag, 0x89, numpy.where(horiz, 0x8a, 0x8b)))
+    op = op + numpy.where(travel, 0, 0x20)              # cut opcodes are a8 .. ab
+    size = numpy.where(absol, 11, numpy.where(diag, 5, 3))
+    off = numpy.zeros(n, dtype=numpy.int64)
+    off[1:] = numpy.cumsum(size)[:-1]
+
+    out = numpy.zeros(int(off[-1] + size[-1]), dtype=numpy.uint8)
+    out[off] = op
+
+    def number7(v, length):
+      """ 7-bit groups of encode_number(), most significant first. """
+      return [(v >> (7*(length-1-k))) & 0x7f for k in range(length)]
+
+    def relcoord(nn):
+      """ encode_relcoord_um() as 14 bit 2s complement. None if out of range. """
+      if len(nn) and (numpy.abs(nn) > 8191).any(): return None
+      return numpy.where(nn < 0, nn + 16384, nn)
+
+    o = off[absol]
+    ax = numpy.maximum(numpy.trunc(x[absol] * 1000).astype(numpy.int64), 0)    # negative numbers encode as 0
+    ay = numpy.maximum(numpy.trunc(y[absol] * 1000).astype(numpy.int64), 0)
+    for k, (gx, gy) in enumerate(zip(number7(ax, 5), number7(ay, 5))):
+      out[o+1+k] = gx
+      out[o+6+k] = gy
+
+    rx = relcoord(ux[diag])
+    ry = relcoord(uy[diag])
+    rh = relcoord(ux[horiz])
+    rv = relcoord(uy[vert])
+    if rx is None or ry is None or rh is None or rv is None: return None
+    for o, r, k in ((off[diag], rx, 1), (off[diag], ry, 3), (off[horiz], rh, 1), (off[vert], rv, 1)):
+      g = number7(r, 2)
+      out[o+k]   = g[0]
+      out[o+k+1] = g[1]
+
+    state['last'] = nonempty[-1][-1]
+    state['relcounter'] = relcounter
+    state['odo'] = [cut_d, trav_d]
+    bbox = [[float(x.min()), float(y.min())], [float(x.max()), float(y.max())]]
+    state['bbox'] = self.bbox_combine(state['bbox'], bbox)
+    return out.tobytes()
+
+
+  def scramble_bytes(self, data):
+    """
+    Scramble all bytes for writing into *.rd files.
+    A bytearray() is scrambled in place and returned, other data is copied.
+    """
+    if Ruida._scramble_table is None:
+      Ruida._scramble_table = bytes([self.scramble(b) for b in range(256)])
+    return self.translate_bytes(data, Ruida._scramble_table)
+
+  def unscramble_bytes(self, data):
+    """
+    Unscramble all bytes read from *.rd files.
+    A bytearray() is unscrambled in place and returned, other data is copied.
+    """
+    if Ruida._unscramble_table is None:
+      Ruida._unscramble_table = bytes([self.unscramble(b) for b in range(256)])
+    return self.translate_bytes(data, Ruida._unscramble_table)
+
+  def translate_bytes(self, data, table, chunksize=1<<20):
+    """
+    Map each byte of data through the 256 byte translation table.
+    A bytearray() is modified in place, one chunk at a time, so that
+    at most chunksize bytes are copied at once.
+    """
+    if isinstance(data, bytearray):
+      for i in range(0, len(data), chunksize):
+        data[i:i+chunksize] = data[i:i+chunksize].translate(table)
+      return data
+    return data.translate(table)
+
+  def unscramble(self, b):
+    """ unscramble a single byte for reading from *.rd files """
+    res_b=b-1
+    if res_b<0: res_b+=0x100
+    res_b^=0x88
+    fb=res_b&0x80
+    lb=res_b&1
+    res_b=res_b-fb-lb
+    res_b|=lb<<7
+    res_b|=fb>>7
+    return res_b
+
+  def scramble(self, b):
+    """ scramble a single byte for writing into *.rd files """
+    fb=b&0x80
+    lb=b&1
+    res_b=b-fb-lb
+    res_b|=lb<<7
+    res_b|=fb>>7
+    res_b^=0x88
+    res_b+=1
+    if res_b>0xff:res_b-=0x100
+    return res_b
+
+  def header(self, layers):
+    """
+    Generate machine initialization instructions, to be sent before geometry.
+
+    layers is a list of RuidaLayer() objects, containing:
+
+    _bbox in [[xmin, ymin], [xmax, ymax]] format, as returned by the boundingbox()
+            method. Note: all test data seen had xmin=0, ymin=0.
+    _speed: single value per layer.
+    _power: a list of 2 to 8 elements, [min1, max1, ...]
+            Missing elements are added by repetition.
+
+    Units: Lengths in mm, power in percent [0..100],
+            speed in mm/sec, freq in khz.
+
+    Returns the binary instruction data.
+    """
+
+    bbox = self._globalbbox
+    for l in layers:
+      bbox = self.bbox_combine(bbox, l._bbox)
+    (xmin, ymin) = bbox[0]
+    (xmax, ymax) = bbox[1]
+
+    data = RuidaBuffer()
+    data += self.encode_hex("""
+        d8 12           # Red Light on ?
+        f0 f1 02 00     # file type ?
+        d8 00           # Green Light off ?
+        """)
+    data += self.enc('-nn', ["e7 06", 0, 0])              # Feeding
+    data += self.enc('-nn', ["e7 03", xmin, ymin])        # Top_Left_E7_07
+    data += self.enc('-nn', ["e7 07", xmax, ymax])        # Bottom_Right_E7_07
+    data += self.enc('-nn', ["e7 50", xmin, ymin])        # Top_Left_E7_50
+    data += self.enc('-nn', ["e7 51", xmax, ymax])        # Bottom_Right_E7_51
+    data += self.enc('-nn', ["e7 04 00 01 00 01", 0, 0])  # E7 04 ???
+    data += self.enc('-',   ["e7 05 00"])                 # E7 05 ???
+
+    ## start of per layer headers
+
+    for lnum in range(len(layers)):
+      l = layers[lnum]
+
+      # CAUTION: keep in sync with body()
+      power = copy.copy(l._power)
+      if len(power) % 2: raise ValueError("Even number of elements needed in power[]")
+      while len(power) < 8: power += power[-2:]
+
+      speed = copy.copy(l._speed)
+      if type(speed) == float or type(speed) == int: speed = [1000, speed]
+      travelspeed = speed[0]
+      laserspeed = speed[1]
+
+      data += self.enc('-bn',  ["c9 04", lnum, laserspeed])
+
+      data += self.enc('-bp-bp', ["c6 31", lnum, power[0], "c6 32", lnum, power[1]]) # Laser_1_Min/Max_Pow
+      data += self.enc('-bp-bp', ["c6 41", lnum, power[2], "c6 42", lnum, power[3]]) # Laser_2_Min/Max_Pow
+      data += self.enc('-bp-bp', ["c6 35", lnum, power[4], "c6 36", lnum, power[5]]) # Laser_3_Min/Max_Pow
+      data += self.enc('-bp-bp', ["c6 37", lnum, power[6], "c6 38", lnum, power[7]]) # Laser_3_Min/Max_Pow
+
+      data += self.enc('-bc-bb-bnn-bnn-bnn-bnn-', ["""
+        ca 06""", lnum, l._color, """                     # Layer_CA_06 Layer:0 00 00 00 00 00  RGB-Color for preview
+        ca 41""", lnum, 0, """                            # ??
+        e7 52""", lnum, l._bbox[0][0], l._bbox[0][1], """ # E7 52 Layer:0 top left?
+        e7 53""", lnum, l._bbox[1][0], l._bbox[1][1], """ # Bottom_Right_E7_53 Layer:0
+        e7 61""", lnum, l._bbox[0][0], l._bbox[0][1], """ # E7 61 Layer:0 top left?
+        e7 62""", lnum, l._bbox[1][0], l._bbox[1][1], """ # Bottom_Right_E7_62 Layer:0
+        """])
+
+    ## end of per layer headers
+
+    data += self.enc('-b-', ["""
+        ca 22""", len(layers)-1, """    # ?? Max layer number ??
+        e7 54 00 00 00 00 00 00         # Pen_Draw_Y 00 0.0mm
+        e7 54 01 00 00 00 00 00         # Pen_Draw_Y 01 0.0mm
+        """])
+    data += self.enc('-nn-nn-nn-nn-nn-nn-nn-nn-', ["""
+        e7 55 00 00 00 00 00 00                         # Laser2_Y_Offset False 0.0mm
+        e7 55 01 00 00 00 00 00                         # Laser2_Y_Offset True 0.0mm
+        f1 03 00 00 00 00 00 00 00 00 00 00             # Laser2_Offset 0.0mm 0.0mm
+        f1 00 00                                        # Start0 00
+        f1 01 00                                        # Start1 00
+        f2 00 00                                        # F2 00 00
+        f2 01 00                                        # F2 01 00
+        f2 02 05 2a 39 1c 41 04 6a 15 08 20             # F2 02 05 2a 39 1c 41 04 6a 15 08 20
+        f2 03 """, xmin, ymin, """                      # F2 03 0.0mm 0.0mm
+        f2 04 """, xmax, ymax, """                      # Bottom_Right_F2_04 17.414mm 24.868mm
+        f2 06 """, xmin, ymin, """                      # F2 06 0.0mm 0.0mm
+        f2 07 00                                        # F2 07 00
+        f2 05 00 01 00 01 """, xmax, ymax, """          # Bottom_Right_F2_05 00 01 00 01 17.414mm 24.868mm
+        ea 00                                           # EA 00
+        e7 60 00                                        # E7 60 00
+        e7 13 """, xmin, ymin, """                      # E7 13 0.0mm 0.0mm
+        e7 17 """, xmax, ymax, """                      # Bottom_Right_E7_17 17.414mm 24.868mm
+        e7 23 """, xmin, ymin, """                      # E7 23 0.0mm 0.0mm
+        e7 24 00                                        # E7 24 00
+        e7 08 00 01 00 01 """, xmax, ymax, """          # Bottom_Right_E7_08 00 01 00 01 17.414mm 24.868mm
+        """])
+    return data.getvalue()
+
+
+  def trailer(self, odo=[0.0, 0.0]):
+    """
+    Generate machine trailer instructions. To be sent after geometry instructions.
+
+    Initialize a trailer with the cut distance in m, not mm.
+    Note, that RDworks8 uses the cut distance twice here, and does not send the
+    the travel distance. Is this a bug?
+
+    Returns the binary instruction data.
+    """
+    data = RuidaBuffer()
+    data += self.enc("-nn-", ["""
+        eb e7 00
+        da 01 06 20""", odo[0]*0.001, odo[0]*0.001, """
+        d7 """])
+    return data.getvalue()
+
+
+  def encode_number(self, num, length=5, scale=1000):
+    """
+    The number n is expected in floating point format with unit mm.
+    A bytes() array of size length is returned.
+    The default scale converts to micrometers.
+    length=5 and scale=1000 are the expected machine format.
+    """
+    res = []
+    nn = int(num * scale)
+    while nn > 0:
+      res.append(nn & 0x7f)
+      nn >>= 7
+    while len(res) < length:
+      res.append(0)
+    res.reverse()
+    return bytes(res)
+
+  def encode_color(self, color):
+    """
+    color = [RED, GREEN, BLUE]
+    """
+    cc = ((color[2]&0xff)<<16) + ((color[1]&0xff)<<8) + (color[0]&0xff)
+    return self.encode_number(cc, scale=1)
+
+  def enc(self, fmt, tupl):
+    """
+    Encode the elements of tupl according to the format string.
+    Each character in fmt consumes the corresponds element from tupl
+    as a parameter to an encoding method:
+    '-'       encode_hex()
+    'n'       encode_number()
+    'p'       encode_percent()
+    'r'       encode_relcoord()
+    'b'       encode_byte()
+    'c'       encode_color()
+    """
+    if len(fmt) != len(tupl): raise ValueError("format '"+fmt+"' length differs from len(tupl)="+str(len(tupl)))
+
+    ret = RuidaBuffer()
+    for encoder, arg in zip(self.enc_compile(fmt), tupl):
+      ret += encoder(self, arg)
+    return ret.getvalue()
+
+  def enc_compile(self, fmt):
+    """
+    Translate a format string as used by enc() into a tuple of encoding methods.
+    The result is cached, so that each format string is parsed only once.
+    """
+    try:
+      return self._fmt_cache[fmt]
+    except KeyError:
+      pass
+    encoders = {
+      '-': Ruida.encode_hex,
+      'n': Ruida.encode_number,
+      'p': Ruida.encode_percent,
+      'r': Ruida.encode_relcoord,
+      'b': Ruida.encode_byte,
+      'c': Ruida.encode_color }
+    compiled = []
+    for c in fmt:
+      if c not in encoders: raise ValueError("unknown character in fmt: "+fmt)
+      compiled.append(encoders[c])
+    compiled = tuple(compiled)
+    self._fmt_cache[fmt] = compiled
+    return compiled
+
+  def decode_number(self, x):
+    "used with a bytes() array of length 5"
+    fak=1
+    res=0
+    for b in reversed(x):
+      res+=fak*b
+      fak*=0x80
+    return 0.0001 * res
+
+  def encode_relcoord(self, n):
+    """
+    Relative position in mm;
+    Returns a bytes array of two elements.
+    """
+    nn = int(n*1000)
+    if nn > 8191 or nn < -8191:
+      raise ValueError("relcoord "+str(n)+" mm is out of range. Use abscoords!")
+    if nn < 0: nn += 16384
+    return self.encode_number(nn, length=2, scale=1)
+
+  def encode_relcoord_um(self, nn):
+    """
+    Same as encode_relcoord(), but nn is an integer number of micrometers.
+    """
+    if nn > 8191 or nn < -8191:
+      raise ValueError("relcoord "+str(nn)+" um is out of range. Use abscoords!")
+    if nn < 0: nn += 16384
+    return self.encode_number(nn, length=2, scale=1)
+
+  def decode_relcoord(self, x):
+    """
+    using the first two elements of array x
+    relative position in micrometer; signed (2s complement)
+    """
+    r = x[0] << 8
+    r += x[1]
+    if r > 16383 or r < 0:
+      raise ValueError("Not a rel coord: " + repr(x[0:2]))
+    if r > 8191: return 0.001 * (r-16384)
+    else:        return 0.001 * r
+
+  def encode_byte(self, n):
+    return self.encode_number(n, length=1, scale=1)
+
+  def encode_percent(self, n):
+    """
+    returns two bytes, used with laser and layer percentages.
+    The magic constant 163.83 is 1/100 of 14bit all 1s.
+    """
+    a = int(n*0x3fff*0.01)    # n * 163.83
+    return bytes([a>>7, a&0x7f])      # 7-bit encoding
+
+  def encode_hex(self, str):
+    """
+    Assemble a string from hexadecimal digits. Binary safe.
+    Example: "48 65 6c 6c f8  # with a smorrebrod o\n    21" -> b'Hell\xf7!'
+    """
+    try:
+      return self._hex_cache[str]
+    except KeyError:
+      pass
+    key = str
+    str = re.sub('#.*$','', str, flags=re.MULTILINE)    # weed out comments.
+    l = map(lambda x: int(x, base=16), str.split())     # locale.atoi() is to be avoided!
+    data = bytes(l)
+    if len(self._hex_cache) < self._hex_cache_max: self._hex_cache[key] = data
+    return data
+
+
+def _body_chunk(args):
+  """
+  Worker for Ruida.iter_geometry_parallel(). Module level, so that it can be pickled.
+  Returns the encoded chunk and the updated state.
+  """
+  (config, engine, paths, state) = args
+  rd = Ruida()
+  for key in config: setattr(rd, key, config[key])
+  geometry = rd.body_batch(paths, state, engine)
+  return (geometry, state)
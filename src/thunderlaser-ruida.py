@@ -41,11 +41,13 @@ else:   # Linux
 
 ## INLINE_BLOCK_START
 # for easier distribution, our Makefile can inline these imports when generating thunderlaser.py from src/rudia-laser.py
-from ruida import Ruida
-from inksvg import InkSvg, LinearPathGen
+from ruida import Ruida, RuidaLayer, RuidaCache
+from inksvg import InkSvg, LinearPathGen, FlattenCache
+from pathopt import PathOpt
 ## INLINE_BLOCK_END
 
 import json
+import re
 import inkex
 import gettext
 
@@ -139,6 +141,10 @@ Option parser example:
 
 
 
+        self.OptionParser.add_option(
+            "--color_layers", action="store", type="string", dest="color_layers", default="",
+            help="One layer per stroke color, instead of cut and mark: 'COLOR=SETTINGS;...'. COLOR is a color name, #RRGGBB, or any. SETTINGS is cut, mark, or speed,minpow,maxpow. With any, each remaining stroke color gets a layer of its own. Default: '' (off)")
+
         self.OptionParser.add_option(
             '--smoothness', dest='smoothness', type='float', default=float(0.2), action='store',
             help='Curve smoothing (less for more [0.0001 .. 5]). Default: 0.2')
@@ -155,6 +161,42 @@ Option parser example:
             '--maxwidth', dest='maxwidth', type='string', default='900', action='store',
             help='Width of laser area [mm]. Default: 900 mm')
 
+        self.OptionParser.add_option(
+            "--dedup", action="store", type="inkbool", dest="dedup", default=False,
+            help="Cut shared and overlapping line segments only once. Default: False")
+
+        self.OptionParser.add_option(
+            '--join', dest='join', type='float', default=float(0.0), action='store',
+            help='Join open paths whose ends are closer than this [mm]. 0 to disable. Default: 0.0')
+
+        self.OptionParser.add_option(
+            '--simplify', dest='simplify', type='float', default=float(0.0), action='store',
+            help='Drop vertices closer than this to a straight line [mm]. 0 to disable. Default: 0.0')
+
+        self.OptionParser.add_option(
+            "--path_order", action="store", type="string", dest="path_order", default="none",
+            help="Reorder paths to shorten travel moves: none, nn, 2opt, hilbert. Default: none")
+
+        self.OptionParser.add_option(
+            "--path_entry", action="store", type="inkbool", dest="path_entry", default=False,
+            help="Start closed paths at the nearest vertex, cut open paths in reverse if shorter. Default: False")
+
+        self.OptionParser.add_option(
+            "--clip_page", action="store", type="inkbool", dest="clip_page", default=False,
+            help="Ignore objects outside the page, unless they are selected. Default: False")
+
+        self.OptionParser.add_option(
+            "--processes", action="store", type="int", dest="processes", default=0,
+            help="Encode large jobs in parallel with this many worker processes. 0: no parallel encoding. Default: 0")
+
+        self.OptionParser.add_option(
+            "--flatten_cache", action="store", type="inkbool", dest="flatten_cache", default=False,
+            help="Keep flattened curves in ~/.cache/thunderlaser/flatten.bin, do not flatten unchanged objects again. Default: False")
+
+        self.OptionParser.add_option(
+            "--body_cache", action="store", type="inkbool", dest="body_cache", default=False,
+            help="Keep encoded layers in ~/.cache/thunderlaser, do not encode unchanged layers again. Default: False")
+
         self.OptionParser.add_option(
             "--bbox_only", action="store", type="inkbool", dest="bbox_only", default=False,
             help="Cut bounding box only. Default: False")
@@ -176,13 +218,14 @@ Option parser example:
           help='Just print version number ("'+self.__version__+'") and exit.')
 
 
-    def cut_options(self):
+    def cut_options(self, color=None):
         """
         returns None, if deactivated or
         returns [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"any" ] otherwise.
+        A color given here replaces the cut_color option.
         """
         group=self.options.cut_group.strip('"')         # passed into the option with surrounding double-quotes. yacc.
-        color = self.options.cut_color
+        if color is None: color = self.options.cut_color
         if color == 'none': return None
 
         parse_str = None
@@ -199,13 +242,14 @@ Option parser example:
           v = parse_str.split(',')
           return { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':group }
 
-    def mark_options(self):
+    def mark_options(self, color=None):
         """
         returns None, if self.options.mark_color=='none'
         returns [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"green" ] otherwise.
+        A color given here replaces the mark_color option.
         """
         group=self.options.mark_group.strip('"')
-        color = self.options.mark_color
+        if color is None: color = self.options.mark_color
         if color == 'none': return None
 
         parse_str = None
@@ -220,6 +264,27 @@ Option parser example:
           v = parse_str.split(',')
           return { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':group }
 
+    def color_layer_options(self):
+        """
+        Parses self.options.color_layers, e.g. "red=cut; blue=mark; #00ff80=100,10,20; any=cut"
+        returns a list of [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"red" ], one per entry.
+        """
+        opts = []
+        for entry in self.options.color_layers.split(';'):
+          if entry.strip() == '': continue
+          try:
+            (color, settings) = [x.strip() for x in entry.split('=', 1)]
+          except ValueError:
+            raise ValueError("color_layers: COLOR=SETTINGS expected, got: "+entry)
+          if   settings == 'cut':  opt = self.cut_options(color=color)
+          elif settings == 'mark': opt = self.mark_options(color=color)
+          else:
+            v = settings.split(',')
+            opt = { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':'color_layers' }
+          self.colorname2rgb(color)       # raises ValueError for unknown colors.
+          opts.append(opt)
+        return opts
+
     def colorname2rgb(self, name):
         if name is None:      return None
         if name == 'none':    return False
@@ -232,13 +297,16 @@ Option parser example:
         if name == 'cyan':    return [ 0, 255, 255]
         if name == 'magenta': return [ 255, 0, 255]
         if name == 'yellow':  return [ 255, 255, 0]
+        m = re.match('^#([0-9a-fA-F]{6})$', name)
+        if m: return [ int(m.group(1)[i:i+2], 16) for i in (0, 2, 4) ]
         raise ValueError("unknown colorname: "+name)
 
 
     def effect(self):
         smooth = float(self.options.smoothness) # svg.smoothness to be deprecated!
         pg = LinearPathGen(smoothness=smooth)
-        svg = InkSvg(document=self.document, pathgen=pg, smoothness=smooth)
+        cache = FlattenCache() if self.options.flatten_cache else None
+        svg = InkSvg(document=self.document, pathgen=pg, smoothness=smooth, cache=cache)
 
         # Viewbox handling
         svg.handleViewBox()
@@ -247,16 +315,35 @@ Option parser example:
             print("Version "+self.__version__)
             sys.exit(0)
 
-        cut_opt  = self.cut_options()
-        mark_opt = self.mark_options()
-        if cut_opt is None and mark_opt is None:
-          inkex.errormsg(gettext.gettext('ERROR: Enable Cut or Mark or both.'))
-          sys.exit(1)
-        if cut_opt is not None and mark_opt is not None and cut_opt['color'] == mark_opt['color']:
-          inkex.errormsg(gettext.gettext('ERROR: Choose different color settings for Cut and Mark. Both are "'+mark_opt['color']+'"'))
-          sys.exit(1)
-        mark_color = self.colorname2rgb(None if mark_opt is None else mark_opt['color'])
-        cut_color  = self.colorname2rgb(None if  cut_opt is None else  cut_opt['color'])
+        ## Layers are [name, paths, options, rgb]. Normally a mark layer and a cut layer,
+        ## or one layer per entry of the color_layers table.
+        color_layers = self.options.color_layers.strip() != ''
+        if color_layers:
+          cut_opt = mark_opt = None
+          layer_opts = self.color_layer_options()
+          if len(layer_opts) == 0:
+            inkex.errormsg(gettext.gettext('ERROR: color_layers has no entries.'))
+            sys.exit(1)
+        else:
+          cut_opt  = self.cut_options()
+          mark_opt = self.mark_options()
+          if cut_opt is None and mark_opt is None:
+            inkex.errormsg(gettext.gettext('ERROR: Enable Cut or Mark or both.'))
+            sys.exit(1)
+          if cut_opt is not None and mark_opt is not None and cut_opt['color'] == mark_opt['color']:
+            inkex.errormsg(gettext.gettext('ERROR: Choose different color settings for Cut and Mark. Both are "'+mark_opt['color']+'"'))
+            sys.exit(1)
+          layer_opts = [mark_opt, cut_opt]
+        layer_rgbs = [self.colorname2rgb(None if opt is None else opt['color']) for opt in layer_opts]
+
+        # Elements that go into no layer are not flattened. They still count for the origin.
+        # With clip_page, elements outside the page are dropped, if possible before they are flattened.
+        classify = svg.strokeColorClassifier(layer_rgbs)
+        svg.accept = lambda node: classify(node) is not None
+        if self.options.clip_page and not self.options.ids:
+            svg.clip = svg.pageBox()
+            if svg.clip is None:
+                inkex.errormsg(gettext.gettext('Warning: page size unknown. Objects outside the page are not ignored.'))
 
         # First traverse the document (or selected items), reducing
         # everything to line segments.  If working on a selection,
@@ -271,6 +358,10 @@ Option parser example:
         else:
             # Traverse the entire document building new, transformed paths
             svg.recursivelyTraverseSvg(self.document.getroot(), svg.docTransform)
+        if cache is not None:
+            cache.save()
+        if svg.clipped > 0:
+            inkex.errormsg(gettext.gettext('Warning: %d objects outside the page ignored.') % svg.clipped)
 
 
         ## First simplification: paths_tupls[]
@@ -291,97 +382,190 @@ Option parser example:
 
         ## Reposition the graphics, so that a corner or the center becomes origin [0,0]
         ## Convert from dots-per-inch to mm.
-        ## Separate into Cut and Mark lists based on element style.
+        ## Separate into layers based on element style.
         paths_list = []
-        paths_list_cut = []
-        paths_list_mark = []
         dpi2mm = 25.4 / svg.dpi
 
         (xoff,yoff) = (svg.xmin, svg.ymin)                      # top left corner is origin
         # (xoff,yoff) = (svg.xmax, svg.ymax)                      # bottom right corner is origin
         # (xoff,yoff) = ((svg.xmax+svg.xmin)/2.0, (svg.ymax+svg.ymin)/2.0)       # center is origin
 
-        for tupl in paths_tupls:
+        # One color lookup per element. Never both. Named colors win over 'any'.
+        # In color_layers mode, an 'any' entry gets one layer per distinct stroke color, in order of appearance.
+        entry_layers = []
+        for i in range(len(layer_opts)):
+                if color_layers and layer_rgbs[i] is True:
+                        entry_layers.append([])
+                elif color_layers:
+                        entry_layers.append([[layer_opts[i]['color'], [], layer_opts[i], layer_rgbs[i]]])
+                else:
+                        entry_layers.append([[['mark', 'cut'][i], [], layer_opts[i], layer_rgbs[i]]])
+        any_layers = {}
+        layer_ids = [classify(tupl[0]) for tupl in paths_tupls]
+        for (tupl, layer_id) in zip(paths_tupls, layer_ids):
                 (elem,paths) = tupl
+                lay = None
+                if layer_id is not None:
+                        if color_layers and layer_rgbs[layer_id] is True:
+                                c = svg.getStrokeColor(elem)
+                                lay = any_layers.get((layer_id, c))
+                                if lay is None:
+                                        name = 'none' if c is None else '#%02x%02x%02x' % c
+                                        lay = [name, [], layer_opts[layer_id], True if c is None else list(c)]
+                                        entry_layers[layer_id].append(lay)
+                                        any_layers[(layer_id, c)] = lay
+                        else:
+                                lay = entry_layers[layer_id][0]
                 for path in paths:
                         newpath = []
                         for point in path:
                                 newpath.append([(point[0]-xoff) * dpi2mm, (point[1]-yoff) * dpi2mm])
                         paths_list.append(newpath)
-                        is_mark = svg.matchStrokeColor(elem, mark_color)
-                        is_cut  = svg.matchStrokeColor(elem,  cut_color)
-                        if is_cut and is_mark:          # never both. Named colors win over 'any'
-                                if mark_opt['color'] == 'any':
-                                        is_mark = False
-                                else:                   # cut_opt['color'] == 'any'
-                                        is_cut = False
-                        if is_cut:  paths_list_cut.append(newpath)
-                        if is_mark: paths_list_mark.append(newpath)
+                        if lay is not None: lay[1].append(newpath)
         paths_tupls = None      # save some memory
-        bbox = [[(svg.xmin-xoff)*dpi2mm, (svg.ymin-yoff)*dpi2mm], [(svg.xmax-xoff)*dpi2mm, (svg.ymax-yoff)*dpi2mm]]
+        layers = [lay for ll in entry_layers for lay in ll]
+        # The reports below are keyed by layer name. A color of an 'any' entry can have the same
+        # name as an explicit '#rrggbb' entry, and an entry can be repeated. Those get their layer index appended.
+        names = [lay[0] for lay in layers]
+        for i in range(len(layers)):
+                if names.count(names[i]) > 1:
+                        layers[i][0] = '%s/%d' % (names[i], i)
+        bbox =[[(svg.xmin-xoff)*dpi2mm, (svg.ymin-yoff)*dpi2mm], [(svg.xmax-xoff)*dpi2mm, (svg.ymax-yoff)*dpi2mm]]
 
         rd = Ruida()
         # bbox = rd.boundingbox(paths_list)     # same as above.
 
+        ## Remove segments that are cut twice, e.g. shared edges of tiles. Measured as cut distance with rd.odometer().
+        deduped = {}
+        if self.options.dedup:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.dedup(lay[1])
+                        deduped[lay[0]] = [rd.odometer(lay[1])[0], rd.odometer(new)[0]]
+                        lay[1] = new
+
+        ## Join paths that continue where another one ends. This saves a travel move and a laser on/off each.
+        joined = {}
+        if self.options.join > 0:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.join(lay[1], eps=self.options.join)
+                        joined[lay[0]] = [len(lay[1]), len(new)]
+                        lay[1] = new
+
+        ## Simplify paths, so that fewer and longer segments are sent to the machine.
+        ## The vertex count is reported, the byte count only in dummy mode, as it needs an extra encoding pass.
+        simplified = {}
+        if self.options.simplify > 0:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.simplify(lay[1], self.options.simplify)
+                        simplified[lay[0]] = { 'vertices': [sum(map(len, lay[1])), sum(map(len, new))] }
+                        if self.options.dummy:
+                                simplified[lay[0]]['bytes'] = [len(rd.body_paths(lay[1])), len(rd.body_paths(new))]
+                        lay[1] = new
+
+        ## Reorder the paths of each layer to shorten travel moves. Layers are done in order, mark first, then cut.
+        ## Optionally also rotate closed paths and reverse open paths to enter them at the nearest point.
+        ## The travel distance before and after is measured with rd.odometer().
+        travel = {}
+        if self.options.path_order != 'none' or self.options.path_entry:
+                po = PathOpt(method=self.options.path_order, entry=self.options.path_entry)
+                xy = [0,0]
+                for lay in layers:
+                        before = rd.odometer(lay[1], init=xy)[1]
+                        lay[1] = po.order(lay[1], init=xy)
+                        travel[lay[0]] = [before, rd.odometer(lay[1], init=xy)[1]]
+                        for path in lay[1]:
+                                if len(path): xy = path[-1]
+
         if self.options.bbox_only:
                 paths_list = [[ [bbox[0][0],bbox[0][1]], [bbox[1][0],bbox[0][1]], [bbox[1][0],bbox[1][1]],
                                 [bbox[0][0],bbox[1][1]], [bbox[0][0],bbox[0][1]] ]]
-                paths_list_cut = paths_list
-                paths_list_mark = paths_list
-                if cut_opt['color']  == 'any' or mark_opt is None: paths_list_mark = []
-                if mark_opt['color'] == 'any' or  cut_opt is None: paths_list_cut  = []      # once is enough.
+                if color_layers:
+                        nonempty = [lay for lay in layers if len(lay[1]) > 0]
+                        for lay in layers: lay[1] = []
+                        if len(nonempty): nonempty[-1][1] = paths_list          # once is enough.
+                else:
+                        (mark, cut) = layers
+                        mark[1] = paths_list
+                        cut[1] = paths_list
+                        if mark_opt is None or (cut_opt is not None and cut_opt['color'] == 'any'): mark[1] = []
+                        if cut_opt is None or (mark_opt is not None and mark_opt['color'] == 'any'): cut[1] = []     # once is enough.
         if self.options.move_only:
-                paths_list      = rd.paths2moves(paths_list)
-                paths_list_cut  = rd.paths2moves(paths_list_cut)
-                paths_list_mark = rd.paths2moves(paths_list_mark)
+                paths_list = rd.paths2moves(paths_list)
+                for lay in layers:
+                        lay[1] = rd.paths2moves(lay[1])
+
+        # Layers that go to the machine, in this order.
+        active = [lay for lay in layers if lay[2] is not None and len(lay[1]) > 0]
 
         if self.options.dummy:
-                with open('/tmp/thunderlaser.json', 'w') as fd:
-                        json.dump({
+                est_layers = []
+                for lay in active:
+                        est_layers.append(RuidaLayer(paths=lay[1], speed=lay[2]['speed']))
+                estimate = rd.estimate(est_layers)
+                estimate['names'] = [lay[0] for lay in active]          # same order as estimate['layers']
+                result = {
                                 'paths_bbox': bbox,
                                 'cut_opt': cut_opt, 'mark_opt': mark_opt,
                                 'paths_unit': 'mm', 'svg_resolution': svg.dpi, 'svg_resolution_unit': 'dpi',
                                 'freq1': self.options.freq1, 'freq1_unit': 'kHz',
                                 'paths': paths_list,
-                                'cut':  { 'paths':paths_list_cut,  'color': cut_color  },
-                                'mark': { 'paths':paths_list_mark, 'color': mark_color },
-                                }, fd, indent=4, sort_keys=True, encoding='utf-8')
+                                'path_order': self.options.path_order, 'path_entry': self.options.path_entry,
+                                'travel': travel, 'travel_unit': 'mm',
+                                'estimate': estimate, 'estimate_unit': 'sec',
+                                'dedup': self.options.dedup, 'deduped': deduped,
+                                'join': self.options.join, 'joined': joined,
+                                'simplify': self.options.simplify, 'simplified': simplified,
+                                }
+                if color_layers:
+                        result['color_layers'] = self.options.color_layers
+                        result['layers'] = [{ 'name':lay[0], 'paths':lay[1], 'opt':lay[2], 'color':lay[3] } for lay in layers]
+                else:
+                        result['cut']  = { 'paths':layers[1][1], 'color':layers[1][3] }
+                        result['mark'] = { 'paths':layers[0][1], 'color':layers[0][3] }
+                with open('/tmp/thunderlaser.json', 'w') as fd:
+                        json.dump(result, fd, indent=4, sort_keys=True, encoding='utf-8')
                 print("/tmp/thunderlaser.json written.", file=sys.stderr)
+                print("estimated time: %.1f sec" % estimate['total'], file=sys.stderr)
+                print("%d objects not flattened (no layer), %d outside the page" % (svg.rejected, svg.clipped), file=sys.stderr)
+                if cache is not None:
+                        print("flatten cache: %d hits, %d misses" % (cache.hits, cache.misses), file=sys.stderr)
+                for name in sorted(deduped.keys()):
+                        print("%s: cut %.1f mm -> %.1f mm (dedup)" % (name, deduped[name][0], deduped[name][1]), file=sys.stderr)
+                for name in sorted(joined.keys()):
+                        print("%s: %d -> %d paths (join=%g mm)" % (name, joined[name][0], joined[name][1], self.options.join), file=sys.stderr)
+                for name in sorted(simplified.keys()):
+                        s = simplified[name]
+                        print("%s: %d -> %d vertices, %d -> %d bytes (simplify=%g mm)" % (name, s['vertices'][0], s['vertices'][1], s['bytes'][0], s['bytes'][1], self.options.simplify), file=sys.stderr)
+                for name in sorted(travel.keys()):
+                        print("%s: travel %.1f mm -> %.1f mm (path_order=%s, path_entry=%s)" % (name, travel[name][0], travel[name][1], self.options.path_order, self.options.path_entry), file=sys.stderr)
         else:
-                if len(paths_list_cut) > 0 and len(paths_list_mark) > 0:
-                  nlay=2
-                else:
-                  nlay=1
+                if len(active) == 0:
+                        for lay in layers:
+                                if lay[2] is not None and lay[2]['color'] != 'any':
+                                        what = 'layer' if color_layers else lay[0]
+                                        inkex.errormsg(gettext.gettext('ERROR: '+what+' line color "'+lay[2]['color']+'": nothing found.'))
+                                        sys.exit(0)
+                        inkex.errormsg(gettext.gettext('ERROR: nothing found.'))
+                        sys.exit(0)
+                nlay = len(active)
 
                 if bbox[0][0] < 0 or bbox[0][1] < 0:
                         inkex.errormsg(gettext.gettext('Warning: negative coordinates not implemented in class Ruida(), truncating at 0'))
                 # rd.set(globalbbox=bbox)       # Not needed. Even slightly wrong.
                 rd.set(nlayers=nlay)
+                rd.set(processes=self.options.processes)
+                if self.options.body_cache:
+                        rd.set(cache=RuidaCache())
 
-                l=0
-                if mark_opt is not None:
-                  if len(paths_list_mark) > 0:
-                    cc = mark_color if type(mark_color) == list else [128,0,64]
-                    rd.set(layer=l, speed=mark_opt['speed'], color=cc)
-                    rd.set(layer=l, power=[mark_opt['minpow'], mark_opt['maxpow']])
-                    rd.set(layer=l, paths=paths_list_mark)
-                    l += 1
-                  else:
-                    if mark_opt['color'] != 'any' and len(paths_list_cut) == 0:
-                      inkex.errormsg(gettext.gettext('ERROR: mark line color "'+mark_opt['color']+'": nothing found.'))
-                      sys.exit(0)
-
-                if cut_opt is not None:
-                  if len(paths_list_cut) > 0:
-                    cc = cut_color if type(cut_color) == list else [128,0,64]
-                    rd.set(layer=l, speed=cut_opt['speed'], color=cc)
-                    rd.set(layer=l, power=[cut_opt['minpow'], cut_opt['maxpow']])
-                    rd.set(layer=l, paths=paths_list_cut)
-                    l += 1
-                  else:
-                    if cut_opt['color'] != 'any' and len(paths_list_mark) == 0:
-                      inkex.errormsg(gettext.gettext('ERROR: cut line color "'+cut_opt['color']+'": nothing found.'))
-                      sys.exit(0)
+                for l in range(len(active)):
+                        (name, paths, opt, rgb) = active[l]
+                        cc = rgb if type(rgb) == list else [128,0,64]
+                        rd.set(layer=l, speed=opt['speed'], color=cc)
+                        rd.set(layer=l, power=[opt['minpow'], opt['maxpow']])
+                        rd.set(layer=l, paths=paths)
 
                 device_used = None
                 for device in self.options.devicelist.split(','):
@@ -391,7 +575,7 @@ Option parser example:
                     except:
                         pass
                     if fd is not None:
-                        rd.write(fd)
+                        rd.write(fd, chunksize=1<<20)   # stream in chunks of 1MB, do not hold the job in memory.
                         # print(device+" written.", file=sys.stderr)
                         device_used = device
                         break
@@ -0,0 +1,64 @@
+#! /usr/bin/python3
+#
+# bench_ruida.py -- compare the python and numpy geometry encoders of class Ruida.
+#
+# Encodes random jobs with body_paths() and body_paths_numpy(), for
+# forceabs 0, 1, 100 and with quantize on and off. Asserts that both
+# engines produce the same bytes and prints the timings.
+#
+# Usage: python test/bench_ruida.py [vertices ...]
+#
+# The code is fully compatible with python 2.7 and 3.5
+
+from __future__ import print_function
+import os, sys, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import ruida
+from ruida import Ruida
+
+
+def job(nvert, seed=3):
+  """
+  Random walk paths of 50 vertices, with mostly short steps, some
+  horizontal and vertical ones, and a far jump now and then.
+  """
+  random.seed(seed)
+  paths = []
+  x = y = 100.0
+  for k in range(nvert // 50):
+    p = []
+    for i in range(50):
+      r = random.random()
+      if   r < 0.1:  x += random.uniform(-3, 3)
+      elif r < 0.2:  y += random.uniform(-3, 3)
+      elif r < 0.99: x += random.uniform(-3, 3); y += random.uniform(-3, 3)
+      else:          x = random.uniform(0, 900); y = random.uniform(0, 600)
+      x = abs(x); y = abs(y)
+      p.append([x, y])
+    paths.append(p)
+  return paths
+
+
+def encode(paths, engine, forceabs, quantize):
+  rd = Ruida()
+  rd.set(layer=0, paths=paths, speed=30, power=[10, 60], engine=engine, forceabs=forceabs, quantize=quantize)
+  t = time.time()
+  data = rd.body(rd._layers)
+  return data, time.time() - t
+
+
+if __name__ == '__main__':
+  if ruida.numpy is None:
+    print("numpy is not available, nothing to compare.")
+    sys.exit(0)
+  sizes = [int(a) for a in sys.argv[1:]] or [200000]
+  for nvert in sizes:
+    paths = job(nvert)
+    for quantize in (False, True):
+      for forceabs in (0, 1, 100):
+        py, tpy = encode(paths, 'python', forceabs, quantize)
+        np, tnp = encode(paths, 'numpy',  forceabs, quantize)
+        assert py == np, "engines differ: %d vertices, forceabs=%d, quantize=%s" % (nvert, forceabs, quantize)
+        print("%8d vertices, forceabs=%3d, quantize=%-5s: %9d bytes, python %6.2fs, numpy %6.2fs, %5.1fx" %
+              (nvert, forceabs, quantize, len(py), tpy, tnp, tpy / max(tnp, 1e-6)))
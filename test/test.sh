@@ -10,3 +10,7 @@ test -n "$2" && ids="--id=$2"   # --id=rect4485
 
 $dir/test_simple.sh $svg
 $dir/test_styles.sh
+python $dir/bench_ruida.py 20000
+python $dir/test_quantize.py
+python $dir/test_pathopt.py
+python $dir/test_bbox.py
@@ -0,0 +1,66 @@
+#! /usr/bin/python
+#
+# test_bbox.py -- the origin must not depend on which shapes are flattened.
+#
+# Shapes rejected by InkSvg.accept are not flattened for the job, but they
+# still count for the drawing bounding box, and thus for the origin and
+# the bbox_only frame. Traverse rejected_curves.svg with several accept
+# functions, with and without clip, and compare the bounding box against
+# a traversal that flattens everything. The control points of most curves
+# in rejected_curves.svg reach beyond the curves.
+#
+# Usage: python test/test_bbox.py
+#
+# Like thunderlaser.py, this needs python 2.7 and the inkscape 0.92
+# extensions (inkex, simplepath, ...). Run make first.
+
+from __future__ import print_function
+import os, sys
+
+dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir, '..'))
+from thunderlaser import InkSvg, LinearPathGen        # inksvg.py as inlined by make
+from lxml import etree
+
+svgfile = os.path.join(dir, 'rejected_curves.svg')
+
+layers = {
+  'all':    None,
+  'black':  [[0, 0, 0]],
+  'red':    [[255, 0, 0]],
+  'blue':   [[0, 0, 255]],
+  'none':   [],
+}
+
+
+def traverse(rgbs, clip=False):
+  """
+  Returns the drawing bounding box [xmin, xmax, ymin, ymax] and the number
+  of rejected shapes, with the shapes of colors other than rgbs rejected.
+  rgbs None accepts everything.
+  """
+  svg = InkSvg(document=etree.parse(svgfile), pathgen=LinearPathGen(smoothness=0.2), smoothness=0.2)
+  svg.handleViewBox()
+  if rgbs is not None:
+    classify = svg.strokeColorClassifier(rgbs)
+    svg.accept = lambda node: classify(node) is not None
+  if clip:
+    svg.clip = svg.pageBox()
+  svg.recursivelyTraverseSvg(svg.document.getroot(), svg.docTransform)
+  return [svg.xmin, svg.xmax, svg.ymin, svg.ymax], svg.rejected
+
+
+def test_origin():
+  for clip in (False, True):
+    want, rejected = traverse(None, clip)
+    assert rejected == 0
+    for name in sorted(layers):
+      got, rejected = traverse(layers[name], clip)
+      assert name == 'all' or rejected > 0, "%s: nothing rejected" % name
+      assert got == want, "%s%s: bbox %s, expected %s" % (name, " clipped" if clip else "", got, want)
+    print("bbox%s: %s, identical with %s rejected" %
+          (" clipped" if clip else "", ", ".join(["%.3f" % v for v in want]), "/".join(sorted(layers))))
+
+
+if __name__ == '__main__':
+  test_origin()
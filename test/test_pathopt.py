@@ -0,0 +1,220 @@
+#! /usr/bin/python3
+#
+# test_pathopt.py -- tests for class PathOpt.
+#
+# Ordering keeps the set of paths, 2-opt travel is never longer than
+# nearest neighbour travel, dedup() cuts the union of all segments
+# exactly once, join() keeps every segment, and simplify() stays within
+# its tolerance, with and without numpy.
+#
+# Usage: python test/test_pathopt.py
+#
+# The code is fully compatible with python 2.7 and 3.5
+
+from __future__ import print_function
+import os, sys, math, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import pathopt
+from pathopt import PathOpt
+
+
+def squares_and_lines(n=400, seed=42):
+  """
+  A mix of closed squares and open polylines at random positions.
+  """
+  random.seed(seed)
+  paths = []
+  for k in range(n):
+    x = random.uniform(0, 500)
+    y = random.uniform(0, 300)
+    if k % 3:
+      paths.append([[x,y], [x+5,y], [x+5,y+5], [x,y+5], [x,y]])
+    else:
+      paths.append([[x,y], [x+random.uniform(-9,9), y+random.uniform(-9,9)], [x+random.uniform(-9,9), y+random.uniform(-9,9)]])
+  return paths
+
+
+def travel(paths, init=[0,0]):
+  xy = init
+  d = 0.0
+  for path in paths:
+    d += math.hypot(path[0][0]-xy[0], path[0][1]-xy[1])
+    xy = path[-1]
+  return d
+
+
+def length(paths):
+  return sum(math.hypot(p[k+1][0]-p[k][0], p[k+1][1]-p[k][1]) for p in paths for k in range(len(p)-1))
+
+
+def canonical(path):
+  """
+  The same key for a path, its reverse, and for a closed path all its rotations.
+  """
+  pts = [tuple(p) for p in path]
+  if PathOpt().closed(path):
+    return ('closed', tuple(sorted(tuple(sorted((pts[k], pts[k+1]))) for k in range(len(pts)-1))))
+  return ('open', min(tuple(pts), tuple(pts[::-1])))
+
+
+def segments(paths):
+  """
+  Multiset of the undirected segments of paths.
+  """
+  res = {}
+  for p in paths:
+    for k in range(len(p)-1):
+      s = tuple(sorted((tuple(p[k]), tuple(p[k+1]))))
+      res[s] = res.get(s, 0) + 1
+  return res
+
+
+def test_order():
+  paths = squares_and_lines()
+  want = sorted(canonical(p) for p in paths)
+  for method in PathOpt.methods:
+    for entry in (False, True):
+      res = PathOpt(method=method, entry=entry).order(paths)
+      assert sorted(canonical(p) for p in res) == want, "%s entry=%s changed the paths" % (method, entry)
+      if method != '2opt' and not entry:
+        assert sorted(map(id, res)) == sorted(map(id, paths)), "%s modified a path" % method
+  nn = PathOpt(method='nn').order(paths)
+  opt = PathOpt(method='2opt').order(paths)
+  assert travel(opt) <= travel(nn) + 1e-9, "2opt travel %.3f > nn travel %.3f" % (travel(opt), travel(nn))
+  print("order: paths kept for %s, travel %.1f (none), %.1f (nn), %.1f (2opt) mm" %
+        ("/".join(PathOpt.methods), travel(paths), travel(nn), travel(opt)))
+
+
+def overlaps(paths, eps=1e-6):
+  """
+  Total length cut more than once, by brute force over all pairs of collinear segments.
+  """
+  segs = [(p[k], p[k+1]) for p in paths for k in range(len(p)-1)]
+  total = 0.0
+  for i in range(len(segs)):
+    (a0, a1) = segs[i]
+    (ux, uy) = (a1[0]-a0[0], a1[1]-a0[1])
+    la = math.hypot(ux, uy)
+    if la < eps: continue
+    (ux, uy) = (ux/la, uy/la)
+    for j in range(i+1, len(segs)):
+      (b0, b1) = segs[j]
+      # both ends of b on the line of a?
+      if abs((b0[0]-a0[0])*uy - (b0[1]-a0[1])*ux) > eps: continue
+      if abs((b1[0]-a0[0])*uy - (b1[1]-a0[1])*ux) > eps: continue
+      t0 = (b0[0]-a0[0])*ux + (b0[1]-a0[1])*uy
+      t1 = (b1[0]-a0[0])*ux + (b1[1]-a0[1])*uy
+      total += max(0.0, min(la, max(t0, t1)) - max(0.0, min(t0, t1)))
+  return total
+
+
+def test_dedup():
+  po = PathOpt()
+  # a 6 x 4 grid of 10mm tiles, each tile a closed square: inner edges are shared.
+  tiles = []
+  for i in range(6):
+    for j in range(4):
+      (x, y) = (10.0*i, 10.0*j)
+      tiles.append([[x,y], [x+10,y], [x+10,y+10], [x,y+10], [x,y]])
+  grid = (6+1)*4*10.0 + (4+1)*6*10.0
+  # a star of lines through a common center, each drawn twice, once reversed.
+  star = []
+  for k in range(12):
+    a = math.pi * k / 12
+    (dx, dy) = (20*math.cos(a), 20*math.sin(a))
+    star.append([[100-dx, 100-dy], [100+dx, 100+dy]])
+    star.append([[100+dx, 100+dy], [100-dx, 100-dy]])
+  # overlapping collinear pieces, horizontal and diagonal, in both directions.
+  pieces = [[[0,200], [10,200]], [[5,200], [15,200]], [[14,200], [2,200]],
+            [[0,250], [3,253]], [[1,251], [5,255]], [[4,254], [2,252]], [[7,257], [6,256]]]
+  union = 15.0 + 5*math.sqrt(2) + math.sqrt(2)
+  for (name, paths, want) in (('grid', tiles, grid), ('star', star, 12*40.0), ('pieces', pieces, union)):
+    res = po.dedup(paths)
+    assert abs(length(res) - want) < 1e-6, "%s: dedup length %.6f, expected %.6f" % (name, length(res), want)
+    assert overlaps(res) < 1e-6, "%s: overlaps remain" % name
+    assert abs(length(po.dedup(res)) - want) < 1e-6, "%s: dedup not idempotent" % name
+  print("dedup: grid %.0f mm, star %.0f mm, pieces %.3f mm, no overlaps" % (grid, 12*40.0, union))
+
+
+def test_join(seed=7):
+  random.seed(seed)
+  chains = []
+  for k in range(50):
+    (x, y) = (random.uniform(0, 500), random.uniform(0, 300))
+    chain = [[x, y]]
+    for i in range(2 + int(random.random() * 20)):
+      (x, y) = (x + random.uniform(-5, 5), y + random.uniform(-5, 5))
+      chain.append([x, y])
+    if k % 5 == 0:
+      chain.append(chain[0])        # closed
+    chains.append(chain)
+  pieces = []
+  for chain in chains:
+    k = 0
+    while k < len(chain)-1:
+      n = 1 + int(random.random() * 4)
+      piece = chain[k:k+n+1]
+      if random.random() < 0.5: piece = piece[::-1]
+      pieces.append(piece)
+      k += n
+  random.shuffle(pieces)
+  res = PathOpt().join(pieces)
+  assert segments(res) == segments(pieces), "join lost or added segments"
+  assert len(res) == len(chains), "join left %d paths from %d chains" % (len(res), len(chains))
+  assert sum(PathOpt().closed(p) for p in res) == 10
+  print("join: %d pieces joined into %d paths, all segments kept" % (len(pieces), len(res)))
+
+
+def wiggle(n, seed):
+  random.seed(seed)
+  path = []
+  (x, y, a) = (0.0, 0.0, 0.0)
+  for k in range(n):
+    a += random.uniform(-0.3, 0.3)
+    (x, y) = (x + 0.2*math.cos(a), y + 0.2*math.sin(a))
+    path.append([x + random.uniform(-0.02, 0.02), y + random.uniform(-0.02, 0.02)])
+  return path
+
+
+def segment_distance(p, a, b):
+  (dx, dy) = (b[0]-a[0], b[1]-a[1])
+  l2 = dx*dx + dy*dy
+  t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((p[0]-a[0])*dx + (p[1]-a[1])*dy) / l2))
+  return math.hypot(p[0]-(a[0]+t*dx), p[1]-(a[1]+t*dy))
+
+
+def test_simplify():
+  po = PathOpt()
+  paths = [wiggle(n, n) for n in (3, 10, 65, 200, 2000, 20000)]
+  paths.append(paths[4] + [paths[4][0]])          # closed
+  for tolerance in (0.01, 0.05, 0.5):
+    res = po.simplify(paths, tolerance)
+    for (path, simple) in zip(paths, res):
+      assert simple[0] is path[0] and simple[-1] is path[-1]
+      # every dropped point is within tolerance of the kept segment it was replaced by.
+      k = 0
+      for i in range(len(simple)-1):
+        (a, b) = (simple[i], simple[i+1])
+        while path[k] is not a: k += 1
+        while path[k] is not b:
+          assert segment_distance(path[k], a, b) <= tolerance + 1e-12, "tolerance %g exceeded" % tolerance
+          k += 1
+    if pathopt.numpy is not None:
+      saved = pathopt.numpy
+      pathopt.numpy = None
+      try:
+        plain = po.simplify(paths, tolerance)
+      finally:
+        pathopt.numpy = saved
+      assert plain == res, "numpy and python simplify() differ"
+  print("simplify: within tolerance%s, %d -> %d points at 0.05mm" %
+        ("" if pathopt.numpy is None else ", numpy and python equal",
+         sum(map(len, paths)), sum(map(len, po.simplify(paths, 0.05)))))
+
+
+if __name__ == '__main__':
+  test_order()
+  test_dedup()
+  test_join()
+  test_simplify()
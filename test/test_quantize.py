@@ -0,0 +1,123 @@
+#! /usr/bin/python3
+#
+# test_quantize.py -- regression tests for Ruida._quantize.
+#
+# With _quantize (the default), every vertex of a job must arrive at
+# exactly its truncated micrometer position, however many relative
+# moves lead there. With _quantize = False, the output must stay byte
+# for byte what ruida.py v1.6 wrote. ruida_v16.rd was written by v1.6
+# for job() below.
+#
+# Usage: python test/test_quantize.py [--save]
+#
+# The code is fully compatible with python 2.7 and 3.5
+
+from __future__ import print_function
+import os, sys, io, random
+
+dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir, '..', 'src'))
+import ruida
+from ruida import Ruida
+
+reference = os.path.join(dir, 'ruida_v16.rd')
+
+
+def job(seed=1):
+  """
+  Three layers of random paths. Short steps give long runs of relative
+  moves, horizontal and vertical steps and jumps exercise the other
+  instructions. Only random.random() and random.uniform() are used, they
+  give the same numbers under python 2 and 3.
+  """
+  random.seed(seed)
+  layers = []
+  for ln in range(3):
+    paths = []
+    for k in range(120):
+      x, y = random.uniform(0, 500), random.uniform(0, 400)
+      p = [[x, y]]
+      for i in range(1 + int(random.random() * 30)):
+        r = random.random()
+        if   r < 0.2: x += random.uniform(-5, 5)
+        elif r < 0.4: y += random.uniform(-5, 5)
+        elif r < 0.9: x += random.uniform(-0.05, 0.05); y += random.uniform(-0.05, 0.05)
+        else:         x, y = random.uniform(0, 500), random.uniform(0, 400)
+        x = max(0, x); y = max(0, y)
+        p.append([x, y])
+      paths.append(p)
+    layers.append(dict(paths=paths, speed=[1000, 30+ln] if ln else 25.5, power=[10+ln, 60], color=[ln*40, 255-ln, 3]))
+  return layers
+
+
+def encode(layers, **kw):
+  rd = Ruida()
+  for ln, l in enumerate(layers):
+    rd.set(layer=ln, **l)
+  rd.set(**kw)
+  f = io.BytesIO()
+  rd.write(f)
+  return f.getvalue()
+
+
+def positions(data):
+  """
+  Replay the move and cut instructions of body_paths() output.
+  Returns the machine position after each instruction, in micrometers.
+  """
+  data = bytearray(data)
+  def number(b):
+    n = 0
+    for c in b: n = n*128 + c
+    return n
+  def relcoord(b):
+    n = b[0]*128 + b[1]
+    if n > 8191: n -= 16384
+    return n
+  pos = None
+  res = []
+  i = 0
+  while i < len(data):
+    op = data[i] & 0xdf                 # cut opcodes are move opcodes | 0x20
+    if   op == 0x88: pos = [number(data[i+1:i+6]), number(data[i+6:i+11])]; i += 11
+    elif op == 0x89: pos = [pos[0] + relcoord(data[i+1:i+3]), pos[1] + relcoord(data[i+3:i+5])]; i += 5
+    elif op == 0x8a: pos = [pos[0] + relcoord(data[i+1:i+3]), pos[1]]; i += 3
+    elif op == 0x8b: pos = [pos[0], pos[1] + relcoord(data[i+1:i+3])]; i += 3
+    else: raise ValueError("unexpected opcode %02x at %d" % (data[i], i))
+    res.append(pos)
+  return res
+
+
+def test_quantize_exact():
+  engines = ['python'] if ruida.numpy is None else ['python', 'numpy']
+  for engine in engines:
+    for l in job():
+      rd = Ruida()
+      rd.set(quantize=True, engine=engine)
+      data = rd.body_paths(l['paths']) if engine == 'python' else rd.body_paths_numpy(l['paths'])
+      got = positions(data)
+      want = [[int(p[0]*1000), int(p[1]*1000)] for path in l['paths'] for p in path]
+      assert len(got) == len(want)
+      dev = max(max(abs(g[0]-w[0]), abs(g[1]-w[1])) for g, w in zip(got, want))
+      assert dev == 0, "%s engine: %d um deviation" % (engine, dev)
+  print("quantize: 0 um deviation,", ", ".join(engines))
+
+
+def test_v16_bytes():
+  with open(reference, 'rb') as f:
+    want = f.read()
+  assert encode(job(), quantize=False, engine='python') == want, "quantize=False differs from v1.6"
+  if ruida.numpy is not None:
+    assert encode(job(), quantize=False, engine='numpy') == want, "quantize=False differs from v1.6 (numpy)"
+  assert encode(job()) != want          # the default is quantize=True
+  print("quantize=False: identical to v1.6, %d bytes" % len(want))
+
+
+if __name__ == '__main__':
+  if sys.argv[1:] == ['--save']:
+    # only meaningful with ruida.py v1.6 in src/
+    with open(reference, 'wb') as f:
+      f.write(encode(job()))
+    sys.exit(0)
+  test_quantize_exact()
+  test_v16_bytes()
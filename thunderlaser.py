@@ -75,9 +75,26 @@ else:   # Linux
 #                      Added load(), getElementsByIds() methods.
 # 2018-03-21 jw, v1.7d Added handleViewBox() to load().
 #                      Added traverse().
+# 2019-01-12 jw, v1.7e debug output to self.tty
+# 2026-10-17     v1.8  Added FlattenCache, a persistent cache for getPathVertices().
+#                      getPathVertices() flattens in local coordinates, memoized per run.
+#                      Added getIdIndex(), used for <use> and getElementsByIds().
+#                      getNodeStyle() results and parsed style strings are cached.
+#                      Added classifyStrokeColors(), matchColor(), getStrokeColor().
+#                      Added accept and clip, to skip elements before flattening.
+#                      Added flattenCubicPath(), flattenCubicPathNumpy(), used instead of
+#                      subdivideCubicPath().
+#                      Circles, ellipses, arcs and rounded rects are flattened directly,
+#                      by arcVertices() and getShapeVertices().
+#                      Added objLine(), objPolyline() to PathGenerator. LinearPathGen
+#                      emits rects, lines, polylines and polygons without path data.
 
 import gettext
+import hashlib
+import math
+import os
 import re
+import struct
 import sys
 
 sys_platform = sys.platform.lower()
@@ -98,6 +115,11 @@ import bezmisc
 
 from lxml import etree
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class PathGenerator():
     """
     A PathGenerator has methods for different svg objects. It compiles an
@@ -130,6 +152,40 @@ class PathGenerator():
     def objRect(x, y, w, h, node, mat):
         raise NotImplementedError("See example inksvg.LinearPathGen.objRect()")
 
+    def objLine(self, x1, y1, x2, y2, node, mat):
+        """
+        Convert
+
+          <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
+
+        to
+
+          <path d="MX1,Y1 LX2,Y2"/>
+        """
+        a = []
+        a.append(['M ', [x1, y1]])
+        a.append([' L ', [x2, y2]])
+        self.pathList(a, node, mat)
+
+    def objPolyline(self, points, closed, node, mat):
+        """
+        Convert
+
+          <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
+
+        to
+
+          <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
+
+        points is the points attribute. With closed=True, for a <polygon>,
+        a Z is added.
+        """
+        pa = points.split()
+        d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
+        if closed:
+            d += " Z"
+        self.pathString(d, node, mat)
+
     def objRoundedRect(self, x, y, w, h, rx, ry, node, mat):
         raise NotImplementedError("See example inksvg.LinearPathGen.objRoundedRect()")
 
@@ -151,6 +207,10 @@ class PathGenerator():
 
 class LinearPathGen(PathGenerator):
 
+    # "x,y" with numbers as understood by simplepath.
+    point_re = re.compile(r'^([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?),'
+                          r'([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)$')
+
     def __init__(self, smoothness=0.2):
         self.smoothness = max(0.0001, smoothness)
 
@@ -158,7 +218,7 @@ class LinearPathGen(PathGenerator):
         """
         d is expected formatted as an svg path string here.
         """
-        print("calling getPathVertices",  self.smoothness)
+        print("calling getPathVertices",  self.smoothness, file=self._svg.tty)
         self._svg.getPathVertices(d, node, mat, self.smoothness)
 
     def pathList(self, d, node, mat):
@@ -179,7 +239,20 @@ class LinearPathGen(PathGenerator):
 
         I.e., explicitly draw three sides of the rectangle and the
         fourth side implicitly
+
+        Without a stroke-dasharray, the vertices are computed directly.
+        They are the same, as all numbers go through str() like in
+        simplepath.formatPath(), and the relative moves are added up like
+        in simplepath.parsePath(). The Z returns to the exact start point.
         """
+        if not self._svg.hasDasharray(node):
+            (x, y, w, h, mw) = [float(str(v)) for v in (x, y, w, h, -w)]
+            p1 = [x + w, y + 0.0]
+            p2 = [p1[0] + 0.0, p1[1] + h]
+            p3 = [p2[0] + mw, p2[1] + 0.0]
+            self._svg.getShapeVertices([[[x, y], p1, p2, p3, [x, y]]], node, mat)
+            return
+
         a = []
         a.append(['M ', [x, y]])
         a.append([' l ', [w, 0]])
@@ -188,10 +261,70 @@ class LinearPathGen(PathGenerator):
         a.append([' Z', []])
         self.pathList(a, node, mat)
 
+    def flatness(self, mat):
+        """
+        The smoothness, in the coordinates of an object drawn with transform mat.
+        """
+        scale = self._svg.transformScale(mat)
+        if scale > 0.0:
+            return self.smoothness / scale
+        return self.smoothness
+
+    def objLine(self, x1, y1, x2, y2, node, mat):
+        """
+        Without a stroke-dasharray, the two vertices are used directly,
+        with the numbers going through str() as in PathGenerator.objLine().
+        """
+        if self._svg.hasDasharray(node):
+            return PathGenerator.objLine(self, x1, y1, x2, y2, node, mat)
+        v = [[float(str(x1)), float(str(y1))], [float(str(x2)), float(str(y2))]]
+        self._svg.getShapeVertices([v], node, mat)
+
+    def objPolyline(self, points, closed, node, mat):
+        """
+        Without a stroke-dasharray, and with all points written as "x,y",
+        the points are used as vertices directly. A closed polyline ends
+        with its first point, as after a Z. Other notations go through
+        PathGenerator.objPolyline(), so that simplepath sees them as before.
+        """
+        if self._svg.hasDasharray(node):
+            return PathGenerator.objPolyline(self, points, closed, node, mat)
+        v = []
+        for p in points.split():
+            m = self.point_re.match(p)
+            if m is None:
+                return PathGenerator.objPolyline(self, points, closed, node, mat)
+            v.append([float(m.group(1)), float(m.group(2))])
+        if closed:
+            v.append(v[0][:])
+        self._svg.getShapeVertices([v], node, mat)
+
     def objRoundedRect(self, x, y, w, h, rx, ry, node, mat):
-        print("calling roundedRectBezier")
-        d = self._svg.roundedRectBezier(x, y, w, h, rx, ry)
-        self._svg.getPathVertices(d, node, mat, self.smoothness)
+        """
+        The corners are flattened directly as quarter ellipses, clockwise
+        from the top left, as in InkSvg.roundedRectBezier().
+        A dashed outline is done through roundedRectBezier().
+        """
+        if self._svg.hasDasharray(node):
+            print("calling roundedRectBezier", file=self._svg.tty)
+            d = self._svg.roundedRectBezier(x, y, w, h, rx, ry)
+            self._svg.getPathVertices(d, node, mat, self.smoothness)
+            return
+
+        if rx < 0: rx = 0
+        if rx > 0.5*w: rx = 0.5*w
+        if ry < 0: ry = 0
+        if ry > 0.5*h: ry = 0.5*h
+        if ry < 0.0000001: ry = rx
+        flat = self.flatness(mat)
+        q = 0.5 * math.pi
+        v = [[x+rx, y]]
+        v += self._svg.arcVertices(x+w-rx, y+ry,   rx, ry, -q,  0,   flat)   # top right
+        v += self._svg.arcVertices(x+w-rx, y+h-ry, rx, ry,  0,  q,   flat)   # bottom right
+        v += self._svg.arcVertices(x+rx,   y+h-ry, rx, ry,  q,  2*q, flat)   # bottom left
+        v += self._svg.arcVertices(x+rx,   y+ry,   rx, ry,  2*q, 3*q, flat)[:-1]   # top left
+        v.append(v[0])
+        self._svg.getShapeVertices([v], node, mat)
 
     def objEllipse(self, cx, cy, rx, ry, node, mat):
         """
@@ -211,7 +344,16 @@ class LinearPathGen(PathGenerator):
 
         Note: ellipses or circles with a radius attribute of value 0
         are ignored
+
+        Without a stroke-dasharray, the same vertices are computed directly,
+        see InkSvg.arcVertices(), starting at X1,CY.
         """
+        if not self._svg.hasDasharray(node):
+            v = self._svg.arcVertices(cx, cy, rx, ry, math.pi, -math.pi, self.flatness(mat))
+            v[-1] = v[0]
+            self._svg.getShapeVertices([v], node, mat)
+            return
+
         x1 = cx - rx
         x2 = cx + rx
         d = 'M %f,%f '     % (x1, cy) + \
@@ -223,13 +365,159 @@ class LinearPathGen(PathGenerator):
 
     def objArc(self, d, cx, cy, rx, ry, st, en, cl, node, mat):
         """
-        We ignore the cx, cy, rx, ry data, and are happy that inkscape
-        also provides the same information as a path.
+        The arc runs from angle st to en, a full ellipse if they are equal.
+        If closed, it is a slice through the center, or a chord with
+        sodipodi:arc-type="chord".
+
+        A dashed arc or one without radius is done with the path d, which
+        inkscape provides with the same information.
         """
-        self.pathString(d, node, mat)
+        if rx <= 0 or ry <= 0 or self._svg.hasDasharray(node):
+            self.pathString(d, node, mat)
+            return
+
+        while en <= st:
+            en += 2 * math.pi
+        en = min(en, st + 2 * math.pi)
+        v = self._svg.arcVertices(cx, cy, rx, ry, st, en, self.flatness(mat))
+        if en - st >= 2 * math.pi - 1e-9:
+            v[-1] = v[0]
+        elif cl:
+            if node.get(inkex.addNS('arc-type', 'sodipodi'), 'slice') != 'chord':
+                v.append([cx, cy])
+            v.append(v[0])
+        self._svg.getShapeVertices([v], node, mat)
 
 
 
+class FlattenCache():
+    """
+    Persistent cache for InkSvg.getPathVertices(). The flattened subpaths
+    of a path are stored under a hash of everything that determines them:
+    the path data, the dash style, the composed transform and the smoothness.
+    Unchanged nodes are then not parsed and subdivided again, when the
+    document is exported the next time.
+
+    The cache is a single binary file. It is loaded at construction and
+    written by save(). Each entry holds a 20 byte key, the save() generation
+    it was last used in, and the subpaths as a count, and per subpath a
+    vertex count, a bounding box and the vertices as little endian doubles.
+    Entries used in the current run are always written. Older entries are
+    kept, most recently used first, as long as the file stays within maxsize bytes.
+    """
+    # Version of the flattening done by getPathVertices(). Bump it, whenever
+    # that output changes, so that old cache files are not used.
+    # 1: subdivideCubicPath() in document coordinates.
+    # 2: flattenPath() in local coordinates, with the tolerance scaled.
+    # 3: the tolerance is not rounded for unscaled paths.
+    VERSION = 3
+    MAGIC = b'inksvg-flatten-%d\n' % VERSION
+
+    def __init__(self, filename=None, maxsize=256<<20):
+        if filename is None:
+            filename = os.path.join(os.path.expanduser('~'), '.cache', 'thunderlaser', 'flatten.bin')
+        self.filename = filename
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = b''
+        self._index = {}        # key -> (offset, length, generation) of entries in self._data
+        self._used = {}         # key -> payload of entries to keep with the current generation
+        self._generation = 1
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as fd:
+                data = fd.read()
+        except (IOError, OSError):
+            return
+        if not data.startswith(self.MAGIC):
+            return
+        index = {}
+        generation = 0
+        pos = len(self.MAGIC)
+        try:
+            while pos < len(data):
+                (gen, length) = struct.unpack_from('<II', data, pos+20)
+                if pos+28+length > len(data): break     # truncated
+                index[data[pos:pos+20]] = (pos+28, length, gen)
+                generation = max(generation, gen)
+                pos += 28+length
+        except struct.error:
+            pass
+        self._data = data
+        self._index = index
+        self._generation = generation+1
+
+    def key(self, d, dash, transform, smoothness):
+        return hashlib.sha1(repr((self.VERSION, d, dash, transform, smoothness)).encode('utf-8')).digest()
+
+    def get(self, key):
+        """
+        Returns the subpath list for key, as built by getPathVertices(),
+        or None if key is not in the cache.
+        """
+        payload = self._used.get(key)
+        if payload is None and key in self._index:
+            (pos, length, gen) = self._index[key]
+            payload = self._data[pos:pos+length]
+            self._used[key] = payload
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        subpath_list = []
+        (nsub,) = struct.unpack_from('<I', payload, 0)
+        pos = 4
+        for i in range(nsub):
+            (n,) = struct.unpack_from('<I', payload, pos)
+            bbox = list(struct.unpack_from('<4d', payload, pos+4))
+            v = iter(struct.unpack_from('<%dd' % (2*n), payload, pos+36))
+            pos += 36+16*n
+            subpath_list.append([[[x, y] for (x, y) in zip(v, v)], bbox])
+        return subpath_list
+
+    def put(self, key, subpath_list):
+        data = [struct.pack('<I', len(subpath_list))]
+        for (vertices, bbox) in subpath_list:
+            data.append(struct.pack('<I4d', len(vertices), *bbox))
+            data.append(struct.pack('<%dd' % (2*len(vertices)), *[c for pt in vertices for c in pt]))
+        self._used[key] = b''.join(data)
+
+    def save(self):
+        """
+        Write all entries used or added since load() and as many of the older
+        entries as fit into maxsize to the file. Nothing is written, if no entry was used.
+        """
+        if not self._used:
+            return
+        entries = [(self._generation, key, self._used[key]) for key in self._used]
+        size = len(self.MAGIC) + sum([28+len(e[2]) for e in entries])
+        older = [(self._index[key][2], key) for key in self._index if key not in self._used]
+        for (gen, key) in sorted(older, reverse=True):
+            (pos, length, gen) = self._index[key]
+            if size+28+length > self.maxsize: break
+            entries.append((gen, key, self._data[pos:pos+length]))
+            size += 28+length
+
+        dirname = os.path.dirname(self.filename)
+        try:
+            if dirname and not os.path.isdir(dirname): os.makedirs(dirname)
+            tmpname = self.filename + '.%d.tmp' % os.getpid()
+            with open(tmpname, 'wb') as fd:
+                fd.write(self.MAGIC)
+                for (gen, key, payload) in entries:
+                    fd.write(key + struct.pack('<II', gen, len(payload)))
+                    fd.write(payload)
+            if os.path.exists(self.filename) and sys_platform.startswith('win'):
+                os.unlink(self.filename)        # windows cannot rename to an existing file.
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError) as e:
+            inkex.errormsg('Warning: cannot write %s: %s' % (self.filename, e))
+
+
 class InkSvg():
     """
     Usage example with subclassing:
@@ -258,7 +546,7 @@ class InkSvg():
     #    print(svg.pathgen.path)
 
     """
-    __version__ = "1.7c"
+    __version__ = "1.8"
     DEFAULT_WIDTH = 100
     DEFAULT_HEIGHT = 100
 
@@ -279,11 +567,11 @@ class InkSvg():
         # cannot use inkex.getElementById() -- it returns only the first element of each hit.
         # cannot use inkex.getselected() -- it returns the last element of each hit only.
         """Collect selected nodes"""
+        index = self.getIdIndex()
         nodes = []
         for id in ids:
           if id != '':    # empty strings happen after splitting...
-            path = '//*[@id="%s"]' % id
-            el_list = self.document.xpath(path, namespaces=InkSvg.NSS)
+            el_list = index.get(id)
             if el_list:
               for node in el_list:
                 nodes.append(node)
@@ -292,6 +580,21 @@ class InkSvg():
         return nodes
 
 
+    def getIdIndex(self):
+        """
+        Returns a dict, mapping each id to the list of elements with this id,
+        in document order. It is built in one pass over the document, when
+        first needed, and rebuilt when self.document is replaced.
+        Set self.id_index = None after changing ids in the document.
+        """
+        if self.id_index is None or self.id_index_doc is not self.document:
+          index = {}
+          for node in self.document.xpath('//*[@id]'):
+            index.setdefault(node.get('id'), []).append(node)
+          self.id_index = index
+          self.id_index_doc = self.document
+        return self.id_index
+
     def load(self, filename):
         inkex.localize()
         # OO-Fail: cannot call inkex.Effect.parse(), Effect constructor has so many side-effects.
@@ -299,6 +602,7 @@ class InkSvg():
         p = etree.XMLParser(huge_tree=True)
         self.document = etree.parse(stream, parser=p)
         stream.close()
+        self.id_index = None
         # initialize a coordinate system that can be picked up by pathgen.
         self.handleViewBox()
 
@@ -319,50 +623,80 @@ class InkSvg():
         else:
           # Traverse the entire document building new, transformed paths
           self.recursivelyTraverseSvg(self.document.getroot(), self.docTransform)
+        if self.cache is not None:
+          self.cache.save()
 
 
     def getNodeStyleOne(self, node):
         """
         Finds style declarations by .class, #id or by tag.class syntax,
         and of course by a direct style='...' attribute.
+
+        The css_dict declarations of each tag and class attribute combination
+        are looked up once, and kept in self.css_sheet_cache until cssDictAdd().
+        Parsed style strings are kept in self.style_parse_cache.
+        Do not modify the returned dict.
         """
         sheet = ''
-        selectors = []
-        classes = node.get('class', '')         # classes == None can happen here.
-        if classes is not None and classes != '':
-            selectors = ["."+cls for cls in re.split('[\s,]+', classes)]
-            selectors += [node.tag+sel for sel in selectors]
-        node_id = node.get('id', '')
-        if node_id is not None and node_id != '':
-            selectors += [ "#"+node_id ]
-        for sel in selectors:
-            if sel in self.css_dict:
-                sheet += '; '+self.css_dict[sel]
+        if self.css_dict:
+            classes = node.get('class', '')     # classes == None can happen here.
+            if classes is not None and classes != '':
+                key = (node.tag, classes)
+                sheet = self.css_sheet_cache.get(key)
+                if sheet is None:
+                    sheet = ''
+                    selectors = ["."+cls for cls in re.split('[\s,]+', classes)]
+                    selectors += [node.tag+sel for sel in selectors]
+                    for sel in selectors:
+                        if sel in self.css_dict:
+                            sheet += '; '+self.css_dict[sel]
+                    self.css_sheet_cache[key] = sheet
+            node_id = node.get('id', '')
+            if node_id is not None and node_id != '':
+                if "#"+node_id in self.css_dict:
+                    sheet += '; '+self.css_dict["#"+node_id]
         style = node.get('style', '')
         if style is not None and style != '':
             sheet += '; '+style
-        return simplestyle.parseStyle(sheet)
+        parsed = self.style_parse_cache.get(sheet)
+        if parsed is None:
+            parsed = simplestyle.parseStyle(sheet)
+            self.style_parse_cache[sheet] = parsed
+        return parsed
 
     def getNodeStyle(self, node):
         """
         Recurse into parent group nodes, like simpletransform.ComposeParents
         Calling getNodeStyleOne() for each.
+
+        The result is kept per node in self.style_cache. While recursivelyTraverseSvg()
+        walks down the document, the style of the parent group is already
+        there, and only the declarations of the node itself are added.
+        Nodes without declarations share the dict of their parent.
+        Do not modify the returned dict.
         """
+        combined_style = self.style_cache.get(node)
+        if combined_style is not None:
+            return combined_style
         combined_style = {}
         parent = node.getparent()
-        if parent.tag == inkex.addNS('g','svg') or parent.tag == 'g':
+        if parent is not None and (parent.tag == inkex.addNS('g','svg') or parent.tag == 'g'):
             combined_style = self.getNodeStyle(parent)
         style = self.getNodeStyleOne(node)
-        for s in style:
-            combined_style[s] = style[s]        # overwrite or add
+        if style:
+            combined_style = dict(combined_style)
+            for s in style:
+                combined_style[s] = style[s]    # overwrite or add
+        self.style_cache[node] = combined_style
         return combined_style
 
 
-    def styleDasharray(self, path_d, node):
+    def styleDasharray(self, path_d, node, style=None):
         """
         Check the style of node for a stroke-dasharray, and apply it to the
         path d returning the result.  d is returned unchanged, if no
-        stroke-dasharray was found.
+        stroke-dasharray was found. The style of node can be passed in,
+        if the caller already has it.
 
         ## Extracted from inkscape extension convert2dashes; original
         ## comments below.
@@ -394,7 +728,8 @@ class InkSvg():
             bez = (sp1[1][:],sp1[2][:],sp2[0][:],sp2[1][:])
             return bezmisc.bezierlength(bez, tolerance)
 
-        style = self.getNodeStyle(node)
+        if style is None:
+            style = self.getNodeStyle(node)
         if not style.has_key('stroke-dasharray'):
             return path_d
         dashes = []
@@ -414,7 +749,7 @@ class InkSvg():
         for sub in p:
             idash = 0
             dash = dashes[0]
-            # print("initial dash length: ", dash, dashoffset)
+            # print("initial dash length: ", dash, dashoffset, file=self.tty)
             dash = dash - dashoffset
             length = 0
             new.append([sub[0][:]])
@@ -456,14 +791,21 @@ class InkSvg():
         Hexadecimal stroke formats of '#RRGGBB' or '#RGB' are understood
         as well as 'rgb(100%, 0%, 0%) or 'red' relying on simplestyle.
         """
-        if eps is None:
-          eps = 64 if avg == True else 85
         if rgb is None or rgb is False: return False
         if rgb is True: return True
         style = self.getNodeStyle(node)
         s = style.get('stroke', '')
         if s == '': return False
         c = simplestyle.parseColor(s)
+        return self.matchColor(c, rgb, eps, avg)
+
+    def matchColor(self, c, rgb, eps=None, avg=True):
+        """
+        The color comparison of matchStrokeColor(), for a parsed color c
+        and an rgb list of three integers.
+        """
+        if eps is None:
+          eps = 64 if avg == True else 85
         if sum:
            s = abs(rgb[0]-c[0]) + abs(rgb[1]-c[1]) + abs(rgb[2]-c[2])
            if s < 3*eps:
@@ -474,11 +816,67 @@ class InkSvg():
         if abs(rgb[2]-c[2]) > eps: return False
         return True
 
+    def classifyStrokeColors(self, nodes, rgbs, eps=None, avg=True):
+        """
+        Assign each node to one of the colors in rgbs, according to its
+        stroke color. rgbs is a list of values as accepted by matchStrokeColor().
+        Returns a list with one entry per node: the index into rgbs, or None
+        if no color matches.
+
+        If several colors match, the first matching [r, g, b] value wins
+        over a True ('any') value. Otherwise the first match wins.
+
+        The stroke color of each node is taken from getStrokeColor(). Each
+        distinct color is compared against rgbs once, the results are kept
+        in a lookup table.
+        """
+        classify = self.strokeColorClassifier(rgbs, eps, avg)
+        return [classify(node) for node in nodes]
+
+    def strokeColorClassifier(self, rgbs, eps=None, avg=True):
+        """
+        Returns a function classify(node), that does what classifyStrokeColors()
+        does for a single node. The lookup table is shared by all calls.
+        """
+        order = [i for i in range(len(rgbs)) if rgbs[i] not in (None, False, True)]
+        order += [i for i in range(len(rgbs)) if rgbs[i] is True]
+        any_idx = [i for i in order if rgbs[i] is True]
+
+        by_color = { None: any_idx[0] if any_idx else None }   # (r, g, b) -> index
+
+        def classify(node):
+            c = self.getStrokeColor(node)
+            if c not in by_color:
+                by_color[c] = None
+                for i in order:
+                    if rgbs[i] is True or self.matchColor(c, rgbs[i], eps, avg):
+                        by_color[c] = i
+                        break
+            return by_color[c]
+        return classify
+
+    def getStrokeColor(self, node):
+        """
+        Returns the stroke color of node as an (r, g, b) tuple, or None if
+        the node has no stroke. Parsed colors are kept in self.color_parse_cache.
+        """
+        s = self.getNodeStyle(node).get('stroke', '')
+        if s == '':
+            return None
+        c = self.color_parse_cache.get(s)
+        if c is None:
+            c = tuple(simplestyle.parseColor(s))
+            self.color_parse_cache[s] = c
+        return c
+
     def cssDictAdd(self, text):
         """
         Represent css cdata as a hash in css_dict.
         Implements what is seen on: http://www.blooberry.com/indexdot/css/examples/cssembedded.htm
+        Styles computed before are dropped from the caches of getNodeStyle().
         """
+        self.style_cache = {}
+        self.css_sheet_cache = {}
         text=re.sub('^\s*(<!--)?\s*', '', text)
         while True:
             try:
@@ -568,6 +966,87 @@ class InkSvg():
             p = [one[2], one[3], two[1]]
             sp[i:1] = [p]
 
+    def flattenCubicPath(self, sp, flat):
+        '''
+        Returns the vertices of the subpath sp, with each bezier curve
+        subdivided as by subdivideCubicPath(). The result is the same, but
+        sp is not modified: pending halves wait on a stack, and vertices are
+        only appended to the output. Inserting into sp costs O(n**2) for
+        curves that need many subdivisions.
+
+        With numpy, longer subpaths are done by flattenCubicPathNumpy().
+        '''
+        if len(sp) == 0:
+            return []
+        if numpy is not None and len(sp) > 32:
+            return self.flattenCubicPathNumpy(sp, flat)
+
+        vertices = [sp[0][1]]
+        stack = []
+        for i in range(1, len(sp)):
+            b = (sp[i - 1][1], sp[i - 1][2], sp[i][0], sp[i][1])
+            while True:
+                if cspsubdiv.maxdist(b) > flat:
+                    one, two = bezmisc.beziersplitatt(b, 0.5)
+                    stack.append(two)
+                    b = one
+                    continue
+                vertices.append(b[3])
+                if not len(stack):
+                    break
+                b = stack.pop()
+        return vertices
+
+    def flattenCubicPathNumpy(self, sp, flat):
+        '''
+        Same as flattenCubicPath(), with numpy array operations. All curves of
+        the subpath are subdivided together, one level per round. The flatness
+        test is that of cspsubdiv.maxdist(): the larger distance of the two
+        control points from the line through the end points. It is NaN for
+        curves that end where they start, these are not subdivided.
+        '''
+        bez = numpy.array([[sp[i - 1][1], sp[i - 1][2], sp[i][0], sp[i][1]] for i in range(1, len(sp))],
+                          dtype=numpy.float64)
+        seg = numpy.arange(len(bez))            # index of the original curve
+        t = numpy.zeros(len(bez))               # start of each part in the original curve
+        w = 1.0                                 # length of all parts in this round
+        done_pt, done_seg, done_t = [], [], []
+        while len(bez):
+            (x0, y0) = (bez[:, 0, 0], bez[:, 0, 1])
+            dx = bez[:, 3, 0] - x0
+            dy = bez[:, 3, 1] - y0
+            l = numpy.sqrt(dx ** 2 + dy ** 2)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                d1 = numpy.fabs(dx * (y0 - bez[:, 1, 1]) - (x0 - bez[:, 1, 0]) * dy) / l
+                d2 = numpy.fabs(dx * (y0 - bez[:, 2, 1]) - (x0 - bez[:, 2, 0]) * dy) / l
+                split = numpy.maximum(d1, d2) > flat
+            split[l == 0] = False
+            keep = ~split
+            done_pt.append(bez[keep, 3])
+            done_seg.append(seg[keep])
+            done_t.append(t[keep])
+
+            bez, seg, t = bez[split], seg[split], t[split]
+            if not len(bez):
+                break
+            # bezmisc.beziersplitatt(b, 0.5), for all curves at once.
+            m1 = bez[:, 0] + 0.5 * (bez[:, 1] - bez[:, 0])
+            m2 = bez[:, 1] + 0.5 * (bez[:, 2] - bez[:, 1])
+            m3 = bez[:, 2] + 0.5 * (bez[:, 3] - bez[:, 2])
+            m4 = m1 + 0.5 * (m2 - m1)
+            m5 = m2 + 0.5 * (m3 - m2)
+            m = m4 + 0.5 * (m5 - m4)
+            one = numpy.stack((bez[:, 0], m1, m4, m), axis=1)
+            two = numpy.stack((m, m5, m3, bez[:, 3]), axis=1)
+            w *= 0.5
+            bez = numpy.concatenate((one, two))
+            seg = numpy.concatenate((seg, seg))
+            t = numpy.concatenate((t, t + w))
+
+        pts = numpy.concatenate(done_pt)
+        order = numpy.lexsort((numpy.concatenate(done_t), numpy.concatenate(done_seg)))
+        return [sp[0][1]] + pts[order].tolist()
+
     def parseLengthWithUnits(self, str, default_unit='px'):
         '''
         Parse an SVG value which may or may not have units attached
@@ -595,7 +1074,7 @@ class InkSvg():
         return v, u
 
 
-    def __init__(self, document=None, svgfile=None, smoothness=0.2, pathgen=LinearPathGen(smoothness=0.2)):
+    def __init__(self, document=None, svgfile=None, smoothness=0.2, debug=False, pathgen=LinearPathGen(smoothness=0.2), cache=None):
         """
         Usage: ...
         """
@@ -604,6 +1083,13 @@ class InkSvg():
         self.xmin, self.xmax = (1.0E70, -1.0E70)
         self.ymin, self.ymax = (1.0E70, -1.0E70)
 
+        try:
+            if debug == False: raise ValueError('intentional exception')
+            self.tty = open("/dev/tty", 'w')
+        except:
+            from os import devnull
+            self.tty = open(devnull, 'w')  # '/dev/null' for POSIX, 'nul' for Windows.
+
         # CAUTION: smoothness here is deprecated. it belongs into pathgen, if.
         # CAUTION: smoothness == 0.0 leads to a busy-loop.
         self.smoothness = max(0.0001, smoothness)    # 0.0001 .. 5.0
@@ -615,9 +1101,50 @@ class InkSvg():
         # to go back and update the SVG document, or retrieve e.g. style information.
         self.paths = []
 
+        # Elements by id, built by getIdIndex().
+        self.id_index = None
+        self.id_index_doc = None
+
+        # A FlattenCache() used by getPathVertices(), or None.
+        self.cache = cache
+
+        # Untransformed vertices of flattened path data, see getPathVertices().
+        # Memoization stops after flatten_memo_max vertices.
+        self.flatten_memo = {}
+        self.flatten_memo_size = 0
+        self.flatten_memo_max = 2000000
+
+        # A function accept(node), or None. Shapes it returns False for are
+        # not flattened by recursivelyTraverseSvg(). They only extend the
+        # drawing bounding box. self.skipping is set while they are traversed.
+        # Their path data is collected in self.skipped, see addSkippedBBoxes().
+        self.accept = None
+        self.skipping = False
+        self.skipped = []
+        self.traverse_depth = 0
+
+        # [xmin, xmax, ymin, ymax] or None. Paths that lie outside are not added
+        # to self.paths, and if possible not even flattened, see getPathVertices().
+        self.clip = None
+
+        # Number of elements rejected by accept, and by clip.
+        self.rejected = 0
+        self.clipped = 0
+
+        # Tags of the elements that recursivelyTraverseSvg() hands to pathgen.
+        self.shape_tags = set([inkex.addNS('path', 'svg')])
+        for tag in ('rect', 'line', 'polyline', 'polygon', 'ellipse', 'circle'):
+            self.shape_tags.update([inkex.addNS(tag, 'svg'), tag])
+
         # cssDictAdd collects style definitions here:
         self.css_dict = {}
 
+        # Caches of getNodeStyle() and getNodeStyleOne().
+        self.style_cache = {}
+        self.css_sheet_cache = {}
+        self.style_parse_cache = {}
+        self.color_parse_cache = {}
+
         # For handling an SVG viewbox attribute, we will need to know the
         # values of the document's <svg> width and height attributes as well
         # as establishing a transform from the viewbox to the display.
@@ -630,12 +1157,13 @@ class InkSvg():
         # multiple times about the same problem
         self.warnings = {}
 
+        self.document = None
         if document:
             self.document = document
             if svgfile:
                 inkex.errormsg('Warning: ignoring svgfile. document given too.')
         elif svgfile:
-            self.document = self.load(svgfile)
+            self.load(svgfile)
 
     def getLength(self, name, default):
 
@@ -759,6 +1287,32 @@ class InkSvg():
                     sy = self.docHeight / float(vinfo[3])
                     self.docTransform = simpletransform.parseTransform('scale(%f,%f)' % (sx, sy))
 
+    def pageBox(self):
+        '''
+        Returns the page as [xmin, xmax, ymin, ymax] in the coordinates of
+        self.paths, i.e. the viewBox rectangle mapped through docTransform,
+        or [0, docWidth, 0, docHeight] without a viewBox.
+        None if the page size is unknown: width or height missing, or not
+        in absolute units (e.g. '100%'). Call handleViewBox() first.
+        '''
+        root = self.document.getroot()
+        if root.get('width') is None or root.get('height') is None:
+            return None
+        if self.docWidth is None or self.docHeight is None:
+            return None
+        viewbox = root.get('viewBox')
+        if not viewbox:
+            return [0.0, self.docWidth, 0.0, self.docHeight]
+        try:
+            (x, y, w, h) = [float(v) for v in viewbox.strip().replace(',', ' ').split()]
+        except ValueError:
+            return None
+        if w <= 0 or h <= 0:
+            return None
+        corners = [[x, y], [x + w, y + h]]
+        [[corners, bbox]] = self.transformVertices([corners], self.docTransform)
+        return bbox
+
     def getPathVertices(self, path, node=None, transform=None, smoothness=None):
 
         '''
@@ -771,6 +1325,24 @@ class InkSvg():
         form (node, path_list). This preserves the native ordering of
         the SVG file as much as possible, while still making all attributes
         if the node available when processing the path list.
+
+        The path is flattened in its own coordinates, by flattenPath(), and
+        then transformed. The smoothness is divided by the largest scale factor
+        of the transform, so that it holds after transforming. The untransformed
+        vertices are kept in self.flatten_memo, thus repeated path data, e.g. of
+        <use> clones, is flattened only once per run.
+
+        With a FlattenCache in self.cache, the path list is taken from there,
+        if the same path was flattened before.
+
+        With self.clip set, a path that lies outside of it is not added,
+        see addPathVertices(). If it is not in the cache or the memo, the
+        bounding box of its control points is checked first, so that it is
+        not even flattened.
+
+        With self.skipping set (for elements rejected by self.accept), the
+        path is not flattened here. It is kept in self.skipped, for
+        addSkippedBBoxes() at the end of the traversal.
         '''
 
         if not smoothness:
@@ -780,8 +1352,74 @@ class InkSvg():
             # Nothing to do
             return None
 
+        if self.skipping:
+            bbox = self.pathBBox(path, transform)
+            if bbox is not None and (self.clip is None or self.boxInClip(bbox)):
+                self.skipped.append((path, node, transform, smoothness, bbox))
+            return None
+
+        subpath_list = self.flattenTransformed(path, node, transform, smoothness)
+        if subpath_list is not None:
+            self.addPathVertices(node, subpath_list)
+
+    def flattenTransformed(self, path, node, transform, smoothness):
+        '''
+        Returns the subpath list of the path data, flattened and transformed
+        as described in getPathVertices(), using self.cache and
+        self.flatten_memo. None if there is nothing to add, or if the path
+        is outside of self.clip.
+        '''
+        style = None
+        dash = None
+        if node is not None:
+            style = self.getNodeStyle(node)
+            dash = (style.get('stroke-dasharray'), style.get('stroke-dashoffset'))
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(path, dash, transform, float(smoothness))
+            subpath_list = self.cache.get(cache_key)
+            if subpath_list is not None:
+                return subpath_list
+
+        # Round the tolerance down to 1/64 of an octave, so that clones with
+        # almost the same scale (e.g. rotated) share the memo entry.
+        # Without scaling, the smoothness is used as it is.
+        flat = float(smoothness)
+        scale = self.transformScale(transform)
+        if scale > 0.0 and scale != 1.0:
+            flat = 2.0 ** (math.floor(64 * math.log(flat / scale, 2)) / 64)
+
+        memo_key = (path, dash, flat)
+        vertex_lists = self.flatten_memo.get(memo_key)
+        if vertex_lists is None:
+            if self.clip is not None:
+                bbox = self.pathBBox(path, transform)
+                if bbox is not None and not self.boxInClip(bbox):
+                    self.clipped += 1
+                    return None
+            vertex_lists = self.flattenPath(path, node, style, flat)
+            if vertex_lists is None:
+                return None
+            if self.flatten_memo_size < self.flatten_memo_max:
+                self.flatten_memo[memo_key] = vertex_lists
+                self.flatten_memo_size += sum([len(v) for v in vertex_lists])
+
+        subpath_list = self.transformVertices(vertex_lists, transform)
+        if cache_key is not None and len(subpath_list) > 0:
+            self.cache.put(cache_key, subpath_list)
+        return subpath_list
+
+    def flattenPath(self, path, node, style, flat):
+        '''
+        Returns the subpaths of the path data as lists of vertices, without
+        any transform. Bezier curves are subdivided until they are within flat
+        of a straight line. A stroke-dasharray of the node is applied first.
+        None is returned if the path data has no content.
+        '''
+
         if node is not None:
-            path = self.styleDasharray(path, node)
+            path = self.styleDasharray(path, node, style)
 
         # parsePath() may raise an exception.  This is okay
         sp = simplepath.parsePath(path)
@@ -795,69 +1433,155 @@ class InkSvg():
             # Probably never happens, but...
             return None
 
-        if transform:
-            simpletransform.applyTransformToPath(transform, p)
+        vertex_lists = []
+        for sp in p:
+            vertex_lists.append(self.flattenCubicPath(sp, flat))
+        return vertex_lists
+
+    def pathBBox(self, path, transform):
+        '''
+        Returns the bounding box [xmin, xmax, ymin, ymax] of the control
+        points of the path data, after applying transform. The bezier curves
+        of the path stay within it. Dashes are not considered, they only
+        remove parts of the path. None if the path has no points.
+        '''
+        p = cubicsuperpath.CubicSuperPath(simplepath.parsePath(path))
+        xs = [pt[0] for sp in p for csp in sp for pt in csp]
+        ys = [pt[1] for sp in p for csp in sp for pt in csp]
+        if not len(xs):
+            return None
+        corners = [[min(xs), min(ys)], [max(xs), min(ys)], [min(xs), max(ys)], [max(xs), max(ys)]]
+        [[corners, bbox]] = self.transformVertices([corners], transform)
+        return bbox
+
+    def boxInClip(self, bbox):
+        '''
+        Returns False if the bounding box [xmin, xmax, ymin, ymax] lies outside of self.clip.
+        '''
+        (xmin, xmax, ymin, ymax) = bbox
+        (cxmin, cxmax, cymin, cymax) = self.clip
+        return xmax >= cxmin and xmin <= cxmax and ymax >= cymin and ymin <= cymax
+
+    def hasDasharray(self, node):
+        '''
+        True if styleDasharray() would split the outline of node into dashes.
+        '''
+        return self.getNodeStyle(node).get('stroke-dasharray', '').find(',') > 0
+
+    def arcVertices(self, cx, cy, rx, ry, st, en, flat):
+        '''
+        Returns the vertices of an elliptical arc, from angle st to angle en
+        (in radians, en < st runs backwards). The angles are evenly spaced, and
+        the chords stay within flat of the arc: a chord spanning the angle a
+        is at most max(rx, ry) * (1 - cos(a/2)) away from it. A quarter ellipse
+        takes at least one chord.
+        '''
+        r = max(abs(rx), abs(ry))
+        step = 0.5 * math.pi
+        if flat < r:
+            step = min(step, 2.0 * math.acos(1.0 - flat / r))
+        n = max(1, int(math.ceil(abs(en - st) / step - 1e-9)))
+        a = (en - st) / n
+        return [[cx + rx * math.cos(st + i*a), cy + ry * math.sin(st + i*a)] for i in range(n + 1)]
+
+    def getShapeVertices(self, vertex_lists, node=None, transform=None):
+        '''
+        Like getPathVertices(), for lists of vertices that were generated
+        without path data, e.g. by arcVertices(). The vertices are
+        transformed and added by addPathVertices(). With self.skipping set,
+        only their bounding box is added to the drawing bounding box.
+        '''
+        subpath_list = self.transformVertices(vertex_lists, transform)
+        if self.skipping:
+            if self.clip is not None and not [1 for (vertices, bbox) in subpath_list if self.boxInClip(bbox)]:
+                return None
+            for (vertices, bbox) in subpath_list:
+                self.addBBox(bbox)
+            return None
+        self.addPathVertices(node, subpath_list)
 
-        # Now traverse the cubic super path
+    def transformScale(self, transform):
+        '''
+        Returns the largest factor by which transform stretches a distance,
+        the larger singular value of its 2x2 matrix part. 1.0 for no transform.
+        '''
+        if not transform:
+            return 1.0
+        (a, c) = (transform[0][0], transform[0][1])
+        (b, d) = (transform[1][0], transform[1][1])
+        s = a*a + b*b + c*c + d*d
+        det = a*d - b*c
+        return math.sqrt(0.5 * (s + math.sqrt(max(0.0, s*s - 4*det*det))))
+
+    def transformVertices(self, vertex_lists, transform):
+        '''
+        Apply transform to lists of vertices, as returned by flattenPath().
+        Returns new lists, in the path_list format of getPathVertices(): each
+        list of vertices is paired with its bounding box [xmin, xmax, ymin, ymax].
+        '''
+        if not transform:
+            transform = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+        ((a, c, e), (b, d, f)) = transform
         subpath_list = []
-        subpath_vertices = []
+        for vertices in vertex_lists:
+            if not len(vertices):
+                continue
+            tv = [[a*x + c*y + e, b*x + d*y + f] for (x, y) in vertices]
+            xs = [pt[0] for pt in tv]
+            ys = [pt[1] for pt in tv]
+            subpath_list.append([tv, [min(xs), max(xs), min(ys), max(ys)]])
+        return subpath_list
 
-        for sp in p:
+    def addPathVertices(self, node, subpath_list):
+        '''
+        Append (node, subpath_list) to self.paths, and track the bounding box of
+        the overall drawing in self.xmin, self.xmax, self.ymin, self.ymax.
+        This is used for centering the polygons in OpenSCAD around the (x,y) origin.
+
+        With self.clip set, nothing is added if all subpaths lie outside of it.
+        '''
+        if self.clip is not None and len(subpath_list) > 0:
+            if not [1 for (vertices, bbox) in subpath_list if self.boxInClip(bbox)]:
+                self.clipped += 1
+                return
 
-            # We've started a new subpath
-            # See if there is a prior subpath and whether we should keep it
-            if len(subpath_vertices):
-                subpath_list.append([subpath_vertices, [sp_xmin, sp_xmax, sp_ymin, sp_ymax]])
-
-            subpath_vertices = []
-            self.subdivideCubicPath(sp, float(smoothness))
-
-            # Note the first point of the subpath
-            first_point = sp[0][1]
-            subpath_vertices.append(first_point)
-            sp_xmin = first_point[0]
-            sp_xmax = first_point[0]
-            sp_ymin = first_point[1]
-            sp_ymax = first_point[1]
-
-            n = len(sp)
-
-            # Traverse each point of the subpath
-            for csp in sp[1:n]:
-
-                # Append the vertex to our list of vertices
-                pt = csp[1]
-                subpath_vertices.append(pt)
-
-                # Track the bounding box of this subpath
-                if pt[0] < sp_xmin:
-                    sp_xmin = pt[0]
-                elif pt[0] > sp_xmax:
-                    sp_xmax = pt[0]
-                if pt[1] < sp_ymin:
-                    sp_ymin = pt[1]
-                elif pt[1] > sp_ymax:
-                    sp_ymax = pt[1]
-
-            # Track the bounding box of the overall drawing
-            # This is used for centering the polygons in OpenSCAD around the
-            # (x,y) origin
-            if sp_xmin < self.xmin:
-                self.xmin = sp_xmin
-            if sp_xmax > self.xmax:
-                self.xmax = sp_xmax
-            if sp_ymin < self.ymin:
-                self.ymin = sp_ymin
-            if sp_ymax > self.ymax:
-                self.ymax = sp_ymax
-
-        # Handle the final subpath
-        if len(subpath_vertices):
-            subpath_list.append([subpath_vertices, [sp_xmin, sp_xmax, sp_ymin, sp_ymax]])
+        for (vertices, bbox) in subpath_list:
+            self.addBBox(bbox)
 
         if len(subpath_list) > 0:
             self.paths.append( (node, subpath_list) )
 
+    def addSkippedBBoxes(self):
+        '''
+        Extend the bounding box of the overall drawing by the paths in
+        self.skipped, as if they had been flattened. Paths whose control
+        points lie strictly inside the bounding box cannot extend it, as the
+        curves stay within their control points. Only the others are flattened.
+        '''
+        skipped = self.skipped
+        self.skipped = []
+        for (path, node, transform, smoothness, bbox) in skipped:
+            if bbox[0] > self.xmin and bbox[1] < self.xmax and bbox[2] > self.ymin and bbox[3] < self.ymax:
+                continue
+            subpath_list = self.flattenTransformed(path, node, transform, smoothness) or []
+            if self.clip is not None and not [1 for (vertices, vbbox) in subpath_list if self.boxInClip(vbbox)]:
+                continue
+            for (vertices, vbbox) in subpath_list:
+                self.addBBox(vbbox)
+
+    def addBBox(self, bbox):
+        '''
+        Extend the bounding box of the overall drawing by bbox [xmin, xmax, ymin, ymax].
+        '''
+        if bbox[0] < self.xmin:
+            self.xmin = bbox[0]
+        if bbox[1] > self.xmax:
+            self.xmax = bbox[1]
+        if bbox[2] < self.ymin:
+            self.ymin = bbox[2]
+        if bbox[3] > self.ymax:
+            self.ymax = bbox[3]
+
 
     def recursivelyTraverseSvg(self, aNodeList, matCurrent=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
                                parent_visibility='visible'):
@@ -883,6 +1607,7 @@ class InkSvg():
         All other SVG elements trigger an error (including <text>)
         '''
 
+        self.traverse_depth += 1
         for node in aNodeList:
 
             # Ignore invisible nodes
@@ -896,6 +1621,12 @@ class InkSvg():
             s = self.getNodeStyle(node)
             if s.get('display', '') == 'none': continue
 
+            # Shapes rejected by accept are not flattened, but still count
+            # for the bounding box of the drawing, see getPathVertices() and addSkippedBBoxes().
+            self.skipping = self.accept is not None and node.tag in self.shape_tags and not self.accept(node)
+            if self.skipping:
+                self.rejected += 1
+
             # First apply the current matrix transform to this node's tranform
             matNew = simpletransform.composeTransform(
                 matCurrent, simpletransform.parseTransform(node.get("transform")))
@@ -908,8 +1639,8 @@ class InkSvg():
 
                 # A <use> element refers to another SVG element via an
                 # xlink:href="#blah" attribute.  We will handle the element by
-                # doing an XPath search through the document, looking for the
-                # element with the matching id="blah" attribute.  We then
+                # looking up the element with the matching id="blah" attribute
+                # in the id index of the document.  We then
                 # recursively process that element after applying any necessary
                 # (x,y) translation.
                 #
@@ -926,8 +1657,7 @@ class InkSvg():
                     continue
 
                 # [1:] to ignore leading '#' in reference
-                path = '//*[@id="%s"]' % refid[1:]
-                refnode = node.xpath(path)
+                refnode = self.getIdIndex().get(refid[1:])
                 if refnode:
                     x = float(node.get('x', '0'))
                     y = float(node.get('y', '0'))
@@ -975,65 +1705,33 @@ class InkSvg():
 
             elif node.tag == inkex.addNS('line', 'svg') or node.tag == 'line':
 
-                # Convert
-                #
-                #   <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
-                #
-                # to
-                #
-                #   <path d="MX1,Y1 LX2,Y2"/>
-
                 x1 = float(node.get('x1'))
                 y1 = float(node.get('y1'))
                 x2 = float(node.get('x2'))
                 y2 = float(node.get('y2'))
                 if (not x1) or (not y1) or (not x2) or (not y2):
                     continue
-                a = []
-                a.append(['M ', [x1, y1]])
-                a.append([' L ', [x2, y2]])
-                self.pathgen.pathList(a, node, matNew)
+                self.pathgen.objLine(x1, y1, x2, y2, node, matNew)
 
             elif node.tag == inkex.addNS('polyline', 'svg') or node.tag == 'polyline':
 
-                # Convert
-                #
-                #  <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
-                #
                 # Note: we ignore polylines with no points
 
                 pl = node.get('points', '').strip()
                 if pl == '':
                     continue
 
-                pa = pl.split()
-                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
-                self.pathgen.pathString(d, node, matNew)
+                self.pathgen.objPolyline(pl, False, node, matNew)
 
             elif node.tag == inkex.addNS('polygon', 'svg') or node.tag == 'polygon':
 
-                # Convert
-                #
-                #  <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...] Z"/>
-                #
                 # Note: we ignore polygons with no points
 
                 pl = node.get('points', '').strip()
                 if pl == '':
                     continue
 
-                pa = pl.split()
-                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i] for i in range(0, len(pa))])
-                d += " Z"
-                self.pathgen.pathString(d, node, matNew)
+                self.pathgen.objPolyline(pl, True, node, matNew)
 
             elif node.tag == inkex.addNS('ellipse', 'svg') or node.tag == 'ellipse' or \
                  node.tag == inkex.addNS('circle', 'svg')  or node.tag == 'circle':
@@ -1140,6 +1838,11 @@ class InkSvg():
                 inkex.errormsg('Warning: unable to draw object <%s>, please convert it to a path first.' % node.tag)
                 pass
 
+        self.skipping = False
+        self.traverse_depth -= 1
+        if self.traverse_depth == 0:
+            self.addSkippedBBoxes()
+
     def recursivelyGetEnclosingTransform(self, node):
 
         '''
@@ -1172,10 +1875,12 @@ class InkSvg():
 #
 # High level methods:
 #  set(paths=[[..]], speed=.., power=[..], ...)
-#  write(fd)
+#  write(fd), write_stream(fd)
+#  estimate()
 #
 # Intermediate methods:
 #  header(), body(), trailer()
+#  body_paths(), body_paths_numpy()
 #
 # Low level methods:
 #  encode_hex(), encode_relcoord(), encode_percent()
@@ -1201,14 +1906,52 @@ class InkSvg():
 # 2017-12-18, jw@fabmail.org
 #     v1.6 -- encode_byte() encode_color() added.
 #             multi layer support in header() and body() done.
-
-import sys, re, math, copy
+# 2026-10-17
+#     v1.7 -- encode_hex() snippets and enc() format strings are parsed once
+#             and cached. body() emits precomputed opcode bytes per vertex.
+#             header(), body(), trailer() and enc() assemble their output in
+#             a RuidaBuffer(), avoiding quadratic bytes() concatenation.
+#             body_paths_numpy() encodes a layer with numpy array operations,
+#             used by body() if numpy is available. Same output as body_paths(),
+#             compared by test/bench_ruida.py.
+#             scramble_bytes() and unscramble_bytes() use translation tables,
+#             a bytearray() is converted in place.
+#             write_stream() writes in chunks, with bounded memory.
+#             Bounding box and odometer of each layer are computed while
+#             encoding, instead of extra passes over the paths.
+#             added _quantize = True. Relative moves are computed from
+#             integer micrometers, _forceabs is no longer needed.
+#             added estimate(), job time with acceleration and corner slowdown.
+#             added _processes. body() can encode path chunks in a process pool.
+#             added _cache. RuidaCache() keeps the geometry of unchanged layers on disk.
+
+import sys, os, stat, re, math, copy, itertools, multiprocessing
+import hashlib, json, struct, tempfile
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 # python2 has a completely useless alias bytes = str. Fix this:
 if sys.version_info.major < 3:
         def bytes(tupl):
                 "Minimalistic python3 compatible implementation used in python2."
-                return "".join(map(chr, tupl))
+                return str(bytearray(tupl))
+
+class RuidaBuffer(bytearray):
+  """
+  Append-only output buffer for encoded instructions.
+  Appending with += is amortized O(1), as the underlying bytearray grows in
+  place. Repeated += on immutable bytes() copies all previous data each time.
+  """
+  def getvalue(self):
+    """ Returns the buffer contents as a bytes() object (a str() in python2). """
+    if sys.version_info.major < 3:
+      return str(self)
+    else:
+      return bytes(self)
+
 
 class RuidaLayer():
   """
@@ -1222,6 +1965,13 @@ class RuidaLayer():
     self._color = color
     self._freq  = freq
 
+    # Results of Ruida.iter_body(), computed while the paths are encoded:
+    self._paths_bbox = None     # boundingbox() of the paths, None if there are no points.
+    self._odo = None            # odometer() of the paths: [cut_distance, travel_distance]
+
+    # Result of Ruida.estimate():
+    self._time = None           # estimated run time in seconds.
+
   def set(self, paths=None, speed=None, power=None, bbox=None, color=None, freq=None):
     if paths is not None: self._paths = paths
     if speed is not None: self._speed = speed
@@ -1232,6 +1982,170 @@ class RuidaLayer():
 
 
 
+class RuidaCache():
+  """
+  Disk cache for the encoded geometry of RuidaLayer()s. Entries are files in
+  a directory, named by a hash of everything that goes into the geometry:
+  the paths, speed, power, color, freq and the encoder settings of Ruida.
+  A layer that was encoded before with the same key is read back from the
+  file instead of encoded again. The prolog of a layer is not cached, it
+  depends on the layer number.
+
+  Each file starts with a line of json, holding the bounding box and the
+  odometer of the layer, followed by the instruction bytes.
+
+  The total size of the files is limited to maxsize bytes. When it is
+  exceeded, the least recently used files are removed.
+  """
+  def __init__(self, directory=None, maxsize=256<<20):
+    if directory is None: directory = os.path.join(os.path.expanduser('~'), '.cache', 'thunderlaser')
+    self._dir = directory
+    self._maxsize = maxsize
+    self._suffix = '.rdb'
+
+  def key(self, rd, l, chunksize=None):
+    """
+    Returns the hex digest for RuidaLayer l, encoded by Ruida rd with
+    iter_body(chunksize=chunksize). With _processes > 1 the chunks start
+    with an absolute move, so the chunking is part of the key.
+    """
+    h = hashlib.sha1()
+    chunking = None
+    if rd._processes and rd._processes > 1: chunking = (rd._processes, chunksize or 1<<20)
+    params = (rd.__version__, rd._quantize, rd._forceabs, rd._maxrel, chunking, l._speed, l._power, l._color, l._freq)
+    h.update(repr(params).encode('ascii'))
+    for path in l._paths or []:
+      n = len(path)
+      h.update(struct.pack('<i%dd' % (2*n), n, *itertools.chain.from_iterable(path)))
+    return h.hexdigest()
+
+  def filename(self, key):
+    return os.path.join(self._dir, key + self._suffix)
+
+  def open_entry(self, key):
+    """
+    Returns an open file positioned after the json line, and the parsed json.
+    None if key is not in the cache, or the file is incomplete.
+    """
+    try:
+      fd = open(self.filename(key), 'rb')
+    except (IOError, OSError):
+      return None
+    try:
+      meta = json.loads(fd.readline().decode('ascii'))
+      if os.fstat(fd.fileno()).st_size - fd.tell() != meta['size']: raise ValueError("truncated")
+    except (ValueError, KeyError, IOError, OSError):
+      fd.close()
+      return None
+    return (fd, meta)
+
+  def peek(self, key):
+    """
+    Returns (bbox, odo) of a cached layer, without reading the geometry. None if not cached.
+    """
+    entry = self.open_entry(key)
+    if entry is None: return None
+    entry[0].close()
+    return (entry[1]['bbox'], entry[1]['odo'])
+
+  def get(self, key, chunksize=1<<20):
+    """
+    Returns (bbox, odo, chunks), or None if key is not in the cache.
+    chunks is a generator, reading the instruction bytes from the file.
+    """
+    entry = self.open_entry(key)
+    if entry is None: return None
+    (fd, meta) = entry
+    try:
+      os.utime(fd.name, None)           # most recently used.
+    except OSError:
+      pass
+
+    def chunks(fd):
+      try:
+        while True:
+          data = fd.read(chunksize)
+          if not data: break
+          yield data
+      finally:
+        fd.close()
+    return (meta['bbox'], meta['odo'], chunks(fd))
+
+  def writer(self, key):
+    """
+    Returns a RuidaCacheWriter() for a new entry. None, if the directory cannot be written.
+    """
+    try:
+      if not os.path.isdir(self._dir): os.makedirs(self._dir)
+      return RuidaCacheWriter(self, key)
+    except (IOError, OSError):
+      return None
+
+  def prune(self):
+    """
+    Remove the least recently used files, until the total size is within _maxsize.
+    """
+    entries = []
+    try:
+      for name in os.listdir(self._dir):
+        if not name.endswith(self._suffix): continue
+        st = os.stat(os.path.join(self._dir, name))
+        entries.append((st.st_mtime, st.st_size, name))
+    except OSError:
+      return
+    total = sum([e[1] for e in entries])
+    for (mtime, size, name) in sorted(entries):
+      if total <= self._maxsize: break
+      try:
+        os.unlink(os.path.join(self._dir, name))
+        total -= size
+      except OSError:
+        pass
+
+
+class RuidaCacheWriter():
+  """
+  Stores an entry of RuidaCache() in a temporary file. The entry becomes
+  visible with commit(). close() removes the temporary file, if it was not committed.
+  The json line is written last, into space reserved at the start of the file.
+  """
+  _metasize = 256
+
+  def __init__(self, cache, key):
+    self._cache = cache
+    self._key = key
+    (fd, self._tmpname) = tempfile.mkstemp(suffix='.tmp', dir=cache._dir)
+    self._fd = os.fdopen(fd, 'wb')
+    self._fd.write(b' ' * self._metasize)
+    self._size = 0
+
+  def write(self, data):
+    self._fd.write(data)
+    self._size += len(data)
+
+  def commit(self, bbox, odo):
+    meta = json.dumps({ 'bbox': bbox, 'odo': odo, 'size': self._size })
+    if len(meta) >= self._metasize: return
+    self._fd.seek(0)
+    self._fd.write((meta + ' ' * (self._metasize - 1 - len(meta)) + '\n').encode('ascii'))
+    self._fd.close()
+    try:
+      os.rename(self._tmpname, self._cache.filename(self._key))
+      self._tmpname = None
+    except OSError:
+      pass              # windows cannot rename to an existing file. Same contents anyway.
+    self._cache.prune()
+
+  def close(self):
+    if not self._fd.closed: self._fd.close()
+    if self._tmpname:
+      try:
+        os.unlink(self._tmpname)
+      except OSError:
+        pass
+      self._tmpname = None
+
+
 class Ruida():
   """
    Assemble a valid *.rd file with multiple layers. Each layer has the following parameters:
@@ -1271,7 +2185,18 @@ class Ruida():
         Expected as a triple [RED, GREEN, BLUE] each in [0..255]
   """
 
-  __version__ = "1.6"
+  __version__ = "1.7"
+
+  # Parsed encode_hex() snippets and compiled enc() format strings.
+  # Shared by all instances, as the snippets are mostly constants in this file.
+  _hex_cache = {}
+  _hex_cache_max = 1000
+  _fmt_cache = {}
+
+  # 256 byte translation tables for scramble_bytes() and unscramble_bytes(),
+  # built on first use from scramble() and unscramble().
+  _scramble_table = None
+  _unscramble_table = None
 
   def __init__(self, layers=None):
     if layers is None: layers = []
@@ -1293,13 +2218,47 @@ class Ruida():
     #
     # Set to 1, to disable relative moves.
     # Set to 0, to never force an absolute move. Allows potentially infinite precision loss.
+    #
+    # Not used with _quantize.
     self._forceabs = 100
 
+    # Truncate all coordinates to integer micrometers, before computing relative moves.
+    # The sum of relative moves then arrives exactly at the next absolute position, there is
+    # no precision loss. Absolute moves are only needed where a difference exceeds the
+    # range of encode_relcoord(). Horizontal and vertical moves are detected in micrometers.
+    # Set to False, for the float differences and the _forceabs rule of v1.6.
+    self._quantize = True
+
+    # 8.191 encodes as 3f 7f. -8.191 encodes as 40 01
+    self._maxrel = 8.191
+
+    # Geometry encoder used by body(): 'python', 'numpy', or None to use numpy when available.
+    self._engine = None
+
+    # Number of worker processes for body(). 0 or 1 encodes in this process.
+    # Chunks of paths are encoded in parallel, see iter_geometry_parallel().
+    self._processes = 0
+
+    # A RuidaCache() for the geometry of the layers, or None.
+    self._cache = None
+
+    # Machine dynamics for estimate(). Acceleration in mm/s^2, the same for travel and cut.
+    # Corners are passed at the speed where a circular blend would deviate by _junction mm
+    # from the corner point (the junction deviation model of grbl).
+    self._accel = 3000.0
+    self._junction = 0.05
+
   def addLayer(self, layer):
     self._layers.append(layer)
 
-  def set(self, nlayers=None, layer=0, paths=None, speed=None, power=None, globalbbox=None, bbox=None, freq=None, odo=None, color=None, forceabs=None):
+  def set(self, nlayers=None, layer=0, paths=None, speed=None, power=None, globalbbox=None, bbox=None, freq=None, odo=None, color=None, forceabs=None, engine=None, quantize=None, accel=None, junction=None, processes=None, cache=None):
     if forceabs   is not None: self._forceabs   = forceabs
+    if cache      is not None: self._cache      = cache
+    if processes  is not None: self._processes  = processes
+    if accel      is not None: self._accel      = accel
+    if junction   is not None: self._junction   = junction
+    if quantize   is not None: self._quantize   = quantize
+    if engine     is not None: self._engine     = engine
     if globalbbox is not None: self._globalbbox = globalbbox
     if odo        is not None: self._odo        = odo
 
@@ -1317,7 +2276,7 @@ class Ruida():
     if color is not None: self._layers[layer].set(color = color)
 
 
-  def write(self, fd, scramble=True):
+  def write(self, fd, scramble=True, chunksize=None):
     """
     Write a fully prepared object into a file (or raise ValueError()s
     for missing attributes). The object must be prepared by passing
@@ -1328,30 +2287,131 @@ class Ruida():
     The file format is normally scrambled. Files written with
     scramble=False are not understood by the machine, but may be
     helpful for debugging.
+
+    With a chunksize, the work is done by write_stream().
     """
+    if chunksize: return self.write_stream(fd, scramble=scramble, chunksize=chunksize)
 
+    # body() runs first, it also computes bounding boxes and odometers of the layers.
+    if not self._body:
+      if self._layers:
+        self._body = self.body(self._layers)
     if not self._header:
       if self._layers:
         for l in self._layers:
-          if l._bbox is None and l._paths: l._bbox = self.boundingbox(l._paths)
+          if l._bbox is None and l._paths: l._bbox = self.layer_bbox(l)
       self._header = self.header(self._layers)
-    if not self._body:
-      if self._layers:
-        self._body = self.body(self._layers)
     if not self._odo:
       if self._layers:
         for l in self._layers:
-          self.odoAdd(self.odometer(l._paths))
+          self.odoAdd(self.layer_odo(l))
     if not self._trailer: self._trailer = self.trailer(self._odo)
 
     if not self._header:  raise ValueError("header(_bbox,_speed,_power,_freq) not initialized")
     if not self._body:    raise ValueError("body(_layers) not initialized")
     if not self._trailer: raise ValueError("trailer() not initialized")
 
-    contents = self._header + self._body + self._trailer
-    if scramble: contents = self.scramble_bytes(contents)
+    contents = RuidaBuffer()
+    contents += self._header
+    contents += self._body
+    contents += self._trailer
+    if scramble: self.scramble_bytes(contents)      # in place
     fd.write(contents)
 
+  def write_stream(self, fd, scramble=True, chunksize=1<<20):
+    """
+    Same as write(), but the body is encoded, scrambled and written in
+    chunks of about chunksize bytes. Memory use does not grow with the size
+    of the job. The body is not kept in self._body. The output is identical.
+
+    The header needs the bounding boxes of the layers, before any geometry.
+    If fd is a regular file, a header with preliminary bounding boxes is
+    written first, and overwritten with the correct header at the end.
+    Otherwise, e.g. for a device node, the bounding boxes are computed in a
+    pre-pass over the paths. The trailer comes last, thus the odometer is
+    simply taken from the layers after they are written.
+    """
+    if not self._layers: raise ValueError("body(_layers) not initialized")
+
+    backpatch = []
+    if not self._header:
+      backpatch = [l for l in self._layers if l._bbox is None and l._paths]
+      if not self.seekable(fd):
+        for l in backpatch: l._bbox = self.cached_bbox(l, chunksize) or self.boundingbox(l._paths)
+        backpatch = []
+      for l in backpatch: l._bbox = [[0,0], [0,0]]        # encodes with the same length.
+      self._header = self.header(self._layers)
+    if backpatch: header_pos = fd.tell()
+
+    out = RuidaBuffer()
+    def flush(out):
+      if scramble: self.scramble_bytes(out)     # in place
+      fd.write(out)
+      del out[:]
+
+    out += self._header
+    for data in self.iter_body(self._layers, chunksize=chunksize):
+      out += data
+      if len(out) >= chunksize: flush(out)
+
+    if not self._odo:
+      for l in self._layers:
+        self.odoAdd(self.layer_odo(l))
+    if not self._trailer: self._trailer = self.trailer(self._odo)
+    out += self._trailer
+    flush(out)
+
+    if backpatch:
+      for l in backpatch: l._bbox = l._paths_bbox
+      header = self.header(self._layers)
+      if len(header) != len(self._header): raise ValueError("header length changed, cannot patch")
+      self._header = header
+      out += header
+      end_pos = fd.tell()
+      fd.seek(header_pos)
+      flush(out)
+      fd.seek(end_pos)
+
+  def seekable(self, fd):
+    """
+    True if fd is a regular file, or an in-memory file object that can seek.
+    Device nodes are never seeked, even if the system would allow it.
+    """
+    try:
+      return stat.S_ISREG(os.fstat(fd.fileno()).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+      pass
+    try:
+      return fd.seekable()
+    except AttributeError:
+      return False
+
+  def cached_bbox(self, l, chunksize=None):
+    """
+    Returns the bounding box of the paths of RuidaLayer l from the _cache,
+    without reading the geometry. None if not available.
+    """
+    if self._cache is None: return None
+    hit = self._cache.peek(self._cache.key(self, l, chunksize))
+    if hit is None: return None
+    return hit[0]
+
+  def layer_bbox(self, l):
+    """
+    Returns the bounding box of the paths of RuidaLayer l. The result of
+    body() is used, if available. Otherwise boundingbox() is called.
+    """
+    if l._paths_bbox is not None: return l._paths_bbox
+    return self.boundingbox(l._paths)
+
+  def layer_odo(self, l):
+    """
+    Returns the odometer of the paths of RuidaLayer l. The result of
+    body() is used, if available. Otherwise odometer() is called.
+    """
+    if l._odo is not None: return l._odo
+    return self.odometer(l._paths)
+
   def odometer(self, paths=None, init=[0,0], return_home=False):
     """
     Returns a list of two values: [ cut_distance, travel_distance ]
@@ -1390,6 +2450,141 @@ class Ruida():
       for n in range(len(odo)):
         self._odo[n] += odo[n]
 
+  def estimate(self, layers=None, init=[0,0]):
+    """
+    Estimate the run time of the job in seconds. Returns a dict
+      { 'layers': [ seconds_layer0, seconds_layer1, ... ], 'total': seconds }
+    and stores the time of each layer in its _time attribute.
+
+    Each layer starts at init, like odometer(). Travel moves start and end at
+    standstill, at the travel speed (speed[0]). Paths are cut at the laser
+    speed (speed[1]), starting and ending at standstill. In between, each
+    corner limits the speed according to _junction, and speed changes are
+    limited by _accel. Machine overhead, e.g. for switching the laser, is not modelled.
+    """
+    if layers is None: layers = self._layers
+    times = []
+    for l in layers:
+      speed = copy.copy(l._speed)
+      if speed is None: raise ValueError("layer speed not initialized")
+      if type(speed) == float or type(speed) == int: speed = [1000, speed]
+      paths = [path for path in (l._paths or []) if len(path)]
+      if numpy is not None:
+        l._time = self.estimate_paths_numpy(paths, speed[0], speed[1], init)
+      else:
+        l._time = self.estimate_paths(paths, speed[0], speed[1], init)
+      times.append(l._time)
+    return { 'layers': times, 'total': sum(times) }
+
+  def motion_time(self, dist, w0, w1, vmax, accel):
+    """
+    Time to move dist mm, entering with speed sqrt(w0) and leaving with sqrt(w1),
+    not exceeding vmax, with a trapezoidal (or triangular) speed profile.
+    Speeds are passed squared. w0 and w1 must be reachable from each other.
+    """
+    wpeak = (2*accel*dist + w0 + w1) * 0.5
+    if wpeak <= vmax*vmax:
+      return (2*math.sqrt(wpeak) - math.sqrt(w0) - math.sqrt(w1)) / accel
+    ramps = (vmax*vmax - w0) / (2*accel) + (vmax*vmax - w1) / (2*accel)
+    return (2*vmax - math.sqrt(w0) - math.sqrt(w1)) / accel + (dist - ramps) / vmax
+
+  def junction_limit(self, ux0, uy0, ux1, uy1, vmax):
+    """
+    Squared speed limit at a corner between the unit directions (ux0, uy0) and (ux1, uy1).
+    """
+    cos_theta = -(ux0*ux1 + uy0*uy1)
+    sin_half = math.sqrt(max(0.5*(1.0-cos_theta), 0.0))
+    if sin_half > 0.999999: return vmax*vmax
+    return min(self._accel * self._junction * sin_half / (1.0-sin_half), vmax*vmax)
+
+  def estimate_paths(self, paths, travelspeed, laserspeed, init=[0,0]):
+    """
+    Run time of paths in seconds, as described in estimate().
+    A forward and a backward pass limit the squared speed at each point
+    to what can be reached from the previous and the next standstill.
+    """
+    a = self._accel
+    t = 0.0
+    xy = init
+    for path in paths:
+      t += self.motion_time(math.hypot(path[0][0]-xy[0], path[0][1]-xy[1]), 0.0, 0.0, travelspeed, a)
+      seg = []                  # (length, ux, uy) of each segment with a length
+      for k in range(1, len(path)):
+        dx = path[k][0] - path[k-1][0]
+        dy = path[k][1] - path[k-1][1]
+        d = math.hypot(dx, dy)
+        if d > 0: seg.append((d, dx/d, dy/d))
+      xy = path[-1]
+      if not seg: continue
+      n = len(seg)
+      w = [0.0] * (n+1)           # squared speed at the points between segments
+      for k in range(1, n):
+        w[k] = self.junction_limit(seg[k-1][1], seg[k-1][2], seg[k][1], seg[k][2], laserspeed)
+      for k in range(1, n+1):
+        w[k] = min(w[k], w[k-1] + 2*a*seg[k-1][0])
+      for k in range(n-1, -1, -1):
+        w[k] = min(w[k], w[k+1] + 2*a*seg[k][0])
+      for k in range(n):
+        t += self.motion_time(seg[k][0], w[k], w[k+1], laserspeed, a)
+    return t
+
+  def estimate_paths_numpy(self, paths, travelspeed, laserspeed, init=[0,0]):
+    """
+    Same as estimate_paths(), with numpy array operations.
+    The passes are recurrences w[k+1] = min(limit[k+1], w[k] + 2*a*dist[k]), these are
+    solved with prefix sums S of 2*a*dist as w[k] = S[k] + minimum.accumulate(limit - S)[k].
+    """
+    if not paths: return 0.0
+    a = self._accel
+    lens = numpy.array([len(path) for path in paths])
+    xy = numpy.array(list(itertools.chain.from_iterable(paths)), dtype=numpy.float64).reshape(-1, 2)
+    last = numpy.cumsum(lens) - 1
+    first = last - lens + 1
+
+    # travel moves, from the end of the previous path to the start of each path.
+    prev = numpy.vstack((numpy.array(init, dtype=numpy.float64).reshape(1, 2), xy[last[:-1]]))
+    dist = numpy.hypot(xy[first,0]-prev[:,0], xy[first,1]-prev[:,1])
+    t = self.motion_time_numpy(dist, 0.0, 0.0, travelspeed, a).sum()
+
+    # cut segments, without zero length segments and without the gaps between paths.
+    d = numpy.diff(xy, axis=0)
+    pathid = numpy.repeat(numpy.arange(len(lens)), lens)
+    dist = numpy.hypot(d[:,0], d[:,1])
+    keep = (pathid[1:] == pathid[:-1]) & (dist > 0)
+    d = d[keep]
+    dist = dist[keep]
+    pathid = pathid[1:][keep]
+    n = len(dist)
+    if n == 0: return float(t)
+    ux = d[:,0] / dist
+    uy = d[:,1] / dist
+
+    # squared speed limit at the n+1 points between segments. 0 where a path starts or ends.
+    limit = numpy.zeros(n+1)
+    cos_theta = -(ux[:-1]*ux[1:] + uy[:-1]*uy[1:])
+    sin_half = numpy.sqrt(numpy.maximum(0.5*(1.0-cos_theta), 0.0))
+    straight = sin_half > 0.999999
+    j = a * self._junction * sin_half / numpy.where(straight, 1.0, 1.0-sin_half)
+    j = numpy.where(straight, laserspeed*laserspeed, numpy.minimum(j, laserspeed*laserspeed))
+    limit[1:-1] = numpy.where(pathid[1:] == pathid[:-1], j, 0.0)
+
+    S = numpy.concatenate(([0.0], numpy.cumsum(2*a*dist)))
+    fwd = S + numpy.minimum.accumulate(limit - S)
+    bwd = numpy.minimum.accumulate((limit + S)[::-1])[::-1] - S
+    w = numpy.maximum(numpy.minimum(fwd, bwd), 0.0)
+    t += self.motion_time_numpy(dist, w[:-1], w[1:], laserspeed, a).sum()
+    return float(t)
+
+  def motion_time_numpy(self, dist, w0, w1, vmax, accel):
+    """
+    Same as motion_time(), for numpy arrays.
+    """
+    wpeak = (2*accel*dist + w0 + w1) * 0.5
+    tri = (2*numpy.sqrt(wpeak) - numpy.sqrt(w0) - numpy.sqrt(w1)) / accel
+    ramps = (vmax*vmax - w0) / (2*accel) + (vmax*vmax - w1) / (2*accel)
+    trap = (2*vmax - numpy.sqrt(w0) - numpy.sqrt(w1)) / accel + (dist - ramps) / vmax
+    return numpy.where(wpeak <= vmax*vmax, tri, trap)
+
   def paths2moves(self, paths=None):
     """
     Returns a list of one-element-lists, each point in any of the
@@ -1449,122 +2644,506 @@ class Ruida():
     Convert a set of paths (one set per layer) into lasercut instructions.
     Each layer has a prolog, that directly sets speed and powers.
 
+    The geometry is encoded by body_paths_numpy() if the numpy module is
+    available, otherwise by body_paths(). See also set(engine=...).
+
     Returns the binary instruction data.
     """
+    return b''.join(self.iter_body(layers))
 
-    def relok(last, point):
-      """
-      Determine, if we can emit a relative move or cut command.
-      An absolute move or cut costs 11 bytes,
-      a relative one costs 5 bytes.
-      """
-      maxrel = 8.191     # 8.191 encodes as 3f 7f. -8.191 encodes as 40 01
+  def iter_body(self, layers, chunksize=None):
+    """
+    Generator for the instruction data of body(). Without a chunksize, the
+    prolog and the geometry of each layer are yielded as one piece each.
+    With a chunksize, the geometry of a layer is yielded in pieces of about
+    chunksize bytes. Paths are not split, thus a single long path can
+    exceed chunksize. The output is the same in both cases.
+
+    In the same pass over the points, the bounding box and the odometer of
+    each layer are computed. When a layer is done, they are available as
+    its _paths_bbox and _odo attributes.
+
+    With a _cache, the geometry of unchanged layers is read back from the
+    cache, and the geometry of all other layers is stored there.
+    With _processes > 1, the geometry is encoded by iter_geometry_parallel().
+    """
+    engine = self.body_engine()
+    keys = [None] * len(layers)
+    if self._cache is not None: keys = [self._cache.key(self, l, chunksize) for l in layers]
+    hits = [self._cache.get(k) if k else None for k in keys]
+    todo = [layers[i] for i in range(len(layers)) if hits[i] is None]
+
+    if self._processes and self._processes > 1:
+      source = self.iter_geometry_parallel(todo, chunksize, engine)
+    else:
+      source = self.iter_geometry(todo, chunksize, engine)
+
+    try:
+      # for lnum in reversed(range(len(layers))):       # Can be permuted, lower lnum's are processed first. Always.
+      for lnum in range(len(layers)):
+        l = layers[lnum]
+        yield self.body_prolog(lnum, l)
 
-      if last is None: return False
-      dx = abs(point[0]-last[0])
-      dy = abs(point[1]-last[1])
-      return max(dx, dy) <= maxrel
+        if hits[lnum] is not None:
+          (l._paths_bbox, l._odo, chunks) = hits[lnum]
+          for data in chunks:
+            yield data
+          continue
+
+        store = self._cache.writer(keys[lnum]) if keys[lnum] else None
+        try:
+          for data in source:
+            if data is None: break      # end of layer l
+            if store: store.write(data)
+            yield data
+          if store: store.commit(l._paths_bbox, l._odo)
+        finally:
+          if store: store.close()
+    finally:
+      source.close()
+
+  def iter_geometry(self, layers, chunksize, engine):
+    """
+    Generator for the geometry of the layers, without prologs. None is yielded
+    at the end of each layer, after its _paths_bbox and _odo attributes are set.
+    """
+    for l in layers:
+      state = self.body_state()
+      for paths in self.path_batches(l._paths, chunksize):
+        yield self.body_batch(paths, state, engine)
+      l._paths_bbox = state['bbox']
+      l._odo = state['odo']
+      yield None
+
+  def iter_geometry_parallel(self, layers, chunksize, engine):
+    """
+    Same as iter_geometry(), but the paths of all layers are split into chunks
+    of about chunksize bytes (default 1MB), that are encoded by a pool of _processes
+    worker processes. The results are yielded in order.
+
+    A chunk continues from the last point of the previous chunk. With _quantize
+    (or _forceabs = 0) this is all the state the encoder needs, and the output
+    is identical to iter_geometry(). Otherwise, a chunk starts with an absolute
+    instruction, as if the _forceabs counter had just expired there.
+    The odometer of a layer is summed per chunk, it may differ from iter_geometry()
+    in the last digits.
+    """
+    if not chunksize: chunksize = 1<<20
+    config = { '_quantize': self._quantize, '_forceabs': self._forceabs, '_maxrel': self._maxrel }
 
-    data = bytes([])
-    # for lnum in reversed(range(len(layers))):         # Can be permuted, lower lnum's are processed first. Always.
+    tasks = []                  # (lnum, args) for each chunk, in order.
     for lnum in range(len(layers)):
-      l = layers[lnum]
+      last = None
+      for paths in self.path_batches(layers[lnum]._paths, chunksize):
+        state = self.body_state()
+        state['last'] = last
+        if last is not None and not self._quantize and self._forceabs > 0:
+          state['relcounter'] = self._forceabs          # start with an absolute instruction
+        tasks.append((lnum, (config, engine, paths, state)))
+        for path in paths:
+          if len(path): last = path[-1]
+
+    # At most maxpending chunks are submitted ahead of the consumer, so that
+    # encoded chunks do not pile up in memory when the output is slow.
+    maxpending = 2 * max(1, self._processes)
+    pool = multiprocessing.Pool(self._processes)
+    try:
+      pending = []              # outstanding results, in task order.
+      submitted = 0
+      k = 0
+      for lnum in range(len(layers)):
+        l = layers[lnum]
+        (bbox, odo) = (None, [0.0, 0.0])
+        while k < len(tasks) and tasks[k][0] == lnum:
+          while submitted < len(tasks) and len(pending) < maxpending:
+            pending.append(pool.apply_async(_body_chunk, (tasks[submitted][1],)))
+            submitted += 1
+          (geometry, state) = pending.pop(0).get()
+          bbox = self.bbox_combine(bbox, state['bbox'])
+          odo = [odo[0] + state['odo'][0], odo[1] + state['odo'][1]]
+          k += 1
+          yield geometry
+        l._paths_bbox = bbox
+        l._odo = odo
+        yield None
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def body_engine(self):
+    """
+    Returns the geometry encoder to use, 'python' or 'numpy', according to _engine.
+    """
+    engine = self._engine
+    if engine is None: engine = 'python' if numpy is None else 'numpy'
+    if engine not in ('python', 'numpy'): raise ValueError("unknown engine: "+str(engine))
+    if engine == 'numpy' and numpy is None: raise ValueError("engine 'numpy' requires the numpy module")
+    return engine
 
-      # CAUTION: keep in sync with header()
-      power = copy.copy(l._power)
-      if len(power) % 2: raise ValueError("Even number of elements needed in power[]")
-      while len(power) < 8: power += power[-2:]
+  def body_batch(self, paths, state, engine):
+    """
+    Encode a batch of paths with body_paths_numpy() or body_paths(),
+    falling back to body_paths(), if numpy cannot handle the coordinates.
+    """
+    geometry = None
+    if engine == 'numpy': geometry = self.body_paths_numpy(paths, state)
+    if geometry is None:  geometry = self.body_paths(paths, state)
+    return geometry
 
-      speed = copy.copy(l._speed)
-      if type(speed) == float or type(speed) == int: speed = [1000, speed]
-      travelspeed = speed[0]
-      laserspeed = speed[1]
+  def body_state(self):
+    """
+    Returns the initial state for encoding the paths of a layer with
+    body_paths() or body_paths_numpy(). The encoders update it in place:
+      'last':       the last point encoded, None at the start.
+      'relcounter': relative instructions since the last absolute one.
+      'bbox':       boundingbox() of the points encoded so far, or None.
+      'odo':        odometer() of the points encoded so far.
+    """
+    return { 'last': None, 'relcounter': 0, 'bbox': None, 'odo': [0.0, 0.0] }
 
-      ################## Body Prolog Start #######################
-      data += self.enc('-b-', ["""
-          ca 01 00                                        # Flags_CA_01 00
-          ca 02""", lnum, """                             # CA 02 Layer:0 priority?
-          ca 01 30                                        # Flags_CA_01 30
-          ca 01 10                                        # Flags_CA_01 10
-          ca 01 13                                        # Blow_on
-          """])
-
-      ##   '-p-p-p-p-'
-      #    c6 12 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
-      #    c6 13 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
-      #    c6 50 """, 100, """             # Cut_through_power1 100%
-      #    c6 51 """, 100, """             # Cut_through_power2 100%
-      #    c6 55 """, 100, """             # Cut_through_power3 100%
-      #    c6 56 """, 100, """             # Cut_through_power4 100%
-      ## if the Cut_through_powers are not present, then c6 15 and c6 16 instead.
-
-      data += self.enc('-n-p-p-p-p-p-p-p-p-', ["""
-          c9 02 """, laserspeed, """      # Speed_C9 30.0mm/s
-          c6 15 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
-          c6 16 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
-          c6 01 """, power[0], """        # Laser_1_Min_Pow_C6_01 0%
-          c6 02 """, power[1], """        # Laser_1_Max_Pow_C6_02 0%
-          c6 21 """, power[2], """        # Laser_2_Min_Pow_C6_21 0%
-          c6 22 """, power[3], """        # Laser_2_Max_Pow_C6_22 0%
-          c6 05 """, power[4], """        # Laser_3_Min_Pow_C6_05 1%
-          c6 06 """, power[5], """        # Laser_3_Max_Pow_C6_06 0%
-          c6 07 """, power[6], """        # Laser_4_Min_Pow_C6_07 0%
-          c6 08 """, power[7], """        # Laser_4_Max_Pow_C6_08 0%
-          ca 03 01                        # Layer_CA_03 01
-          ca 10 00                        # CA 10 00
-          """])
-      ################## Body Prolog End #######################
-
-      relcounter = 0
-      lp = None
-      for path in l._paths:
-        travel = True
-        for p in path:
-          if relok(lp, p) and (self._forceabs == 0 or relcounter < self._forceabs):
+  def path_batches(self, paths, chunksize=None):
+    """
+    Generator splitting paths into lists of consecutive paths, with
+    about chunksize bytes of instruction data each. This is estimated
+    as 11 bytes per point, the size of an absolute move or cut.
+    Without a chunksize, paths is returned as one batch.
+    """
+    if not chunksize:
+      yield paths
+      return
+    batch = []
+    npoints = 0
+    for path in paths:
+      batch.append(path)
+      npoints += len(path)
+      if npoints * 11 >= chunksize:
+        yield batch
+        batch = []
+        npoints = 0
+    if batch: yield batch
+
+  def body_prolog(self, lnum, l):
+    """
+    Returns the instructions starting layer number lnum. These set speed
+    and power for the RuidaLayer l.
+    """
+    # CAUTION: keep in sync with header()
+    power = copy.copy(l._power)
+    if len(power) % 2: raise ValueError("Even number of elements needed in power[]")
+    while len(power) < 8: power += power[-2:]
+
+    speed = copy.copy(l._speed)
+    if type(speed) == float or type(speed) == int: speed = [1000, speed]
+    travelspeed = speed[0]
+    laserspeed = speed[1]
+
+    ################## Body Prolog Start #######################
+    data = RuidaBuffer()
+    data += self.enc('-b-', ["""
+        ca 01 00                                        # Flags_CA_01 00
+        ca 02""", lnum, """                             # CA 02 Layer:0 priority?
+        ca 01 30                                        # Flags_CA_01 30
+        ca 01 10                                        # Flags_CA_01 10
+        ca 01 13                                        # Blow_on
+        """])
 
-            if self._forceabs > 0: relcounter += 1
+    ##   '-p-p-p-p-'
+    #    c6 12 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
+    #    c6 13 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
+    #    c6 50 """, 100, """             # Cut_through_power1 100%
+    #    c6 51 """, 100, """             # Cut_through_power2 100%
+    #    c6 55 """, 100, """             # Cut_through_power3 100%
+    #    c6 56 """, 100, """             # Cut_through_power4 100%
+    ## if the Cut_through_powers are not present, then c6 15 and c6 16 instead.
+
+    data += self.enc('-n-p-p-p-p-p-p-p-p-', ["""
+        c9 02 """, laserspeed, """      # Speed_C9 30.0mm/s
+        c6 15 00 00 00 00 00            # Cut_Open_delay_12 0.0 ms
+        c6 16 00 00 00 00 00            # Cut_Close_delay_13 0.0 ms
+        c6 01 """, power[0], """        # Laser_1_Min_Pow_C6_01 0%
+        c6 02 """, power[1], """        # Laser_1_Max_Pow_C6_02 0%
+        c6 21 """, power[2], """        # Laser_2_Min_Pow_C6_21 0%
+        c6 22 """, power[3], """        # Laser_2_Max_Pow_C6_22 0%
+        c6 05 """, power[4], """        # Laser_3_Min_Pow_C6_05 1%
+        c6 06 """, power[5], """        # Laser_3_Max_Pow_C6_06 0%
+        c6 07 """, power[6], """        # Laser_4_Min_Pow_C6_07 0%
+        c6 08 """, power[7], """        # Laser_4_Max_Pow_C6_08 0%
+        ca 03 01                        # Layer_CA_03 01
+        ca 10 00                        # CA 10 00
+        """])
+    ################## Body Prolog End #######################
 
-            if p[1] == lp[1]:     # horizontal rel
-              if travel:
-                data += self.enc('-r', ['8a', p[0]-lp[0]])   # Move_Horiz 6.213mm
-              else:
-                data += self.enc('-r', ['aa', p[0]-lp[0]])   # Cut_Horiz -6.008mm
-            elif p[0] == lp[0]:   # vertical rel
-              if travel:
-                data += self.enc('-r', ['8b', p[1]-lp[1]])   # Move_Vert 17.1mm
-              else:
-                data += self.enc('-r', ['ab', p[1]-lp[1]])   # Cut_Vert 2.987mm
-            else:                 # other rel
-              if travel:
-                data += self.enc('-rr', ['89', p[0]-lp[0], p[1]-lp[1]])   # Move_To_Rel 3.091mm 0.025mm
-              else:
-                data += self.enc('-rr', ['a9', p[0]-lp[0], p[1]-lp[1]])   # Cut_Rel 0.015mm -1.127mm
+    return data.getvalue()
 
-          else:
+  def relok(self, last, point):
+    """
+    Determine, if we can emit a relative move or cut command.
+    An absolute move or cut costs 11 bytes,
+    a relative one costs 5 bytes.
+    """
+    if last is None: return False
+    dx = abs(point[0]-last[0])
+    dy = abs(point[1]-last[1])
+    return max(dx, dy) <= self._maxrel
+
+  def body_paths(self, paths, state=None):
+    """
+    Convert the paths of one layer into move and cut instructions.
+    The first point of each path is reached with a move, all other points with cuts.
+    With _quantize, all points are truncated to micrometers and relative
+    instructions are used for all differences in the range of
+    encode_relcoord_um(). Otherwise, relative instructions are used where
+    relok() permits, but at least every _forceabs points an absolute
+    instruction is emitted.
+
+    state is an optional dict as returned by body_state(), that is updated
+    in place. Passing the same state to consecutive calls encodes the paths of
+    a layer in pieces, with the same output as one call for all paths.
+    The bounding box and odometer are computed on the way, see body_state().
 
+    Returns the binary instruction data.
+    """
+    if state is None: state = self.body_state()
+    # Opcodes and encoders used per vertex are looked up once, not per point.
+    op_move_abs   = self.encode_hex('88')
+    op_move_rel   = self.encode_hex('89')
+    op_move_horiz = self.encode_hex('8a')
+    op_move_vert  = self.encode_hex('8b')
+    op_cut_abs    = self.encode_hex('a8')
+    op_cut_rel    = self.encode_hex('a9')
+    op_cut_horiz  = self.encode_hex('aa')
+    op_cut_vert   = self.encode_hex('ab')
+    encode_number   = self.encode_number
+    encode_relcoord_um = self.encode_relcoord_um
+    relok           = self.relok
+    quantize        = self._quantize
+
+    sqrt = math.sqrt
+    data = RuidaBuffer()
+    lp = state['last']
+    lq = None if lp is None else [int(lp[0]*1000), int(lp[1]*1000)]
+    relcounter = state['relcounter']
+    (cut_d, trav_d) = state['odo']
+    xmin = ymin = float('inf')
+    xmax = ymax = float('-inf')
+    for path in paths:
+      travel = True
+      for p in path:
+        if p[0] < xmin: xmin = p[0]
+        if p[0] > xmax: xmax = p[0]
+        if p[1] < ymin: ymin = p[1]
+        if p[1] > ymax: ymax = p[1]
+        if lp is None:
+          d = sqrt(p[0]*p[0] + p[1]*p[1])     # odometer() starts at [0,0]
+        else:
+          dx = p[0]-lp[0]
+          dy = p[1]-lp[1]
+          d = sqrt(dx*dx + dy*dy)
+        if travel: trav_d += d
+        else:      cut_d  += d
+
+        # rel, horiz, vert classify the instruction. ux, uy are relative micrometers.
+        if quantize:
+          q = [int(p[0]*1000), int(p[1]*1000)]       # same truncation as encode_number()
+          rel = False
+          if lq is not None:
+            ux = q[0]-lq[0]
+            uy = q[1]-lq[1]
+            rel = -8191 <= ux <= 8191 and -8191 <= uy <= 8191
+            horiz = uy == 0
+            vert  = ux == 0
+          lq = q
+        else:
+          rel = relok(lp, p) and (self._forceabs == 0 or relcounter < self._forceabs)
+          if rel:
+            if self._forceabs > 0: relcounter += 1
+            ux = int((p[0]-lp[0])*1000)
+            uy = int((p[1]-lp[1])*1000)
+            horiz = p[1] == lp[1]
+            vert  = p[0] == lp[0]
+          else:
             relcounter = 0
 
+        if rel:
+          if horiz:
+            if travel:
+              data += op_move_horiz + encode_relcoord_um(ux)   # Move_Horiz 6.213mm
+            else:
+              data += op_cut_horiz  + encode_relcoord_um(ux)   # Cut_Horiz -6.008mm
+          elif vert:
+            if travel:
+              data += op_move_vert  + encode_relcoord_um(uy)   # Move_Vert 17.1mm
+            else:
+              data += op_cut_vert   + encode_relcoord_um(uy)   # Cut_Vert 2.987mm
+          else:
             if travel:
-              data += self.enc('-nn', ['88', p[0], p[1]])               # Move_To_Abs 0.0mm 0.0mm
+              data += op_move_rel + encode_relcoord_um(ux) + encode_relcoord_um(uy)  # Move_To_Rel 3.091mm 0.025mm
             else:
-              data += self.enc('-nn', ['a8', p[0], p[1]])               # Cut_Abs_a8 17.415mm 7.521mm
+              data += op_cut_rel  + encode_relcoord_um(ux) + encode_relcoord_um(uy)  # Cut_Rel 0.015mm -1.127mm
+        else:
+          if travel:
+            data += op_move_abs + encode_number(p[0]) + encode_number(p[1])    # Move_To_Abs 0.0mm 0.0mm
+          else:
+            data += op_cut_abs  + encode_number(p[0]) + encode_number(p[1])    # Cut_Abs_a8 17.415mm 7.521mm
+
+        lp = p
+        travel = False
+    state['last'] = lp
+    state['relcounter'] = relcounter
+    state['odo'] = [cut_d, trav_d]
+    if xmin <= xmax:
+      state['bbox'] = self.bbox_combine(state['bbox'], [[xmin, ymin], [xmax, ymax]])
+    return data.getvalue()
+
+  def body_paths_numpy(self, paths, state=None):
+    """
+    Same as body_paths(), but all points of the layer are classified and
+    encoded at once with numpy array operations. The output is identical.
 
-          lp = p
-          travel = False
-    return data
+    Returns None, if a coordinate cannot be handled here (not finite, or
+    too large for a 5 byte number). The caller falls back to body_paths() then,
+    state is only updated on success.
+    """
+    if state is None: state = self.body_state()
+    lp = state['last']
+    relcounter = state['relcounter']
+    nonempty = [path for path in paths if len(path)]
+    if not nonempty: return b''
+    lens = numpy.array([len(path) for path in nonempty])
+    xy = numpy.array(list(itertools.chain.from_iterable(nonempty)), dtype=numpy.float64).reshape(-1, 2)
+    if not numpy.isfinite(xy).all(): return None
+    if (xy >= (1<<35)*0.001).any(): return None         # encode_number() would need more than 5 bytes.
+    n = len(xy)
+    x = xy[:,0]
+    y = xy[:,1]
+
+    travel = numpy.zeros(n, dtype=bool)
+    travel[numpy.cumsum(lens)[:-1]] = True
+    travel[0] = True
+
+    dx = numpy.zeros(n)
+    dy = numpy.zeros(n)
+    dx[1:] = x[1:] - x[:-1]
+    dy[1:] = y[1:] - y[:-1]
+    if lp is not None:
+      dx[0] = x[0] - lp[0]
+      dy[0] = y[0] - lp[1]
+    else:
+      dx[0] = x[0]      # odometer() starts at [0,0]
+      dy[0] = y[0]
+
+    # odometer(): cumsum() adds in sequence, exactly like the loop there.
+    dist = numpy.sqrt(dx*dx + dy*dy)
+    (cut_d, trav_d) = state['odo']
+    cut_d  = float(numpy.cumsum(numpy.concatenate(([cut_d],  dist[~travel])))[-1])
+    trav_d = float(numpy.cumsum(numpy.concatenate(([trav_d], dist[travel])))[-1])
+
+    if self._quantize:
+      # Differences of coordinates truncated to micrometers are exact.
+      qx = numpy.trunc(x * 1000).astype(numpy.int64)
+      qy = numpy.trunc(y * 1000).astype(numpy.int64)
+      ux = numpy.zeros(n, dtype=numpy.int64)
+      uy = numpy.zeros(n, dtype=numpy.int64)
+      ux[1:] = qx[1:] - qx[:-1]
+      uy[1:] = qy[1:] - qy[:-1]
+      if lp is not None:
+        ux[0] = qx[0] - int(lp[0]*1000)
+        uy[0] = qy[0] - int(lp[1]*1000)
+      rel = numpy.maximum(numpy.abs(ux), numpy.abs(uy)) <= 8191
+      if lp is None: rel[0] = False
+      horiz = rel & (uy == 0)
+      vert  = rel & ~horiz & (ux == 0)
+    else:
+      # relok() for all points, then the _forceabs counter: within a run of
+      # relative points, every (_forceabs+1)th point becomes absolute.
+      # A run continued from the previous call has relcounter points already.
+      rel = numpy.maximum(numpy.abs(dx), numpy.abs(dy)) <= self._maxrel
+      if lp is None: rel[0] = False
+      if self._forceabs > 0:
+        idx = numpy.arange(n)
+        lastabs = numpy.maximum.accumulate(numpy.where(rel, -1-relcounter, idx))
+        runpos = (idx - lastabs) % (self._forceabs + 1)
+        rel &= runpos != 0
+        relcounter = int(runpos[-1]) if rel[-1] else 0
+      ux = numpy.trunc(dx * 1000).astype(numpy.int64)
+      uy = numpy.trunc(dy * 1000).astype(numpy.int64)
+      horiz = rel & (dy == 0)
+      vert  = rel & ~horiz & (dx == 0)
+    diag  = rel & ~horiz & ~vert
+    absol = ~rel
+
+    op = numpy.where(absol, 0x88, numpy.where(diag, 0x89, numpy.where(horiz, 0x8a, 0x8b)))
+    op = op + numpy.where(travel, 0, 0x20)              # cut opcodes are a8 .. ab
+    size = numpy.where(absol, 11, numpy.where(diag, 5, 3))
+    off = numpy.zeros(n, dtype=numpy.int64)
+    off[1:] = numpy.cumsum(size)[:-1]
+
+    out = numpy.zeros(int(off[-1] + size[-1]), dtype=numpy.uint8)
+    out[off] = op
+
+    def number7(v, length):
+      """ 7-bit groups of encode_number(), most significant first. """
+      return [(v >> (7*(length-1-k))) & 0x7f for k in range(length)]
+
+    def relcoord(nn):
+      """ encode_relcoord_um() as 14 bit 2s complement. None if out of range. """
+      if len(nn) and (numpy.abs(nn) > 8191).any(): return None
+      return numpy.where(nn < 0, nn + 16384, nn)
+
+    o = off[absol]
+    ax = numpy.maximum(numpy.trunc(x[absol] * 1000).astype(numpy.int64), 0)    # negative numbers encode as 0
+    ay = numpy.maximum(numpy.trunc(y[absol] * 1000).astype(numpy.int64), 0)
+    for k, (gx, gy) in enumerate(zip(number7(ax, 5), number7(ay, 5))):
+      out[o+1+k] = gx
+      out[o+6+k] = gy
+
+    rx = relcoord(ux[diag])
+    ry = relcoord(uy[diag])
+    rh = relcoord(ux[horiz])
+    rv = relcoord(uy[vert])
+    if rx is None or ry is None or rh is None or rv is None: return None
+    for o, r, k in ((off[diag], rx, 1), (off[diag], ry, 3), (off[horiz], rh, 1), (off[vert], rv, 1)):
+      g = number7(r, 2)
+      out[o+k]   = g[0]
+      out[o+k+1] = g[1]
+
+    state['last'] = nonempty[-1][-1]
+    state['relcounter'] = relcounter
+    state['odo'] = [cut_d, trav_d]
+    bbox = [[float(x.min()), float(y.min())], [float(x.max()), float(y.max())]]
+    state['bbox'] = self.bbox_combine(state['bbox'], bbox)
+    return out.tobytes()
 
 
   def scramble_bytes(self, data):
-    if sys.version_info.major < 3:
-      return bytes([self.scramble(ord(b)) for b in data])
-    else:
-      return bytes([self.scramble(b) for b in data])
+    """
+    Scramble all bytes for writing into *.rd files.
+    A bytearray() is scrambled in place and returned, other data is copied.
+    """
+    if Ruida._scramble_table is None:
+      Ruida._scramble_table = bytes([self.scramble(b) for b in range(256)])
+    return self.translate_bytes(data, Ruida._scramble_table)
 
   def unscramble_bytes(self, data):
-    if sys.version_info.major < 3:
-      return bytes([self.unscramble(ord(b)) for b in data])
-    else:
-      return bytes([self.unscramble(b) for b in data])
+    """
+    Unscramble all bytes read from *.rd files.
+    A bytearray() is unscrambled in place and returned, other data is copied.
+    """
+    if Ruida._unscramble_table is None:
+      Ruida._unscramble_table = bytes([self.unscramble(b) for b in range(256)])
+    return self.translate_bytes(data, Ruida._unscramble_table)
+
+  def translate_bytes(self, data, table, chunksize=1<<20):
+    """
+    Map each byte of data through the 256 byte translation table.
+    A bytearray() is modified in place, one chunk at a time, so that
+    at most chunksize bytes are copied at once.
+    """
+    if isinstance(data, bytearray):
+      for i in range(0, len(data), chunksize):
+        data[i:i+chunksize] = data[i:i+chunksize].translate(table)
+      return data
+    return data.translate(table)
 
   def unscramble(self, b):
     """ unscramble a single byte for reading from *.rd files """
@@ -1614,7 +3193,8 @@ class Ruida():
     (xmin, ymin) = bbox[0]
     (xmax, ymax) = bbox[1]
 
-    data = self.encode_hex("""
+    data = RuidaBuffer()
+    data += self.encode_hex("""
         d8 12           # Red Light on ?
         f0 f1 02 00     # file type ?
         d8 00           # Green Light off ?
@@ -1687,7 +3267,7 @@ class Ruida():
         e7 24 00                                        # E7 24 00
         e7 08 00 01 00 01 """, xmax, ymax, """          # Bottom_Right_E7_08 00 01 00 01 17.414mm 24.868mm
         """])
-    return data
+    return data.getvalue()
 
 
   def trailer(self, odo=[0.0, 0.0]):
@@ -1700,11 +3280,12 @@ class Ruida():
 
     Returns the binary instruction data.
     """
-    data = self.enc("-nn-", ["""
+    data = RuidaBuffer()
+    data += self.enc("-nn-", ["""
         eb e7 00
         da 01 06 20""", odo[0]*0.001, odo[0]*0.001, """
         d7 """])
-    return data
+    return data.getvalue()
 
 
   def encode_number(self, num, length=5, scale=1000):
@@ -1745,16 +3326,34 @@ class Ruida():
     """
     if len(fmt) != len(tupl): raise ValueError("format '"+fmt+"' length differs from len(tupl)="+str(len(tupl)))
 
-    ret = b''
-    for i in range(len(fmt)):
-      if   fmt[i] == '-': ret += self.encode_hex(tupl[i])
-      elif fmt[i] == 'n': ret += self.encode_number(tupl[i])
-      elif fmt[i] == 'p': ret += self.encode_percent(tupl[i])
-      elif fmt[i] == 'r': ret += self.encode_relcoord(tupl[i])
-      elif fmt[i] == 'b': ret += self.encode_byte(tupl[i])
-      elif fmt[i] == 'c': ret += self.encode_color(tupl[i])
-      else: raise ValueError("unknown character in fmt: "+fmt)
-    return ret
+    ret = RuidaBuffer()
+    for encoder, arg in zip(self.enc_compile(fmt), tupl):
+      ret += encoder(self, arg)
+    return ret.getvalue()
+
+  def enc_compile(self, fmt):
+    """
+    Translate a format string as used by enc() into a tuple of encoding methods.
+    The result is cached, so that each format string is parsed only once.
+    """
+    try:
+      return self._fmt_cache[fmt]
+    except KeyError:
+      pass
+    encoders = {
+      '-': Ruida.encode_hex,
+      'n': Ruida.encode_number,
+      'p': Ruida.encode_percent,
+      'r': Ruida.encode_relcoord,
+      'b': Ruida.encode_byte,
+      'c': Ruida.encode_color }
+    compiled = []
+    for c in fmt:
+      if c not in encoders: raise ValueError("unknown character in fmt: "+fmt)
+      compiled.append(encoders[c])
+    compiled = tuple(compiled)
+    self._fmt_cache[fmt] = compiled
+    return compiled
 
   def decode_number(self, x):
     "used with a bytes() array of length 5"
@@ -1776,6 +3375,15 @@ class Ruida():
     if nn < 0: nn += 16384
     return self.encode_number(nn, length=2, scale=1)
 
+  def encode_relcoord_um(self, nn):
+    """
+    Same as encode_relcoord(), but nn is an integer number of micrometers.
+    """
+    if nn > 8191 or nn < -8191:
+      raise ValueError("relcoord "+str(nn)+" um is out of range. Use abscoords!")
+    if nn < 0: nn += 16384
+    return self.encode_number(nn, length=2, scale=1)
+
   def decode_relcoord(self, x):
     """
     using the first two elements of array x
@@ -1804,13 +3412,626 @@ class Ruida():
     Assemble a string from hexadecimal digits. Binary safe.
     Example: "48 65 6c 6c f8  # with a smorrebrod o\n    21" -> b'Hell\xf7!'
     """
+    try:
+      return self._hex_cache[str]
+    except KeyError:
+      pass
+    key = str
     str = re.sub('#.*$','', str, flags=re.MULTILINE)    # weed out comments.
     l = map(lambda x: int(x, base=16), str.split())     # locale.atoi() is to be avoided!
-    return bytes(l)
+    data = bytes(l)
+    if len(self._hex_cache) < self._hex_cache_max: self._hex_cache[key] = data
+    return data
+
+
+def _body_chunk(args):
+  """
+  Worker for Ruida.iter_geometry_parallel(). Module level, so that it can be pickled.
+  Returns the encoded chunk and the updated state.
+  """
+  (config, engine, paths, state) = args
+  rd = Ruida()
+  for key in config: setattr(rd, key, config[key])
+  geometry = rd.body_batch(paths, state, engine)
+  return (geometry, state)
+#! /usr/bin/python3
+#
+# pathopt.py -- dedup, join, simplify and reorder the paths of a laser job to reduce machine time.
+#
+# The code is fully compatible with python 2.7 and 3.5
+#
+# Paths are lists of [x, y] points in mm, as passed to Ruida.set(paths=...).
+# Ordering never changes the geometry. The 2-opt refinement may reverse
+# the direction of a path, all other methods keep paths as they are.
+#
+# Methods:
+#  'none'     -- document order
+#  'nn'       -- nearest neighbour, using a k-d tree of the start points.
+#  '2opt'     -- nearest neighbour, then 2-opt refinement within a time budget.
+#  'hilbert'  -- sort by position of the start point along a hilbert curve.
+#                O(n log n), for very large jobs.
+#
+# With entry=True, closed paths may also start at any of their vertices, and open paths
+# may be cut in reverse. 'nn' then searches all these entry points. The other methods
+# rotate or reverse each path afterwards, to start nearest to the end of the previous path.
+#
+# Use Ruida.odometer() to measure the travel distance before and after.
+#
+# dedup() removes segments that are cut twice, e.g. shared edges of adjacent tiles. Segments
+# are indexed by the straight line they lie on, and overlaps are subtracted as intervals.
+#
+# join() chains open paths that end where another one starts, using a grid hash of their
+# end points. Each join saves a travel move and a laser on/off.
+#
+# simplify() drops vertices with the Ramer-Douglas-Peucker algorithm. No point of the
+# original path is farther than the tolerance from the simplified path.
+#
+# 2026-10-17
+#     v1.0 -- initial draft: nearest neighbour, 2-opt and hilbert ordering.
+#     v1.1 -- entry point selection: rotate closed paths, reverse open paths.
+#     v1.2 -- added simplify(), iterative RDP decimation.
+#     v1.3 -- added join().
+#     v1.4 -- added dedup().
+
+import math, time, bisect
+
+try:
+  from math import gcd
+except ImportError:     # python2
+  from fractions import gcd
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+class PathOpt():
+  """
+  Travel minimizing ordering of paths.
+  Example:
+    po = PathOpt(method='2opt')
+    paths = po.order(paths)
+  """
+  __version__ = "1.4"
+
+  methods = ('none', 'nn', '2opt', 'hilbert')
+
+  def __init__(self, method='nn', init=[0,0], timeout=2.0, window=64, entry=False):
+    self._method = method
+    self._entry = entry         # allow rotation of closed paths and reversal of open paths.
+    self._init = init           # start position of the laser head.
+    self._timeout = timeout     # time budget for 2-opt in seconds.
+    self._window = window       # 2-opt looks at most this many paths ahead.
+    if method not in self.methods:
+      raise ValueError("unknown path ordering method: "+str(method))
+
+  def order(self, paths, method=None, init=None, entry=None):
+    """
+    Returns a new list with the same paths in travel optimized order.
+    Empty paths are moved to the end.
+    """
+    if method is None: method = self._method
+    if init is None: init = self._init
+    if entry is None: entry = self._entry
+    todo = [p for p in paths if len(p)]
+    empty = [p for p in paths if not len(p)]
+    if not todo:
+      return empty
+    if method == 'nn':
+      todo = self.nearest(todo, init, entry)
+    elif method == '2opt':
+      todo = self.two_opt(self.nearest(todo, init, entry), init)
+    elif method == 'hilbert':
+      todo = self.hilbert(todo)
+    elif method != 'none':
+      raise ValueError("unknown path ordering method: "+str(method))
+    if entry and method != 'nn':
+      todo = self.entry_points(todo, init)
+    return todo + empty
+
+  def closed(self, path, eps=1e-6):
+    """
+    True, if the path ends where it starts.
+    """
+    return len(path) > 2 and abs(path[0][0]-path[-1][0]) < eps and abs(path[0][1]-path[-1][1]) < eps
+
+  def rotate(self, path, k):
+    """
+    Returns a closed path, that starts and ends at vertex k. Same geometry and direction.
+    """
+    if k == 0: return path
+    return path[k:] + path[1:k+1]
+
+  def entry_points(self, paths, init=None):
+    """
+    Keeps the order of paths, but starts each path nearest to the end of the previous one.
+    Closed paths are rotated to their nearest vertex, open paths are reversed if their end is nearer.
+    """
+    if init is None: init = self._init
+    xy = init
+    result = []
+    for path in paths:
+      if self.closed(path):
+        d = [(p[0]-xy[0])*(p[0]-xy[0]) + (p[1]-xy[1])*(p[1]-xy[1]) for p in path[:-1]]
+        path = self.rotate(path, d.index(min(d)))
+      else:
+        d0 = (path[0][0]-xy[0])*(path[0][0]-xy[0]) + (path[0][1]-xy[1])*(path[0][1]-xy[1])
+        d1 = (path[-1][0]-xy[0])*(path[-1][0]-xy[0]) + (path[-1][1]-xy[1])*(path[-1][1]-xy[1])
+        if d1 < d0: path = path[::-1]
+      result.append(path)
+      xy = path[-1]
+    return result
+
+  def kdtree(self, pts, leafsize=8):
+    """
+    Build a static k-d tree over a list of [x, y] points, splitting x and y alternately.
+    Each node is a list [bbox, lo, hi, left, right, parent], where bbox = [x0, y0, x1, y1]
+    encloses the points perm[lo:hi]. Leaves have left = right = None.
+    Returns (nodes, perm, leaf_of_point)
+    """
+    n = len(pts)
+    perm = list(range(n))
+    coord = ([p[0] for p in pts], [p[1] for p in pts])
+    nodes = []
+    leaf = [None] * n
+    stack = [(0, n, None, 3, 0)]
+    while stack:
+      (lo, hi, parent, side, axis) = stack.pop()
+      k = len(nodes)
+      nodes.append([None, lo, hi, None, None, parent])
+      if parent is not None: nodes[parent][side] = k
+      if hi-lo <= leafsize:
+        for i in perm[lo:hi]: leaf[i] = k
+        self.kdtree_bbox(nodes, k, pts, perm, None)
+        continue
+      perm[lo:hi] = sorted(perm[lo:hi], key=coord[axis].__getitem__)
+      mid = (lo+hi) >> 1
+      stack.append((mid, hi, k, 4, 1-axis))
+      stack.append((lo, mid, k, 3, 1-axis))
+    # fill in the bounding boxes bottom up. Children always have higher node numbers.
+    for k in range(len(nodes)-1, -1, -1):
+      if nodes[k][3] is not None:
+        self.kdtree_bbox(nodes, k, pts, perm, None)
+    return (nodes, perm, leaf)
+
+  def kdtree_bbox(self, nodes, k, pts, perm, alive):
+    """
+    Recompute the bounding box of node k from its alive points (leaf) or its children.
+    An empty node gets bbox None. Returns True if the bbox changed.
+    """
+    node = nodes[k]
+    if node[3] is None:
+      live = [pts[i] for i in perm[node[1]:node[2]] if alive is None or alive[i]]
+      if live:
+        bbox = [min(p[0] for p in live), min(p[1] for p in live), max(p[0] for p in live), max(p[1] for p in live)]
+      else:
+        bbox = None
+    else:
+      (l, r) = (nodes[node[3]][0], nodes[node[4]][0])
+      if l is None:
+        bbox = r
+      elif r is None:
+        bbox = l
+      else:
+        bbox = [min(l[0], r[0]), min(l[1], r[1]), max(l[2], r[2]), max(l[3], r[3])]
+    if bbox == node[0]: return False
+    node[0] = bbox
+    return True
+
+  def nearest(self, paths, init=None, entry=False):
+    """
+    Greedy nearest neighbour ordering. From the end of each path, continue with the
+    path whose start point is closest. Ties are resolved in document order.
+    With entry=True, every vertex of a closed path and both ends of an open path are
+    candidates, the chosen path is rotated or reversed accordingly.
+    The candidates are kept in a k-d tree. The bounding boxes of the tree shrink
+    to the remaining points, so that used up subtrees are pruned early.
+    """
+    if init is None: init = self._init
+    n = len(paths)
+    pts = []            # candidate entry points
+    owner = []          # path index of each candidate
+    entry_at = []       # vertex index of each candidate, -1 for the reversed end of an open path.
+    first = []          # index of the first candidate of each path
+    for j in range(n):
+      first.append(len(pts))
+      path = paths[j]
+      if not entry:
+        vertices = [0]
+      elif self.closed(path):
+        vertices = range(len(path)-1)
+      elif len(path) > 1:
+        vertices = [0, -1]
+      else:
+        vertices = [0]
+      for v in vertices:
+        pts.append(path[v])
+        owner.append(j)
+        entry_at.append(v)
+    first.append(len(pts))
+    (nodes, perm, leaf) = self.kdtree(pts)
+    alive = [True] * len(pts)
+    xy = init
+    result = []
+    for count in range(n):
+      (qx, qy) = (xy[0], xy[1])
+      (best_d, best_i) = (None, None)
+      stack = [(0, 0)]                  # (squared distance to the bounding box, node index)
+      while stack:
+        (dn, k) = stack.pop()
+        if best_d is not None and dn > best_d: continue
+        node = nodes[k]
+        if node[3] is None:
+          for i in perm[node[1]:node[2]]:
+            if not alive[i]: continue
+            d = (pts[i][0]-qx)*(pts[i][0]-qx) + (pts[i][1]-qy)*(pts[i][1]-qy)
+            if best_d is None or d < best_d or (d == best_d and i < best_i):
+              (best_d, best_i) = (d, i)
+          continue
+        near = []
+        for c in (node[3], node[4]):
+          b = nodes[c][0]
+          if b is None: continue
+          dx = b[0]-qx if qx < b[0] else (qx-b[2] if qx > b[2] else 0)
+          dy = b[1]-qy if qy < b[1] else (qy-b[3] if qy > b[3] else 0)
+          d = dx*dx+dy*dy
+          if best_d is None or d <= best_d: near.append((d, c))
+        if len(near) == 2 and near[0][0] < near[1][0]:
+          near.reverse()                # visit the nearer child first.
+        stack.extend(near)
+      j = owner[best_i]
+      for c in range(first[j], first[j+1]):
+        alive[c] = False
+      for k in set(leaf[c] for c in range(first[j], first[j+1])):
+        while k is not None and self.kdtree_bbox(nodes, k, pts, perm, alive):
+          k = nodes[k][5]
+      path = paths[j]
+      if entry_at[best_i] == -1:
+        path = path[::-1]
+      elif entry_at[best_i]:
+        path = self.rotate(path, entry_at[best_i])
+      result.append(path)
+      xy = path[-1]
+    return result
+
+  def two_opt(self, paths, init=None, timeout=None, window=None):
+    """
+    Improve an ordering by reversing sub-sequences, as long as the travel distance decreases.
+    A reversed sub-sequence also reverses each path in it, so that only the two
+    connecting travel moves change. Candidates are limited to window paths ahead.
+    Stops after timeout seconds, the result is always valid.
+    """
+    if init is None: init = self._init
+    if timeout is None: timeout = self._timeout
+    if window is None: window = self._window
+    deadline = time.time() + timeout
+    n = len(paths)
+    seq = list(range(n))
+    flip = [False] * n
+    sx = [p[0][0] for p in paths]
+    sy = [p[0][1] for p in paths]
+    ex = [p[-1][0] for p in paths]
+    ey = [p[-1][1] for p in paths]
+
+    def dist(x1, y1, x2, y2):
+      return math.sqrt((x2-x1)*(x2-x1) + (y2-y1)*(y2-y1))
+
+    improved = True
+    while improved and time.time() < deadline:
+      improved = False
+      for i in range(n):
+        if time.time() > deadline: break
+        if i == 0:
+          (px, py) = (init[0], init[1])
+        else:
+          (px, py) = (ex[i-1], ey[i-1])
+        d_in = dist(px, py, sx[i], sy[i])
+        for j in range(i, min(n, i+window)):
+          delta = dist(px, py, ex[j], ey[j]) - d_in
+          if j < n-1:
+            delta += dist(sx[i], sy[i], sx[j+1], sy[j+1]) - dist(ex[j], ey[j], sx[j+1], sy[j+1])
+          if delta < -1e-9:
+            # reverse positions i..j, and swap start and end of each path there.
+            seq[i:j+1]  = seq[i:j+1][::-1]
+            flip[i:j+1] = [not f for f in flip[i:j+1][::-1]]
+            (sx[i:j+1], ex[i:j+1]) = (ex[i:j+1][::-1], sx[i:j+1][::-1])
+            (sy[i:j+1], ey[i:j+1]) = (ey[i:j+1][::-1], sy[i:j+1][::-1])
+            d_in = dist(px, py, sx[i], sy[i])
+            improved = True
+    return [paths[seq[k]][::-1] if flip[k] else paths[seq[k]] for k in range(n)]
+
+  def hilbert_index(self, order, x, y):
+    """
+    Position of the grid point (x, y) along a hilbert curve covering 2**order x 2**order cells.
+    x and y may be integers or numpy integer arrays.
+    """
+    n = 1 << order
+    d = 0
+    s = n >> 1
+    while s > 0:
+      rx = (x & s) > 0
+      ry = (y & s) > 0
+      if numpy is not None and isinstance(x, numpy.ndarray):
+        rx = rx.astype(numpy.int64)
+        ry = ry.astype(numpy.int64)
+        d = d + s * s * ((3 * rx) ^ ry)
+        mirror = (ry == 0) & (rx == 1)
+        x = numpy.where(mirror, n-1-x, x)
+        y = numpy.where(mirror, n-1-y, y)
+        (x, y) = (numpy.where(ry == 0, y, x), numpy.where(ry == 0, x, y))
+      else:
+        rx = int(rx)
+        ry = int(ry)
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+          if rx == 1:
+            x = n-1-x
+            y = n-1-y
+          (x, y) = (y, x)
+      s >>= 1
+    return d
+
+  def hilbert(self, paths, order=16):
+    """
+    Sort paths by the hilbert curve position of their start point.
+    Nearby paths are cut one after the other, without any search.
+    """
+    xs = [p[0][0] for p in paths]
+    ys = [p[0][1] for p in paths]
+    (x0, y0) = (min(xs), min(ys))
+    scale = ((1 << order) - 1) / max(max(xs)-x0, max(ys)-y0, 1e-3)
+    if numpy is not None:
+      gx = ((numpy.array(xs, dtype=numpy.float64) - x0) * scale).astype(numpy.int64)
+      gy = ((numpy.array(ys, dtype=numpy.float64) - y0) * scale).astype(numpy.int64)
+      d = self.hilbert_index(order, gx, gy)
+      return [paths[i] for i in numpy.argsort(d, kind='mergesort')]
+    d = [self.hilbert_index(order, int((xs[i]-x0)*scale), int((ys[i]-y0)*scale)) for i in range(len(paths))]
+    return [paths[i] for i in sorted(range(len(paths)), key=lambda i: d[i])]
+
+  def dedup(self, paths, eps=0.001):
+    """
+    Returns a new list of paths, where each piece of a line is cut only once.
+    Points are quantized to multiples of eps. Each segment is indexed by its line,
+    an exact integer tuple (dx, dy, offset) with dx, dy reduced by their gcd and
+    normalized in sign, so that both directions give the same key. Along that line,
+    the intervals already cut are kept sorted. A new segment only keeps the parts not
+    yet covered, in document order. Exact duplicates are the special case of full coverage.
+
+    The remaining segments of a path stay connected, a path is only split where something
+    was removed. A closed path with a gap is rotated to start after the gap.
+    Segments that are shorter than eps are kept. Collinear segments are only found, if their
+    quantized end points are exactly collinear, which is always true for horizontal and
+    vertical lines.
+    """
+    covered = {}        # line key -> sorted list of disjoint intervals [lo, hi], flattened.
+    result = []
+    for path in paths:
+      if len(path) < 2:
+        result.append(path)
+        continue
+      pieces = []       # output polylines of this path
+      cur = None
+      for k in range(len(path)-1):
+        (p0, p1) = (path[k], path[k+1])
+        for (a, b) in self.dedup_segment(covered, p0, p1, eps):
+          if a == 0.0:
+            pa = p0
+          else:
+            pa = [p0[0]+a*(p1[0]-p0[0]), p0[1]+a*(p1[1]-p0[1])]
+          if b == 1.0:
+            pb = p1
+          else:
+            pb = [p0[0]+b*(p1[0]-p0[0]), p0[1]+b*(p1[1]-p0[1])]
+          if cur is not None and cur[-1] is pa:
+            cur.append(pb)
+          else:
+            cur = [pa, pb]
+            pieces.append(cur)
+      if len(pieces) > 1 and pieces[0][0] is path[0] and pieces[-1][-1] is path[-1] and self.closed(path):
+        pieces[0] = pieces.pop() + pieces[0][1:]
+      result.extend(pieces)
+    return result
+
+  def dedup_segment(self, covered, p0, p1, eps):
+    """
+    Mark the segment p0 to p1 as cut. Returns the parts, that were not cut before,
+    as a list of (a, b) with 0 <= a < b <= 1, relative to the segment.
+    """
+    (x0, y0) = (int(round(p0[0]/eps)), int(round(p0[1]/eps)))
+    (x1, y1) = (int(round(p1[0]/eps)), int(round(p1[1]/eps)))
+    (dx, dy) = (x1-x0, y1-y0)
+    if dx == 0 and dy == 0: return [(0.0, 1.0)]
+    g = abs(gcd(dx, dy))
+    (dx, dy) = (dx//g, dy//g)
+    if dx < 0 or (dx == 0 and dy < 0): (dx, dy) = (-dx, -dy)
+    key = (dx, dy, dx*y0 - dy*x0)
+    # position along the line, in units of the reduced direction vector.
+    (t0, t1) = (dx*x0 + dy*y0, dx*x1 + dy*y1)
+    (lo, hi) = (min(t0, t1), max(t0, t1))
+    iv = covered.setdefault(key, [])
+    # iv is flattened [lo0, hi0, lo1, hi1, ...]. Find the intervals touching [lo, hi].
+    i = bisect.bisect_left(iv, lo)
+    if i % 2: i -= 1            # lo falls into the interval starting at iv[i-1].
+    j = bisect.bisect_right(iv, hi)
+    if j % 2: j += 1            # hi falls into the interval ending at iv[j].
+    free = []
+    pos = lo
+    for n in range(i, j, 2):
+      if iv[n] > pos: free.append((pos, iv[n]))
+      pos = max(pos, iv[n+1])
+    if pos < hi: free.append((pos, hi))
+    iv[i:j] = [min(lo, iv[i]) if i < j else lo, max(hi, iv[j-1]) if i < j else hi]
+    if free == [(lo, hi)]: return [(0.0, 1.0)]
+    # back to segment relative positions, in the direction of the segment.
+    span = float(t1 - t0)
+    parts = [((u-t0)/span, (v-t0)/span) for (u, v) in free]
+    if t1 < t0: parts = [(b, a) for (a, b) in reversed(parts)]
+    return [(max(a, 0.0), min(b, 1.0)) for (a, b) in parts]
+
+  def join(self, paths, eps=0.001, reverse=True):
+    """
+    Returns a new list of paths, where open paths are chained into longer paths,
+    if the end of one is within eps of the start of the other. With reverse=True,
+    paths may be reversed to make them fit. A chain stops when it becomes closed.
+    Closed paths and single points are kept as they are.
+    The end points are hashed into a grid of eps sized cells, so that each lookup
+    only needs to check 3x3 cells. Chains start in document order, and continue with
+    the first matching path in document order.
+    """
+    n = len(paths)
+    used = [False] * n
+    grid = {}
+
+    def cell(p):
+      return (int(p[0]//eps), int(p[1]//eps))
+
+    def find(p, end):
+      # an unused path with its end (0: start, -1: last point) near p. Returns (index, reversed) or None
+      (px, py) = (p[0], p[1])
+      (cx, cy) = (int(px//eps), int(py//eps))
+      best = None
+      for x in (cx-1, cx, cx+1):
+        for y in (cy-1, cy, cy+1):
+          entries = grid.get((x, y))
+          if not entries: continue
+          stale = False
+          for e in entries:
+            if used[e[0]]:
+              stale = True
+              continue
+            if e[1] != end and not reverse: continue
+            q = paths[e[0]][e[1]]
+            if abs(q[0]-px) <= eps and abs(q[1]-py) <= eps:
+              cand = (e[0], e[1] != end)
+              if best is None or cand < best: best = cand
+          if stale:
+            entries[:] = [e for e in entries if not used[e[0]]]
+      return best
+
+    def near(p, q):
+      return abs(p[0]-q[0]) <= eps and abs(p[1]-q[1]) <= eps
+
+    joinable = [len(path) > 1 and not self.closed(path, eps) for path in paths]
+    for j in range(n):
+      if joinable[j]:
+        for end in (0, -1):
+          c = cell(paths[j][end])
+          if c in grid:
+            grid[c].append((j, end))
+          else:
+            grid[c] = [(j, end)]
+
+    result = []
+    for j in range(n):
+      if used[j]: continue
+      used[j] = True
+      if not joinable[j]:
+        result.append(paths[j])
+        continue
+      tail = list(paths[j])
+      while not near(tail[0], tail[-1]):
+        e = find(tail[-1], 0)
+        if e is None: break
+        used[e[0]] = True
+        tail.extend(paths[e[0]][-2::-1] if e[1] else paths[e[0]][1:])
+      head = []         # pieces to prepend, in reverse order, each without its last point.
+      start = tail[0]
+      while not near(start, tail[-1]):
+        e = find(start, -1)
+        if e is None: break
+        used[e[0]] = True
+        piece = paths[e[0]][:0:-1] if e[1] else paths[e[0]][:-1]
+        head.append(piece)
+        start = piece[0]
+      result.append([p for piece in reversed(head) for p in piece] + tail)
+    return result
+
+  def simplify(self, paths, tolerance):
+    """
+    Returns a new list of paths, each simplified with simplify_path().
+    """
+    return [self.simplify_path(path, tolerance) for path in paths]
+
+  def simplify_path(self, path, tolerance):
+    """
+    Ramer-Douglas-Peucker decimation of a single path. tolerance is in mm.
+    The first and last point are always kept, closed paths stay closed.
+    Iterative with an explicit stack, so that paths of any length can be handled.
+    Long spans are searched with numpy, if available. The result is the same.
+    """
+    n = len(path)
+    if n < 3 or tolerance <= 0: return path
+    tol2 = tolerance * tolerance
+    keep = [False] * n
+    keep[0] = keep[n-1] = True
+    xy = None
+    if numpy is not None and n > 64:
+      xy = numpy.array(path, dtype=numpy.float64)
+    stack = [(0, n-1)]
+    while stack:
+      (a, b) = stack.pop()
+      if b - a < 2: continue
+      if xy is not None and b - a > 64:
+        (k, d2) = self.farthest_numpy(xy, a, b)
+      else:
+        (k, d2) = self.farthest(path, a, b)
+      if d2 > tol2:
+        keep[k] = True
+        stack.append((k, b))
+        stack.append((a, k))
+    return [path[k] for k in range(n) if keep[k]]
+
+  def farthest(self, path, a, b):
+    """
+    Returns (k, d2) of the point path[k], a < k < b, farthest from the segment path[a] to path[b],
+    and its squared distance. The first one wins in case of a tie.
+    """
+    (x1, y1) = (path[a][0], path[a][1])
+    dx = path[b][0] - x1
+    dy = path[b][1] - y1
+    l2 = dx*dx + dy*dy
+    (best_k, best_d2) = (a+1, -1.0)
+    for k in range(a+1, b):
+      (px, py) = (path[k][0], path[k][1])
+      if l2 == 0:
+        (ex, ey) = (px-x1, py-y1)
+      else:
+        t = ((px-x1)*dx + (py-y1)*dy) / l2
+        if t < 0:
+          t = 0.0
+        elif t > 1:
+          t = 1.0
+        (ex, ey) = (px-(x1+t*dx), py-(y1+t*dy))
+      d2 = ex*ex + ey*ey
+      if d2 > best_d2: (best_k, best_d2) = (k, d2)
+    return (best_k, best_d2)
+
+  def farthest_numpy(self, xy, a, b):
+    """
+    Same as farthest(), for a numpy array of points.
+    """
+    (x1, y1) = (xy[a,0], xy[a,1])
+    dx = xy[b,0] - x1
+    dy = xy[b,1] - y1
+    l2 = dx*dx + dy*dy
+    px = xy[a+1:b,0]
+    py = xy[a+1:b,1]
+    if l2 == 0:
+      ex = px-x1
+      ey = py-y1
+    else:
+      t = numpy.clip(((px-x1)*dx + (py-y1)*dy) / l2, 0.0, 1.0)
+      ex = px-(x1+t*dx)
+      ey = py-(y1+t*dy)
+    d2 = ex*ex + ey*ey
+    k = int(numpy.argmax(d2))
+    return (a+1+k, float(d2[k]))
 
 
 
 import json
+import re
 import inkex
 import gettext
 
@@ -1904,6 +4125,10 @@ Option parser example:
 
 
 
+        self.OptionParser.add_option(
+            "--color_layers", action="store", type="string", dest="color_layers", default="",
+            help="One layer per stroke color, instead of cut and mark: 'COLOR=SETTINGS;...'. COLOR is a color name, #RRGGBB, or any. SETTINGS is cut, mark, or speed,minpow,maxpow. With any, each remaining stroke color gets a layer of its own. Default: '' (off)")
+
         self.OptionParser.add_option(
             '--smoothness', dest='smoothness', type='float', default=float(0.2), action='store',
             help='Curve smoothing (less for more [0.0001 .. 5]). Default: 0.2')
@@ -1920,6 +4145,42 @@ Option parser example:
             '--maxwidth', dest='maxwidth', type='string', default='900', action='store',
             help='Width of laser area [mm]. Default: 900 mm')
 
+        self.OptionParser.add_option(
+            "--dedup", action="store", type="inkbool", dest="dedup", default=False,
+            help="Cut shared and overlapping line segments only once. Default: False")
+
+        self.OptionParser.add_option(
+            '--join', dest='join', type='float', default=float(0.0), action='store',
+            help='Join open paths whose ends are closer than this [mm]. 0 to disable. Default: 0.0')
+
+        self.OptionParser.add_option(
+            '--simplify', dest='simplify', type='float', default=float(0.0), action='store',
+            help='Drop vertices closer than this to a straight line [mm]. 0 to disable. Default: 0.0')
+
+        self.OptionParser.add_option(
+            "--path_order", action="store", type="string", dest="path_order", default="none",
+            help="Reorder paths to shorten travel moves: none, nn, 2opt, hilbert. Default: none")
+
+        self.OptionParser.add_option(
+            "--path_entry", action="store", type="inkbool", dest="path_entry", default=False,
+            help="Start closed paths at the nearest vertex, cut open paths in reverse if shorter. Default: False")
+
+        self.OptionParser.add_option(
+            "--clip_page", action="store", type="inkbool", dest="clip_page", default=False,
+            help="Ignore objects outside the page, unless they are selected. Default: False")
+
+        self.OptionParser.add_option(
+            "--processes", action="store", type="int", dest="processes", default=0,
+            help="Encode large jobs in parallel with this many worker processes. 0: no parallel encoding. Default: 0")
+
+        self.OptionParser.add_option(
+            "--flatten_cache", action="store", type="inkbool", dest="flatten_cache", default=False,
+            help="Keep flattened curves in ~/.cache/thunderlaser/flatten.bin, do not flatten unchanged objects again. Default: False")
+
+        self.OptionParser.add_option(
+            "--body_cache", action="store", type="inkbool", dest="body_cache", default=False,
+            help="Keep encoded layers in ~/.cache/thunderlaser, do not encode unchanged layers again. Default: False")
+
         self.OptionParser.add_option(
             "--bbox_only", action="store", type="inkbool", dest="bbox_only", default=False,
             help="Cut bounding box only. Default: False")
@@ -1941,13 +4202,14 @@ Option parser example:
           help='Just print version number ("'+self.__version__+'") and exit.')
 
 
-    def cut_options(self):
+    def cut_options(self, color=None):
         """
         returns None, if deactivated or
         returns [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"any" ] otherwise.
+        A color given here replaces the cut_color option.
         """
         group=self.options.cut_group.strip('"')         # passed into the option with surrounding double-quotes. yacc.
-        color = self.options.cut_color
+        if color is None: color = self.options.cut_color
         if color == 'none': return None
 
         parse_str = None
@@ -1964,13 +4226,14 @@ Option parser example:
           v = parse_str.split(',')
           return { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':group }
 
-    def mark_options(self):
+    def mark_options(self, color=None):
         """
         returns None, if self.options.mark_color=='none'
         returns [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"green" ] otherwise.
+        A color given here replaces the mark_color option.
         """
         group=self.options.mark_group.strip('"')
-        color = self.options.mark_color
+        if color is None: color = self.options.mark_color
         if color == 'none': return None
 
         parse_str = None
@@ -1985,6 +4248,27 @@ Option parser example:
           v = parse_str.split(',')
           return { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':group }
 
+    def color_layer_options(self):
+        """
+        Parses self.options.color_layers, e.g. "red=cut; blue=mark; #00ff80=100,10,20; any=cut"
+        returns a list of [ 'speed':1000, 'minpow':50, 'maxpow':70, 'color':"red" ], one per entry.
+        """
+        opts = []
+        for entry in self.options.color_layers.split(';'):
+          if entry.strip() == '': continue
+          try:
+            (color, settings) = [x.strip() for x in entry.split('=', 1)]
+          except ValueError:
+            raise ValueError("color_layers: COLOR=SETTINGS expected, got: "+entry)
+          if   settings == 'cut':  opt = self.cut_options(color=color)
+          elif settings == 'mark': opt = self.mark_options(color=color)
+          else:
+            v = settings.split(',')
+            opt = { 'speed':int(v[0]), 'minpow':int(v[1]), 'maxpow':int(v[2]), 'color':color, 'group':'color_layers' }
+          self.colorname2rgb(color)       # raises ValueError for unknown colors.
+          opts.append(opt)
+        return opts
+
     def colorname2rgb(self, name):
         if name is None:      return None
         if name == 'none':    return False
@@ -1997,13 +4281,16 @@ Option parser example:
         if name == 'cyan':    return [ 0, 255, 255]
         if name == 'magenta': return [ 255, 0, 255]
         if name == 'yellow':  return [ 255, 255, 0]
+        m = re.match('^#([0-9a-fA-F]{6})$', name)
+        if m: return [ int(m.group(1)[i:i+2], 16) for i in (0, 2, 4) ]
         raise ValueError("unknown colorname: "+name)
 
 
     def effect(self):
         smooth = float(self.options.smoothness) # svg.smoothness to be deprecated!
         pg = LinearPathGen(smoothness=smooth)
-        svg = InkSvg(document=self.document, pathgen=pg, smoothness=smooth)
+        cache = FlattenCache() if self.options.flatten_cache else None
+        svg = InkSvg(document=self.document, pathgen=pg, smoothness=smooth, cache=cache)
 
         # Viewbox handling
         svg.handleViewBox()
@@ -2012,16 +4299,35 @@ Option parser example:
             print("Version "+self.__version__)
             sys.exit(0)
 
-        cut_opt  = self.cut_options()
-        mark_opt = self.mark_options()
-        if cut_opt is None and mark_opt is None:
-          inkex.errormsg(gettext.gettext('ERROR: Enable Cut or Mark or both.'))
-          sys.exit(1)
-        if cut_opt is not None and mark_opt is not None and cut_opt['color'] == mark_opt['color']:
-          inkex.errormsg(gettext.gettext('ERROR: Choose different color settings for Cut and Mark. Both are "'+mark_opt['color']+'"'))
-          sys.exit(1)
-        mark_color = self.colorname2rgb(None if mark_opt is None else mark_opt['color'])
-        cut_color  = self.colorname2rgb(None if  cut_opt is None else  cut_opt['color'])
+        ## Layers are [name, paths, options, rgb]. Normally a mark layer and a cut layer,
+        ## or one layer per entry of the color_layers table.
+        color_layers = self.options.color_layers.strip() != ''
+        if color_layers:
+          cut_opt = mark_opt = None
+          layer_opts = self.color_layer_options()
+          if len(layer_opts) == 0:
+            inkex.errormsg(gettext.gettext('ERROR: color_layers has no entries.'))
+            sys.exit(1)
+        else:
+          cut_opt  = self.cut_options()
+          mark_opt = self.mark_options()
+          if cut_opt is None and mark_opt is None:
+            inkex.errormsg(gettext.gettext('ERROR: Enable Cut or Mark or both.'))
+            sys.exit(1)
+          if cut_opt is not None and mark_opt is not None and cut_opt['color'] == mark_opt['color']:
+            inkex.errormsg(gettext.gettext('ERROR: Choose different color settings for Cut and Mark. Both are "'+mark_opt['color']+'"'))
+            sys.exit(1)
+          layer_opts = [mark_opt, cut_opt]
+        layer_rgbs = [self.colorname2rgb(None if opt is None else opt['color']) for opt in layer_opts]
+
+        # Elements that go into no layer are not flattened. They still count for the origin.
+        # With clip_page, elements outside the page are dropped, if possible before they are flattened.
+        classify = svg.strokeColorClassifier(layer_rgbs)
+        svg.accept = lambda node: classify(node) is not None
+        if self.options.clip_page and not self.options.ids:
+            svg.clip = svg.pageBox()
+            if svg.clip is None:
+                inkex.errormsg(gettext.gettext('Warning: page size unknown. Objects outside the page are not ignored.'))
 
         # First traverse the document (or selected items), reducing
         # everything to line segments.  If working on a selection,
@@ -2036,6 +4342,10 @@ Option parser example:
         else:
             # Traverse the entire document building new, transformed paths
             svg.recursivelyTraverseSvg(self.document.getroot(), svg.docTransform)
+        if cache is not None:
+            cache.save()
+        if svg.clipped > 0:
+            inkex.errormsg(gettext.gettext('Warning: %d objects outside the page ignored.') % svg.clipped)
 
 
         ## First simplification: paths_tupls[]
@@ -2056,97 +4366,190 @@ Option parser example:
 
         ## Reposition the graphics, so that a corner or the center becomes origin [0,0]
         ## Convert from dots-per-inch to mm.
-        ## Separate into Cut and Mark lists based on element style.
+        ## Separate into layers based on element style.
         paths_list = []
-        paths_list_cut = []
-        paths_list_mark = []
         dpi2mm = 25.4 / svg.dpi
 
         (xoff,yoff) = (svg.xmin, svg.ymin)                      # top left corner is origin
         # (xoff,yoff) = (svg.xmax, svg.ymax)                      # bottom right corner is origin
         # (xoff,yoff) = ((svg.xmax+svg.xmin)/2.0, (svg.ymax+svg.ymin)/2.0)       # center is origin
 
-        for tupl in paths_tupls:
+        # One color lookup per element. Never both. Named colors win over 'any'.
+        # In color_layers mode, an 'any' entry gets one layer per distinct stroke color, in order of appearance.
+        entry_layers = []
+        for i in range(len(layer_opts)):
+                if color_layers and layer_rgbs[i] is True:
+                        entry_layers.append([])
+                elif color_layers:
+                        entry_layers.append([[layer_opts[i]['color'], [], layer_opts[i], layer_rgbs[i]]])
+                else:
+                        entry_layers.append([[['mark', 'cut'][i], [], layer_opts[i], layer_rgbs[i]]])
+        any_layers = {}
+        layer_ids = [classify(tupl[0]) for tupl in paths_tupls]
+        for (tupl, layer_id) in zip(paths_tupls, layer_ids):
                 (elem,paths) = tupl
+                lay = None
+                if layer_id is not None:
+                        if color_layers and layer_rgbs[layer_id] is True:
+                                c = svg.getStrokeColor(elem)
+                                lay = any_layers.get((layer_id, c))
+                                if lay is None:
+                                        name = 'none' if c is None else '#%02x%02x%02x' % c
+                                        lay = [name, [], layer_opts[layer_id], True if c is None else list(c)]
+                                        entry_layers[layer_id].append(lay)
+                                        any_layers[(layer_id, c)] = lay
+                        else:
+                                lay = entry_layers[layer_id][0]
                 for path in paths:
                         newpath = []
                         for point in path:
                                 newpath.append([(point[0]-xoff) * dpi2mm, (point[1]-yoff) * dpi2mm])
                         paths_list.append(newpath)
-                        is_mark = svg.matchStrokeColor(elem, mark_color)
-                        is_cut  = svg.matchStrokeColor(elem,  cut_color)
-                        if is_cut and is_mark:          # never both. Named colors win over 'any'
-                                if mark_opt['color'] == 'any':
-                                        is_mark = False
-                                else:                   # cut_opt['color'] == 'any'
-                                        is_cut = False
-                        if is_cut:  paths_list_cut.append(newpath)
-                        if is_mark: paths_list_mark.append(newpath)
+                        if lay is not None: lay[1].append(newpath)
         paths_tupls = None      # save some memory
-        bbox = [[(svg.xmin-xoff)*dpi2mm, (svg.ymin-yoff)*dpi2mm], [(svg.xmax-xoff)*dpi2mm, (svg.ymax-yoff)*dpi2mm]]
+        layers = [lay for ll in entry_layers for lay in ll]
+        # The reports below are keyed by layer name. A color of an 'any' entry can have the same
+        # name as an explicit '#rrggbb' entry, and an entry can be repeated. Those get their layer index appended.
+        names = [lay[0] for lay in layers]
+        for i in range(len(layers)):
+                if names.count(names[i]) > 1:
+                        layers[i][0] = '%s/%d' % (names[i], i)
+        bbox =[[(svg.xmin-xoff)*dpi2mm, (svg.ymin-yoff)*dpi2mm], [(svg.xmax-xoff)*dpi2mm, (svg.ymax-yoff)*dpi2mm]]
 
         rd = Ruida()
         # bbox = rd.boundingbox(paths_list)     # same as above.
 
+        ## Remove segments that are cut twice, e.g. shared edges of tiles. Measured as cut distance with rd.odometer().
+        deduped = {}
+        if self.options.dedup:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.dedup(lay[1])
+                        deduped[lay[0]] = [rd.odometer(lay[1])[0], rd.odometer(new)[0]]
+                        lay[1] = new
+
+        ## Join paths that continue where another one ends. This saves a travel move and a laser on/off each.
+        joined = {}
+        if self.options.join > 0:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.join(lay[1], eps=self.options.join)
+                        joined[lay[0]] = [len(lay[1]), len(new)]
+                        lay[1] = new
+
+        ## Simplify paths, so that fewer and longer segments are sent to the machine.
+        ## The vertex count is reported, the byte count only in dummy mode, as it needs an extra encoding pass.
+        simplified = {}
+        if self.options.simplify > 0:
+                po = PathOpt()
+                for lay in layers:
+                        new = po.simplify(lay[1], self.options.simplify)
+                        simplified[lay[0]] = { 'vertices': [sum(map(len, lay[1])), sum(map(len, new))] }
+                        if self.options.dummy:
+                                simplified[lay[0]]['bytes'] = [len(rd.body_paths(lay[1])), len(rd.body_paths(new))]
+                        lay[1] = new
+
+        ## Reorder the paths of each layer to shorten travel moves. Layers are done in order, mark first, then cut.
+        ## Optionally also rotate closed paths and reverse open paths to enter them at the nearest point.
+        ## The travel distance before and after is measured with rd.odometer().
+        travel = {}
+        if self.options.path_order != 'none' or self.options.path_entry:
+                po = PathOpt(method=self.options.path_order, entry=self.options.path_entry)
+                xy = [0,0]
+                for lay in layers:
+                        before = rd.odometer(lay[1], init=xy)[1]
+                        lay[1] = po.order(lay[1], init=xy)
+                        travel[lay[0]] = [before, rd.odometer(lay[1], init=xy)[1]]
+                        for path in lay[1]:
+                                if len(path): xy = path[-1]
+
         if self.options.bbox_only:
                 paths_list = [[ [bbox[0][0],bbox[0][1]], [bbox[1][0],bbox[0][1]], [bbox[1][0],bbox[1][1]],
                                 [bbox[0][0],bbox[1][1]], [bbox[0][0],bbox[0][1]] ]]
-                paths_list_cut = paths_list
-                paths_list_mark = paths_list
-                if cut_opt['color']  == 'any' or mark_opt is None: paths_list_mark = []
-                if mark_opt['color'] == 'any' or  cut_opt is None: paths_list_cut  = []      # once is enough.
+                if color_layers:
+                        nonempty = [lay for lay in layers if len(lay[1]) > 0]
+                        for lay in layers: lay[1] = []
+                        if len(nonempty): nonempty[-1][1] = paths_list          # once is enough.
+                else:
+                        (mark, cut) = layers
+                        mark[1] = paths_list
+                        cut[1] = paths_list
+                        if mark_opt is None or (cut_opt is not None and cut_opt['color'] == 'any'): mark[1] = []
+                        if cut_opt is None or (mark_opt is not None and mark_opt['color'] == 'any'): cut[1] = []     # once is enough.
         if self.options.move_only:
-                paths_list      = rd.paths2moves(paths_list)
-                paths_list_cut  = rd.paths2moves(paths_list_cut)
-                paths_list_mark = rd.paths2moves(paths_list_mark)
+                paths_list = rd.paths2moves(paths_list)
+                for lay in layers:
+                        lay[1] = rd.paths2moves(lay[1])
+
+        # Layers that go to the machine, in this order.
+        active = [lay for lay in layers if lay[2] is not None and len(lay[1]) > 0]
 
         if self.options.dummy:
-                with open('/tmp/thunderlaser.json', 'w') as fd:
-                        json.dump({
+                est_layers = []
+                for lay in active:
+                        est_layers.append(RuidaLayer(paths=lay[1], speed=lay[2]['speed']))
+                estimate = rd.estimate(est_layers)
+                estimate['names'] = [lay[0] for lay in active]          # same order as estimate['layers']
+                result = {
                                 'paths_bbox': bbox,
                                 'cut_opt': cut_opt, 'mark_opt': mark_opt,
                                 'paths_unit': 'mm', 'svg_resolution': svg.dpi, 'svg_resolution_unit': 'dpi',
                                 'freq1': self.options.freq1, 'freq1_unit': 'kHz',
                                 'paths': paths_list,
-                                'cut':  { 'paths':paths_list_cut,  'color': cut_color  },
-                                'mark': { 'paths':paths_list_mark, 'color': mark_color },
-                                }, fd, indent=4, sort_keys=True, encoding='utf-8')
+                                'path_order': self.options.path_order, 'path_entry': self.options.path_entry,
+                                'travel': travel, 'travel_unit': 'mm',
+                                'estimate': estimate, 'estimate_unit': 'sec',
+                                'dedup': self.options.dedup, 'deduped': deduped,
+                                'join': self.options.join, 'joined': joined,
+                                'simplify': self.options.simplify, 'simplified': simplified,
+                                }
+                if color_layers:
+                        result['color_layers'] = self.options.color_layers
+                        result['layers'] = [{ 'name':lay[0], 'paths':lay[1], 'opt':lay[2], 'color':lay[3] } for lay in layers]
+                else:
+                        result['cut']  = { 'paths':layers[1][1], 'color':layers[1][3] }
+                        result['mark'] = { 'paths':layers[0][1], 'color':layers[0][3] }
+                with open('/tmp/thunderlaser.json', 'w') as fd:
+                        json.dump(result, fd, indent=4, sort_keys=True, encoding='utf-8')
                 print("/tmp/thunderlaser.json written.", file=sys.stderr)
+                print("estimated time: %.1f sec" % estimate['total'], file=sys.stderr)
+                print("%d objects not flattened (no layer), %d outside the page" % (svg.rejected, svg.clipped), file=sys.stderr)
+                if cache is not None:
+                        print("flatten cache: %d hits, %d misses" % (cache.hits, cache.misses), file=sys.stderr)
+                for name in sorted(deduped.keys()):
+                        print("%s: cut %.1f mm -> %.1f mm (dedup)" % (name, deduped[name][0], deduped[name][1]), file=sys.stderr)
+                for name in sorted(joined.keys()):
+                        print("%s: %d -> %d paths (join=%g mm)" % (name, joined[name][0], joined[name][1], self.options.join), file=sys.stderr)
+                for name in sorted(simplified.keys()):
+                        s = simplified[name]
+                        print("%s: %d -> %d vertices, %d -> %d bytes (simplify=%g mm)" % (name, s['vertices'][0], s['vertices'][1], s['bytes'][0], s['bytes'][1], self.options.simplify), file=sys.stderr)
+                for name in sorted(travel.keys()):
+                        print("%s: travel %.1f mm -> %.1f mm (path_order=%s, path_entry=%s)" % (name, travel[name][0], travel[name][1], self.options.path_order, self.options.path_entry), file=sys.stderr)
         else:
-                if len(paths_list_cut) > 0 and len(paths_list_mark) > 0:
-                  nlay=2
-                else:
-                  nlay=1
+                if len(active) == 0:
+                        for lay in layers:
+                                if lay[2] is not None and lay[2]['color'] != 'any':
+                                        what = 'layer' if color_layers else lay[0]
+                                        inkex.errormsg(gettext.gettext('ERROR: '+what+' line color "'+lay[2]['color']+'": nothing found.'))
+                                        sys.exit(0)
+                        inkex.errormsg(gettext.gettext('ERROR: nothing found.'))
+                        sys.exit(0)
+                nlay = len(active)
 
                 if bbox[0][0] < 0 or bbox[0][1] < 0:
                         inkex.errormsg(gettext.gettext('Warning: negative coordinates not implemented in class Ruida(), truncating at 0'))
                 # rd.set(globalbbox=bbox)       # Not needed. Even slightly wrong.
                 rd.set(nlayers=nlay)
+                rd.set(processes=self.options.processes)
+                if self.options.body_cache:
+                        rd.set(cache=RuidaCache())
 
-                l=0
-                if mark_opt is not None:
-                  if len(paths_list_mark) > 0:
-                    cc = mark_color if type(mark_color) == list else [128,0,64]
-                    rd.set(layer=l, speed=mark_opt['speed'], color=cc)
-                    rd.set(layer=l, power=[mark_opt['minpow'], mark_opt['maxpow']])
-                    rd.set(layer=l, paths=paths_list_mark)
-                    l += 1
-                  else:
-                    if mark_opt['color'] != 'any' and len(paths_list_cut) == 0:
-                      inkex.errormsg(gettext.gettext('ERROR: mark line color "'+mark_opt['color']+'": nothing found.'))
-                      sys.exit(0)
-
-                if cut_opt is not None:
-                  if len(paths_list_cut) > 0:
-                    cc = cut_color if type(cut_color) == list else [128,0,64]
-                    rd.set(layer=l, speed=cut_opt['speed'], color=cc)
-                    rd.set(layer=l, power=[cut_opt['minpow'], cut_opt['maxpow']])
-                    rd.set(layer=l, paths=paths_list_cut)
-                    l += 1
-                  else:
-                    if cut_opt['color'] != 'any' and len(paths_list_mark) == 0:
-                      inkex.errormsg(gettext.gettext('ERROR: cut line color "'+cut_opt['color']+'": nothing found.'))
-                      sys.exit(0)
+                for l in range(len(active)):
+                        (name, paths, opt, rgb) = active[l]
+                        cc = rgb if type(rgb) == list else [128,0,64]
+                        rd.set(layer=l, speed=opt['speed'], color=cc)
+                        rd.set(layer=l, power=[opt['minpow'], opt['maxpow']])
+                        rd.set(layer=l, paths=paths)
 
                 device_used = None
                 for device in self.options.devicelist.split(','):
@@ -2156,7 +4559,7 @@ Option parser example:
                     except:
                         pass
                     if fd is not None:
-                        rd.write(fd)
+                        rd.write(fd, chunksize=1<<20)   # stream in chunks of 1MB, do not hold the job in memory.
                         # print(device+" written.", file=sys.stderr)
                         device_used = device
                         break